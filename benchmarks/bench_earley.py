@@ -0,0 +1,183 @@
+"""
+Measures the Earley parser, using the Python 3 grammar on some of Lark's own sources,
+Lark's own grammar with the dynamic lexer, long string and comment tokens with the dynamic lexer,
+and the time it takes to run the Earley tests.
+
+Also counts the Earley items with and without filtering the predictions by the lookahead,
+measures how parsing a right-recursive list scales with its length, which should be linear,
+and measures the conversion of an ambiguous forest to a tree, and its transformation with ForestTransformer.
+
+Usage: python -m benchmarks.bench_earley
+"""
+from __future__ import print_function
+
+import os
+import time
+import unittest
+from functools import partial
+
+from lark import Lark
+from lark.indenter import Indenter
+
+_dir = os.path.dirname(__file__)
+_root = os.path.join(_dir, os.path.pardir)
+
+
+class PythonIndenter(Indenter):
+    NL_type = '_NEWLINE'
+    OPEN_PAREN_types = ['LPAR', 'LSQB', 'LBRACE']
+    CLOSE_PAREN_types = ['RPAR', 'RSQB', 'RBRACE']
+    INDENT_type = '_INDENT'
+    DEDENT_type = '_DEDENT'
+    tab_len = 8
+
+
+def best_of(n, f, *args):
+    best = None
+    for _ in range(n):
+        start = time.time()
+        f(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_earley_tests():
+    from tests import test_parser
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite(loader.loadTestsFromTestCase(getattr(test_parser, name))
+                               for name in dir(test_parser) if name.startswith('Test') and 'Earley' in name)
+    result = unittest.TextTestRunner(stream=open(os.devnull, 'w')).run(suite)
+    assert result.wasSuccessful()
+
+
+LONG_TOKENS_GRAMMAR = r"""
+start: item+
+item: STRING | COMMENT | NAME
+STRING: /"[^"]*"/
+COMMENT: /#[^\n]*/
+NAME: /\w+/
+%ignore /\s+/
+"""
+
+
+AMBIGUOUS_GRAMMAR = """
+start: e
+e: e "+" e | e "*" e | f
+f.2: NUMBER
+%import common.NUMBER
+"""
+
+
+RIGHT_RECURSIVE_GRAMMAR = """
+start: list
+list: item "," list | item
+item: "a"
+"""
+
+
+def count_items(make_parser, text):
+    "Returns the number of Earley items created by the parse, without and with filtering by the lookahead"
+    counts = []
+    for lookahead in (False, True):
+        parser = make_parser(profile=True)
+        if not lookahead:
+            parser.parser.parser.filter_predictions = False
+            parser.parser.parser.ignore_first_chars = None
+        parser.parse(text)
+        counts.append(parser.profiler.counters['earley_items'])
+    return counts
+
+
+def peak_items(make_parser, text):
+    "Returns the peak number of Earley items kept during the parse, without and with low_memory"
+    peaks = []
+    for low_memory in (False, True):
+        parser = make_parser(profile=True, low_memory=low_memory)
+        parser.parse(text)
+        peaks.append(parser.profiler.counters['earley_items_peak'])
+    return peaks
+
+
+def forest_to_tree_time(parser, text):
+    "Returns the time it took to convert the parse forest to a tree, best of 3"
+    best = None
+    for _ in range(3):
+        parser.profiler.reset()
+        parser.parse(text)
+        elapsed = parser.profiler.total_time['forest_to_tree']
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    python_parser = Lark.open(os.path.join(_root, 'examples', 'python3.lark'), parser='earley', lexer='standard',
+                              postlex=PythonIndenter(), start='file_input')
+
+    cases = []
+    for name in ('grammar.py', 'indenter.py', 'tree.py'):
+        with open(os.path.join(_root, 'lark', name)) as f:
+            cases.append(('python3.lark: lark/%s' % name, python_parser.parse, f.read()))
+    with open(os.path.join(_root, 'examples', 'python3.lark')) as f:
+        lark_parser = Lark.open(os.path.join(_root, 'examples', 'lark.lark'), parser='earley', lexer='dynamic')
+        cases.append(('lark.lark: python3.lark, dynamic', lark_parser.parse, f.read()))
+    long_tokens_parser = Lark(LONG_TOKENS_GRAMMAR, parser='earley', lexer='dynamic')
+    long_tokens_text = ''.join('name "%s" # %s\n' % ('x' * 2000, 'c' * 2000) for _ in range(50))
+    cases.append(('long tokens, dynamic', long_tokens_parser.parse, long_tokens_text))
+    cases.append(('Earley tests', run_earley_tests))
+
+    print('%-32s %10s' % ('', 'time (s)'))
+    for case in cases:
+        print('%-32s %10.4f' % (case[0], best_of(3, *case[1:])))
+
+    with open(os.path.join(_root, 'lark', 'tree.py')) as f:
+        python_text = f.read()
+    with open(os.path.join(_root, 'examples', 'python3.lark')) as f:
+        grammar_text = f.read()
+    item_cases = [
+        ('python3.lark: lark/tree.py', partial(Lark.open, os.path.join(_root, 'examples', 'python3.lark'), parser='earley',
+                                               lexer='standard', postlex=PythonIndenter(), start='file_input'), python_text),
+    ]
+    for lexer in ('standard', 'dynamic'):
+        item_cases.append(('lark.lark: python3.lark (%s)' % lexer,
+                           partial(Lark.open, os.path.join(_root, 'examples', 'lark.lark'), parser='earley', lexer=lexer), grammar_text))
+
+    print()
+    print('%-32s %10s %10s' % ('earley items', 'all', 'lookahead'))
+    for name, make_parser, text in item_cases:
+        print('%-32s %10d %10d' % ((name,) + tuple(count_items(make_parser, text))))
+
+    print()
+    print('%-32s %10s %10s' % ('peak earley items', 'all', 'low_memory'))
+    for name, make_parser, text in item_cases:
+        print('%-32s %10d %10d' % ((name,) + tuple(peak_items(make_parser, text))))
+
+    print()
+    print('%-32s %10s %10s' % ('right-recursive list', 'time (s)', 'us/item'))
+    for lexer in ('standard', 'dynamic'):
+        parser = Lark(RIGHT_RECURSIVE_GRAMMAR, parser='earley', lexer=lexer)
+        for n in (1000, 2000, 4000, 8000):
+            elapsed = best_of(3, parser.parse, ','.join(['a'] * n))
+            print('%-32s %10.4f %10.1f' % ('lexer=%s, n=%d' % (lexer, n), elapsed, elapsed / n * 1e6))
+
+    print()
+    print('%-32s %10s' % ('ambiguous forest to tree', 'time (s)'))
+    for ambiguity in ('resolve', 'explicit'):
+        parser = Lark(AMBIGUOUS_GRAMMAR, parser='earley', ambiguity=ambiguity, profile=True)
+        for n in (3, 4, 5):
+            print('%-32s %10.4f' % ('%s, n=%d' % (ambiguity, n), forest_to_tree_time(parser, '+'.join(['1*2'] * n))))
+    parser = Lark(AMBIGUOUS_GRAMMAR, parser='earley')
+    for n in (3, 4, 5):
+        forest = parser.parse_forest('+'.join(['1*2'] * n))
+        print('%-32s %10.4f' % ('forest transform, n=%d' % n, best_of(3, forest.transform)))
+
+    print()
+    print('%-32s %10s' % ('ambiguous parse', 'time (s)'))
+    for beam_width in (None, 2, 1):
+        parser = Lark(AMBIGUOUS_GRAMMAR, parser='earley', beam_width=beam_width)
+        for n in (10, 20):
+            print('%-32s %10.4f' % ('beam_width=%s, n=%d' % (beam_width, n), best_of(3, parser.parse, '+'.join(['1*2'] * n))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares the interpreted LALR parser with the one generated by
+lark.tools.standalone --compile, using the Python 3 grammar on Lark's own sources.
+
+Usage: python -m benchmarks.bench_lalr_compiled
+"""
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import time
+import types
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from lark.tools import standalone
+
+_dir = os.path.dirname(__file__)
+_root = os.path.join(_dir, os.path.pardir)
+
+
+def create_standalone(grammar_filename, start, compile):
+    code_buf = StringIO()
+    temp = sys.stdout
+    sys.stdout = code_buf
+    try:
+        with open(grammar_filename) as f:
+            standalone.main(f, start, compile)
+    finally:
+        sys.stdout = temp
+
+    module = types.ModuleType('compiled' if compile else 'interpreted')
+    exec(code_buf.getvalue(), module.__dict__)
+    return module
+
+
+def make_indenter(module):
+    class PythonIndenter(module.Indenter):
+        NL_type = '_NEWLINE'
+        OPEN_PAREN_types = ['LPAR', 'LSQB', 'LBRACE']
+        CLOSE_PAREN_types = ['RPAR', 'RSQB', 'RBRACE']
+        INDENT_type = '_INDENT'
+        DEDENT_type = '_DEDENT'
+        tab_len = 8
+    return PythonIndenter()
+
+
+def record_tokens(parser, text):
+    "Parse the text once, and return the tokens that reached the LALR parser"
+    tokens = []
+    lalr = parser.parser.parser.parser
+    parse = lalr.parse
+    def recording_parse(seq, start, set_state=None):
+        def record():
+            for t in seq:
+                tokens.append(t)
+                yield t
+        return parse(record(), start, set_state)
+    lalr.parse = recording_parse
+    try:
+        parser.parse(text)
+    finally:
+        del lalr.parse
+    return tokens
+
+
+def best_of(n, f, *args):
+    best = None
+    for _ in range(n):
+        start = time.time()
+        f(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    grammar_filename = os.path.join(_root, 'examples', 'python3.lark')
+    sources = sorted(glob.glob(os.path.join(_root, 'lark', '*.py')))
+    text = ''.join(open(fn).read() for fn in sources) + '\n'
+
+    parsers = []
+    for compile in (False, True):
+        module = create_standalone(grammar_filename, 'file_input', compile)
+        parsers.append(('compiled' if compile else 'interpreted', module.Lark_StandAlone(postlex=make_indenter(module))))
+
+    (_, interpreted), (_, compiled) = parsers
+    assert interpreted.parse(text) == compiled.parse(text)
+
+    tokens = record_tokens(interpreted, text)
+    print('Parsing %d lines (%d tokens)' % (text.count('\n'), len(tokens)))
+    print('%-12s %12s %12s' % ('', 'parser (s)', 'total (s)'))
+    for name, parser in parsers:
+        lalr = parser.parser.parser.parser
+        parse_time = best_of(5, lalr.parse, tokens, 'file_input')
+        total_time = best_of(3, parser.parse, text)
+        print('%-12s %12.4f %12.4f' % (name, parse_time, total_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
 from .utils import Serialize
 from .lexer import TerminalDef
+from .exceptions import ParseBudgetExceeded
 
 ###{standalone
+try:
+    from time import perf_counter as _timer
+except ImportError:     # Python 2
+    from time import time as _timer
 
 class LexerConf(Serialize):
     __serialize_fields__ = 'tokens', 'ignore'
@@ -16,6 +21,63 @@ class LexerConf(Serialize):
     def _deserialize(self):
         self.callbacks = {} # TODO
 
+
+class ParseBudget(object):
+    """Counts the resources used by a single parse, and aborts it with ParseBudgetExceeded as soon as
+    one of them goes over its limit (None means unlimited).
+
+    max_tokens limits the tokens read from the lexer, max_items the Earley items, max_forest_nodes the packed
+    nodes of the Earley forest, and timeout the time of the parse, in seconds. Each is checked after every
+    token or Earley step, so a parse may go slightly over its limits before it's aborted."""
+    def __init__(self, max_tokens=None, max_items=None, max_forest_nodes=None, timeout=None):
+        self.max_tokens = max_tokens
+        self.max_items = max_items
+        self.max_forest_nodes = max_forest_nodes
+        self.timeout = timeout
+
+        self.start_time = _timer()
+        self.tokens = 0
+        self.earley_items = 0
+        self.forest_nodes = 0
+        self.pos = 0
+
+    def stats(self):
+        """Returns the progress of the parse so far, as a dict: the tokens read, the Earley items and packed nodes
+        created, pos (the index of the last Earley step, in tokens, or in characters with the dynamic lexers),
+        and the seconds elapsed."""
+        return {'tokens': self.tokens, 'earley_items': self.earley_items, 'forest_nodes': self.forest_nodes,
+                'pos': self.pos, 'elapsed': round(_timer() - self.start_time, 6)}
+
+    def _exceeded(self, option, limit):
+        raise ParseBudgetExceeded(option, limit, self.stats())
+
+    def check_time(self):
+        if self.timeout is not None and _timer() - self.start_time > self.timeout:
+            self._exceeded('timeout', self.timeout)
+
+    def count_tokens(self, stream):
+        "Counts the tokens of the stream as they're read, and checks the time after each one"
+        max_tokens = self.max_tokens
+        timeout = self.timeout
+        for token in stream:
+            self.tokens += 1
+            if max_tokens is not None and self.tokens > max_tokens:
+                self._exceeded('max_tokens', max_tokens)
+            if timeout is not None:
+                self.check_time()
+            yield token
+
+    def earley_step(self, pos, items, forest_nodes):
+        "Adds the items and packed nodes created by an Earley step at pos, and checks the limits"
+        self.pos = pos
+        self.earley_items += items
+        self.forest_nodes += forest_nodes
+        if self.max_items is not None and self.earley_items > self.max_items:
+            self._exceeded('max_items', self.max_items)
+        if self.max_forest_nodes is not None and self.forest_nodes > self.max_forest_nodes:
+            self._exceeded('max_forest_nodes', self.max_forest_nodes)
+        self.check_time()
+
 ###}
 
 class ParserConf:
@@ -2,6 +2,17 @@ from .utils import STRING_TYPE
 
 ###{standalone
 class LarkError(Exception):
+    def __reduce__(self):
+        # Most subclasses take different arguments than self.args, so they're unpickled without calling __init__
+        return _unpickle_error, (type(self), self.args, self.__dict__)
+
+def _unpickle_error(cls, args, attrs):
+    e = cls.__new__(cls)
+    e.args = args
+    e.__dict__.update(attrs)
+    return e
+
+class ConfigurationError(LarkError, ValueError):
     pass
 
 class GrammarError(LarkError):
@@ -13,6 +24,21 @@ class ParseError(LarkError):
 class LexError(LarkError):
     pass
 
+class ParseBudgetExceeded(LarkError):
+    """Raised when a parse goes over one of the limits set by the options max_tokens, max_items,
+    max_forest_nodes and timeout.
+
+    option is the name of the limit that was exceeded, and stats is the progress of the parse
+    when it was aborted (see ParseBudget.stats)."""
+    def __init__(self, option, limit, stats):
+        self.option = option
+        self.limit = limit
+        self.stats = stats
+
+        message = "Parse aborted, exceeded %s=%r (%s)" % (option, limit, ', '.join('%s=%s' % (k, v) for k, v in sorted(stats.items())))
+        super(ParseBudgetExceeded, self).__init__(message)
+
+
 class UnexpectedEOF(ParseError):
     def __init__(self, expected):
         self.expected = expected
@@ -96,6 +122,16 @@ class UnexpectedToken(ParseError, UnexpectedInput):
 
         super(UnexpectedToken, self).__init__(message)
 
+class WorkerError(LarkError):
+    """Stands for an exception that was raised in a parse_many worker, but couldn't be pickled back from it.
+
+    type_name is the name of its type, and traceback is its traceback in the worker, formatted."""
+    def __init__(self, type_name, message, traceback):
+        self.type_name = type_name
+        self.traceback = traceback
+
+        super(WorkerError, self).__init__('%s: %s' % (type_name, message))
+
 class VisitError(LarkError):
     def __init__(self, tree, orig_exc):
         self.tree = tree
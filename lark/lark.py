@@ -1,18 +1,25 @@
 from __future__ import absolute_import
 
 import os
+import stat
+import sys
 import time
+import logging
+import hashlib
+import pickle
+import tempfile
+import traceback
 from collections import defaultdict
 from io import open
-
 from .utils import STRING_TYPE, Serialize, SerializeMemoizer
 from .load_grammar import load_grammar
 from .tree import Tree
-from .common import LexerConf, ParserConf
+from .common import LexerConf, ParserConf, _timer
+from .exceptions import ConfigurationError, WorkerError
 
-from .lexer import Lexer, TraditionalLexer
+from .lexer import Lexer, TraditionalLexer, TerminalDef
 from .parse_tree_builder import ParseTreeBuilder
-from .parser_frontends import get_frontend
+from .parser_frontends import get_frontend, WithLexer
 from .grammar import Rule
 
 ###{standalone
@@ -37,18 +44,31 @@ class LarkOptions(Serialize):
             "resolve": The parser will automatically choose the simplest derivation
                        (it chooses consistently: greedy for tokens, non-greedy for rules)
             "explicit": The parser will return all derivations wrapped in "_ambig" tree nodes (i.e. a forest).
+        beam_width - Experimental. With parser="earley", keeps at most this many derivations of each symbol while parsing,
+                     preferring higher priorities and then the earlier rules, so that the forest stays bounded
+                     on highly ambiguous input. The priorities are only estimated, so the resulting tree may differ
+                     from the one that would be chosen without it. (Default: None, keeps all the derivations)
 
-        transformer - Applies the transformer to every parse tree
+        transformer - Applies the transformer to every parse tree (with parser="earley", only if ambiguity="resolve")
         debug - Affects verbosity (default: False)
         keep_all_tokens - Don't automagically remove "punctuation" tokens (default: False)
-        cache_grammar - Cache the Lark grammar (Default: False)
+        cache_grammar - Cache the compiled parser on disk, and load it from there on subsequent runs.
+                        Only works with parser="lalr", and not with edit_terminals. Either True (use a directory
+                        of the current user in the system's temp directory), or a path to the cache directory (Default: False)
         postlex - Lexer post-processing (Default: None) Only works with the standard and contextual lexers.
         start - The start symbol, either a string, or a list of strings for multiple possible starts (Default: "start")
-        profile - Measure run-time usage in Lark. Read results from the profiler proprety (Default: False)
+        profile - Measure run-time usage in Lark. Read results from the profiler property (Default: False)
         priority - How priorities should be evaluated - auto, none, normal, invert (Default: auto)
         propagate_positions - Propagates [line, column, end_line, end_column] attributes into all tree branches.
         lexer_callbacks - Dictionary of callbacks for the lexer. May alter tokens during lexing. Use with caution.
         maybe_placeholders - Experimental feature. Instead of omitting optional rules (i.e. rule?), replace them with None
+        max_tokens - Aborts the parse with ParseBudgetExceeded after this many tokens (not with the dynamic lexers)
+        max_items - Aborts the parse with ParseBudgetExceeded after this many Earley items (only with parser="earley")
+        max_forest_nodes - Aborts the parse with ParseBudgetExceeded after this many nodes are added to the
+                           parse forest (only with parser="earley")
+        timeout - Aborts the parse with ParseBudgetExceeded after this many seconds (not with parser="cyk")
+        low_memory - With parser="earley", drops the Earley sets that the parse can't refer to anymore, as it goes.
+                     Lowers the peak memory on long inputs, at a small cost in time (Default: False)
     """
     if __doc__:
         __doc__ += OPTIONS_DOC
@@ -70,6 +90,12 @@ class LarkOptions(Serialize):
         'lexer_callbacks': {},
         'maybe_placeholders': False,
         'edit_terminals': None,
+        'beam_width': None,
+        'max_tokens': None,
+        'max_items': None,
+        'max_forest_nodes': None,
+        'timeout': None,
+        'low_memory': False,
     }
 
     def __init__(self, options_dict):
@@ -79,7 +105,7 @@ class LarkOptions(Serialize):
         for name, default in self._defaults.items():
             if name in o:
                 value = o.pop(name)
-                if isinstance(default, bool):
+                if isinstance(default, bool) and name != 'cache_grammar':
                     value = bool(value)
             else:
                 value = default
@@ -93,9 +119,20 @@ class LarkOptions(Serialize):
 
         assert self.parser in ('earley', 'lalr', 'cyk', None)
 
-        if self.parser == 'earley' and self.transformer:
-            raise ValueError('Cannot specify an embedded transformer when using the Earley algorithm.'
-                             'Please use your transformer on the resulting parse tree, or use a different algorithm (i.e. LALR)')
+        if self.parser == 'earley' and self.transformer and self.ambiguity == 'explicit':
+            raise ValueError("Cannot specify an embedded transformer when using the Earley algorithm with ambiguity='explicit'. "
+                             'Please use your transformer on the resulting parse tree, or use Lark.parse_forest(text).transform(transformer)')
+
+        if self.beam_width is not None:
+            if self.parser != 'earley':
+                raise ValueError("beam_width is only supported with parser='earley'")
+            if self.beam_width < 1:
+                raise ValueError("beam_width must be at least 1, got %r" % self.beam_width)
+
+        if self.parser != 'earley' and (self.max_items is not None or self.max_forest_nodes is not None):
+            raise ValueError("max_items and max_forest_nodes are only supported with parser='earley'")
+        if self.parser == 'cyk' and (self.max_tokens is not None or self.timeout is not None):
+            raise ValueError("max_tokens and timeout aren't supported with parser='cyk'")
 
         if o:
             raise ValueError("Unknown options: %s" % o.keys())
@@ -115,19 +152,32 @@ class LarkOptions(Serialize):
 
 
 class Profiler:
+    """Measures the time spent in each stage of parsing, and counts parser events.
+
+    total_time maps each section (lexer, postlex, parser, tree_builder, transformer, ...)
+    to the time spent exclusively inside it, in seconds.
+    counters maps each event (tokens, shifts, reduces, earley_items) to its count, and earley_items_peak
+    to the largest number of Earley items that were kept at once (see the low_memory option).
+    """
     def __init__(self):
-        self.total_time = defaultdict(float)
         self.cur_section = '__init__'
-        self.last_enter_time = time.time()
+        self.reset()
+
+    def reset(self):
+        self.total_time = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.last_enter_time = _timer()
 
     def enter_section(self, name):
-        cur_time = time.time()
+        cur_time = _timer()
         self.total_time[self.cur_section] += cur_time - self.last_enter_time
         self.last_enter_time = cur_time
         self.cur_section = name
 
-    def make_wrapper(self, name, f):
+    def make_wrapper(self, name, f, counter=None):
         def wrapper(*args, **kwargs):
+            if counter:
+                self.counters[counter] += 1
             last_section = self.cur_section
             self.enter_section(name)
             try:
@@ -137,6 +187,24 @@ class Profiler:
 
         return wrapper
 
+    def wrap_iter(self, name, iterable, counter=None):
+        "Measures the time spent producing each item of the iterable. If name is None, only counts the items."
+        it = iter(iterable)
+        while True:
+            if name is not None:
+                last_section = self.cur_section
+                self.enter_section(name)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                if name is not None:
+                    self.enter_section(last_section)
+            if counter:
+                self.counters[counter] += 1
+            yield item
+
 
 class Lark(Serialize):
     def __init__(self, grammar, **options):
@@ -162,11 +230,18 @@ class Lark(Serialize):
 
         assert isinstance(grammar, STRING_TYPE)
 
+        cache_fn = None
         if self.options.cache_grammar:
-            raise NotImplementedError("Not available yet")
+            if self.options.parser != 'lalr' or self.options.lexer not in ('auto', 'standard', 'contextual'):
+                raise NotImplementedError("cache_grammar only works with parser='lalr', using the standard or contextual lexer")
+            if self.options.edit_terminals:
+                # The terminals are stored in the cache after they're edited, and the callback can't be part of the key
+                raise ConfigurationError("cache_grammar can't be used with edit_terminals")
+            cache_fn, cache_key = self._get_cache_filename(grammar)
+            if self._load_cache(cache_fn, cache_key):
+                return
 
-        assert not self.options.profile, "Feature temporarily disabled"
-        # self.profiler = Profiler() if self.options.profile else None
+        self.profiler = Profiler() if self.options.profile else None
 
         if self.options.lexer == 'auto':
             if self.options.parser == 'lalr':
@@ -179,6 +254,8 @@ class Lark(Serialize):
                 assert False, self.options.parser
         lexer = self.options.lexer
         assert lexer in ('standard', 'contextual', 'dynamic', 'dynamic_complete') or issubclass(lexer, Lexer)
+        if self.options.max_tokens is not None and lexer in ('dynamic', 'dynamic_complete'):
+            raise ValueError("max_tokens isn't supported with the dynamic lexers, use max_items instead")
 
         if self.options.ambiguity == 'auto':
             if self.options.parser == 'earley':
@@ -232,6 +309,11 @@ class Lark(Serialize):
         elif lexer:
             self.lexer = self._build_lexer()
 
+        if self.profiler: self.profiler.enter_section('outside_lark')
+
+        if cache_fn:
+            self._save_cache(cache_fn, cache_key)
+
     if __init__.__doc__:
         __init__.__doc__ += "\nOPTIONS:" + LarkOptions.OPTIONS_DOC
 
@@ -243,28 +325,135 @@ class Lark(Serialize):
     def _prepare_callbacks(self):
         self.parser_class = get_frontend(self.options.parser, self.options.lexer)
         self._parse_tree_builder = ParseTreeBuilder(self.rules, self.options.tree_class or Tree, self.options.propagate_positions, self.options.keep_all_tokens, self.options.parser!='lalr' and self.options.ambiguity=='explicit', self.options.maybe_placeholders)
-        self._callbacks = self._parse_tree_builder.create_callback(self.options.transformer)
+        self._callbacks = self._parse_tree_builder.create_callback(self.options.transformer, self.profiler)
 
     def _build_parser(self):
         self._prepare_callbacks()
         parser_conf = ParserConf(self.rules, self._callbacks, self.options.start)
-        return self.parser_class(self.lexer_conf, parser_conf, options=self.options)
+        parser = self.parser_class(self.lexer_conf, parser_conf, options=self.options)
+        if self.profiler:
+            parser.set_profiler(self.profiler)
+        self._set_limits(parser)
+        return parser
+
+    def _set_limits(self, parser):
+        limits = {name: getattr(self.options, name) for name in ('max_tokens', 'max_items', 'max_forest_nodes', 'timeout')}
+        limits = {name: value for name, value in limits.items() if value is not None}
+        if limits:
+            parser.set_limits(limits)
+
+    def _load(self, data, namespace, memo, **options_override):
+        if memo:
+            memo = SerializeMemoizer.deserialize(memo, namespace, {})
+        options = dict(data['options'])
+        options.update(options_override)
+        self.options = LarkOptions.deserialize(options, memo)
+        self.rules = [Rule.deserialize(r, memo) for r in data['rules']]
+        self.profiler = Profiler() if self.options.profile else None
+        self._prepare_callbacks()
+        self.parser = self.parser_class.deserialize(data['parser'], memo, self._callbacks, self.options.postlex, self.options.lexer_callbacks)
+        if self.profiler:
+            self.parser.set_profiler(self.profiler)
+            self.profiler.enter_section('outside_lark')
+        self._set_limits(self.parser)
+        self.lexer_conf = self.parser.lexer_conf
+        self.terminals = self.lexer_conf.tokens
+        self.ignore_tokens = self.lexer_conf.ignore
+        self._terminals_dict = {t.name:t for t in self.terminals}
 
     @classmethod
     def deserialize(cls, data, namespace, memo, transformer=None, postlex=None):
-        if memo:
-            memo = SerializeMemoizer.deserialize(memo, namespace, {})
         inst = cls.__new__(cls)
-        options = dict(data['options'])
-        options['transformer'] = transformer
-        options['postlex'] = postlex
-        inst.options = LarkOptions.deserialize(options, memo)
-        inst.rules = [Rule.deserialize(r, memo) for r in data['rules']]
         inst.source = '<deserialized>'
-        inst._prepare_callbacks()
-        inst.parser = inst.parser_class.deserialize(data['parser'], memo, inst._callbacks, inst.options.postlex)
+        inst._load(data, namespace, memo, transformer=transformer, postlex=postlex)
         return inst
 
+###}
+
+    # The cache is only used when loading a grammar, and relies on the helpers at the end of this module,
+    # so it's left out of the standalone parser.
+    def _get_cache_filename(self, grammar):
+        from . import __version__
+        options_str = ''.join('%s=%r;' % (k, v) for k, v in sorted(self.options.options.items())
+                              if k not in _UNCACHEABLE_OPTIONS)
+        s = u''.join([grammar, options_str, __version__, 'py%d.%d' % sys.version_info[:2]])
+        cache_key = hashlib.sha256(s.encode('utf8')).hexdigest()
+
+        cache_dir = self.options.cache_grammar
+        if not isinstance(cache_dir, STRING_TYPE):
+            cache_dir = _default_cache_dir()
+        return os.path.join(cache_dir, 'lark_cache_%s.pickle' % cache_key), cache_key
+
+    def _load_cache(self, cache_fn, cache_key):
+        "Try to load the parser from the cache. Returns False if the cache is missing, stale or corrupt."
+        try:
+            with open(cache_fn, 'rb') as f:
+                if not _is_private(os.fstat(f.fileno())):
+                    logging.warning("Ignoring grammar cache %s, since other users can write to it", cache_fn)
+                    return False
+                cached = pickle.load(f)
+            if cached['key'] != cache_key:
+                return False
+            # The key only covers the main grammar, so check that the grammars it imports haven't changed
+            for filename, digest in cached['imports'].items():
+                if _file_digest(filename) != digest:
+                    logging.debug("Ignoring stale grammar cache %s, since %s was modified", cache_fn, filename)
+                    return False
+            overrides = {k: self.options.options[k] for k in _UNCACHEABLE_OPTIONS}
+            self._load(cached['data'], {'Rule': Rule, 'TerminalDef': TerminalDef}, cached['memo'], **overrides)
+        except (IOError, OSError):
+            return False
+        except Exception as e:
+            logging.warning("Ignoring corrupt grammar cache %s (%s)", cache_fn, e)
+            return False
+
+        logging.debug("Loaded grammar from cache: %s", cache_fn)
+        return True
+
+    def _serialize_without_objects(self):
+        "Serializes the parser, leaving out the options that hold arbitrary Python objects"
+        data, memo = self.memo_serialize([TerminalDef, Rule])
+        data['options'] = {k: (LarkOptions._defaults[k] if k in _UNCACHEABLE_OPTIONS else v)
+                           for k, v in data['options'].items()}
+        return data, memo
+
+    def _save_cache(self, cache_fn, cache_key):
+        data, memo = self._serialize_without_objects()
+        try:
+            imports = {filename: _file_digest(filename) for filename in self.grammar.imported_files}
+        except (IOError, OSError) as e:
+            logging.warning("Not writing grammar cache to %s, since an imported grammar can't be read (%s)", cache_fn, e)
+            return
+        cached = {'key': cache_key, 'imports': imports, 'data': data, 'memo': memo}
+
+        # Write to a temporary file first, then rename it into place, so that concurrent
+        # processes never observe a partially written cache.
+        cache_dir = os.path.dirname(cache_fn)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o700)
+            if not _is_private(os.stat(cache_dir)):
+                logging.warning("Not writing grammar cache to %s, since other users can write to it", cache_dir)
+                return
+            fd, tmp_fn = tempfile.mkstemp(dir=cache_dir, prefix='.lark_cache_', suffix='.tmp')
+        except (IOError, OSError) as e:
+            logging.warning("Cannot write grammar cache to %s (%s)", cache_dir, e)
+            return
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+            _replace_file(tmp_fn, cache_fn)
+        except (IOError, OSError) as e:
+            logging.warning("Cannot write grammar cache to %s (%s)", cache_fn, e)
+            try:
+                os.remove(tmp_fn)
+            except OSError:
+                pass
+        else:
+            logging.debug("Saved grammar to cache: %s", cache_fn)
+
+###{standalone
 
     @classmethod
     def open(cls, grammar_filename, rel_to=None, **options):
@@ -308,6 +497,194 @@ class Lark(Serialize):
 
         Returns a tree, unless specified otherwise.
         """
+        if self.profiler:
+            return self.profiler.make_wrapper('parser', self.parser.parse)(text, start=start)
         return self.parser.parse(text, start=start)
 
+    def recognize(self, text, start=None):
+        """Check that the given text matches the grammar, without building a tree.
+
+        Returns True, or raises the same exception that parse() would. Skips the construction of the parse forest,
+        and of the tree, so it's faster and uses less memory. Only supported for parser='earley' and parser='cyk'.
+        """
+        try:
+            recognize = self.parser.recognize
+        except AttributeError:
+            raise NotImplementedError("recognize is only supported for parser='earley' and parser='cyk'")
+        if self.profiler:
+            return self.profiler.make_wrapper('parser', recognize)(text, start)
+        return recognize(text, start)
+
+    def parse_forest(self, text, start=None):
+        """Parse the text, and return its shared packed parse forest (SPPF), without choosing a derivation.
+
+        The returned ParseForest yields the trees of the derivations lazily with iter_trees(limit=None),
+        best first (the first one is what ambiguity='resolve' returns). Only one tree is built at a time,
+        so it's practical for inputs with too many derivations for ambiguity='explicit'.
+        Its transform(transformer=None) method applies a Transformer to the forest itself, once per node.
+        Only supported for parser='earley'. The transformer given to Lark (if any) is applied by iter_trees(),
+        and by transform() when it isn't given another one.
+        """
+        try:
+            parse_forest = self.parser.parse_forest
+        except AttributeError:
+            raise NotImplementedError("parse_forest is only supported for parser='earley'")
+        create_callback = self._parse_tree_builder.create_callback
+        if self.profiler:
+            return self.profiler.make_wrapper('parser', parse_forest)(text, start, create_callback)
+        return parse_forest(text, start, create_callback)
+
+###}
+
+    # parse_many sends the parser to its workers without the objects in _UNCACHEABLE_OPTIONS,
+    # so like the cache, it's left out of the standalone parser.
+    def parse_many(self, texts, workers=None, chunksize=1, start=None):
+        """Parse many independent texts in parallel, using a pool of worker processes.
+
+        Returns an iterator over the results, in the same order as texts. The parser is sent to each worker
+        only once, and the trees (or the results of the transformer) are pickled back from the workers.
+        If a text fails to parse, its exception is returned in place of its result, and the rest are still parsed.
+        An exception that can't be pickled is returned as a WorkerError, with its type name, message and traceback.
+
+        workers is the number of processes (Default: the number of CPUs), and chunksize is the number of texts
+        sent to a worker at a time. Only supported for parser='lalr', and requires that the transformer,
+        postlex and lexer_callbacks (if used) can be pickled.
+        """
+        if self.options.parser != 'lalr' or self.options.lexer not in ('standard', 'contextual'):
+            raise NotImplementedError("parse_many only works with parser='lalr', using the standard or contextual lexer")
+        return self._parse_many(texts, workers, chunksize, start)
+
+    def _parse_many(self, texts, workers, chunksize, start):
+        from multiprocessing import Pool, cpu_count
+        from itertools import islice
+        data, memo = self._serialize_without_objects()
+        options = {k: self.options.options[k] for k in _UNCACHEABLE_OPTIONS}
+        pool = Pool(workers, _init_parse_worker, (data, memo, options))
+
+        # Pool.imap would read all of texts up front, so instead send them in batches of a chunk per worker.
+        # The next batch is sent before yielding the results of the current one, to keep the workers busy,
+        # so at most two batches are in memory at a time.
+        texts = iter(texts)
+        batch_size = (workers or cpu_count()) * chunksize
+        def send_batch():
+            batch = [(text, start) for text in islice(texts, batch_size)]
+            return pool.map_async(_parse_in_worker, batch, chunksize) if batch else None
+
+        try:
+            pending = send_batch()
+            while pending is not None:
+                results = pending.get()
+                pending = send_batch()
+                for result in results:
+                    yield result
+            pool.close()
+        finally:
+            # Also stops the workers if the iteration is abandoned early
+            pool.terminate()
+            pool.join()
+
+###{standalone
+
+    def iter_parse(self, text, start=None):
+        """Parse the given text, yielding parser events instead of building a tree.
+
+        Yields ('shift', token) for every token, and ('reduce', (rule, n_children)) for every rule that is
+        matched, in the order in which the parser performs them. No tree is kept, so memory doesn't grow
+        with the size of the input. Only supported for parser='lalr'.
+        """
+        try:
+            iter_parse = self.parser.iter_parse
+        except AttributeError:
+            raise NotImplementedError("iter_parse is only supported for parser='lalr'")
+        return iter_parse(text, start)
+
+    def parse_file(self, filename, start=None):
+        """Parse the UTF-8 text in the given file, according to the options provided.
+
+        The file is memory-mapped and lexed as bytes, so it's never decoded as a whole. Only the values
+        of the tokens that are kept are decoded. Token positions and columns are counted in bytes.
+        Requires a standard or contextual lexer, and ASCII-only terminals. Terminals that match a single non-ASCII
+        byte (e.g. /./ or /[^ ]/) can't match part of a character, so they raise UnexpectedCharacters on it.
+        """
+        if not isinstance(self.parser, WithLexer) or getattr(self.parser.lexer, 'lex_bytes', NotImplemented) is NotImplemented:
+            raise NotImplementedError("parse_file requires the standard or contextual lexer")
+
+        import mmap
+        with open(filename, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty files can't be memory-mapped
+                data = b''
+            try:
+                if self.profiler:
+                    return self.profiler.make_wrapper('parser', self.parser.parse)(data, start=start, lex_bytes=True)
+                return self.parser.parse(data, start=start, lex_bytes=True)
+            finally:
+                if data:
+                    data.close()
+
+    def parse_incremental(self, start=None):
+        """Returns an IncrementalParser, which parses text that is fed to it in chunks.
+
+        Use its feed(text) method for each chunk, and then finish() to get the result, as parse() would return it.
+        Only supported for parser='lalr' with the standard or contextual lexer, and without a postlex.
+        """
+        try:
+            parse_incremental = self.parser.parse_incremental
+        except AttributeError:
+            raise NotImplementedError("Incremental parsing is only supported for parser='lalr'")
+        return parse_incremental(start)
+
 ###}
+
+
+_worker_parser = None
+
+def _init_parse_worker(data, memo, options):
+    global _worker_parser
+    _worker_parser = Lark.__new__(Lark)
+    _worker_parser.source = '<parse_many>'
+    _worker_parser._load(data, {'Rule': Rule, 'TerminalDef': TerminalDef}, memo, **options)
+
+def _parse_in_worker(args):
+    text, start = args
+    try:
+        return _worker_parser.parse(text, start)
+    except Exception as e:
+        try:
+            # The pool stops returning results if it can't unpickle one, so make sure that it can
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            return WorkerError(type(e).__name__, str(e), traceback.format_exc())
+        return e
+
+
+# Options that hold arbitrary Python objects. They don't affect the compiled parser,
+# so they are excluded from the cache key, and re-attached when loading from the cache.
+_UNCACHEABLE_OPTIONS = 'transformer', 'postlex', 'lexer_callbacks', 'edit_terminals', 'tree_class'
+
+try:
+    _replace_file = os.replace      # Python 3.3+
+except AttributeError:
+    def _replace_file(src, dst):
+        # os.rename isn't atomic on Windows, and fails if dst exists
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+def _default_cache_dir():
+    "A directory for the cache in the system's temp directory, of the current user"
+    if not hasattr(os, 'getuid'):
+        return tempfile.gettempdir()    # Windows, where it's already per-user
+    return os.path.join(tempfile.gettempdir(), 'lark_cache_%d' % os.getuid())
+
+def _is_private(st):
+    "Returns whether the file (given by its stat) is owned by the current user, and no one else can write to it"
+    if not hasattr(os, 'getuid'):
+        return True
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def _file_digest(filename):
+    "A hash of the file's contents, to notice when it changes"
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
@@ -2,7 +2,7 @@
 
 import re
 
-from .utils import Str, classify, get_regexp_width, Py36, Serialize
+from .utils import Str, classify, get_regexp_width, get_regexp_first_chars, get_regexp_partial_match, Py36, Serialize
 from .exceptions import UnexpectedCharacters, LexError, UnexpectedToken
 
 ###{standalone
@@ -158,6 +158,10 @@ class _Lex:
         self.lexer = lexer
         self.state = state
 
+    @staticmethod
+    def match(lexer, stream, pos):
+        return lexer.match(stream, pos)
+
     def lex(self, stream, newline_types, ignore_types):
         newline_types = frozenset(newline_types)
         ignore_types = frozenset(ignore_types)
@@ -168,7 +172,7 @@ class _Lex:
             lexer = self.lexer
             res = lexer.match(stream, line_ctr.char_pos)
             if not res:
-                allowed = {v for m, tfi in lexer.mres for v in tfi.values()} - ignore_types
+                allowed = lexer.allowed_types - ignore_types
                 if not allowed:
                     allowed = {"<END-OF-FILE>"}
                 raise UnexpectedCharacters(stream, line_ctr.char_pos, line_ctr.line, line_ctr.column, allowed=allowed, state=self.state, token_history=last_token and [last_token])
@@ -195,16 +199,162 @@ class _Lex:
                 t.end_column = line_ctr.column
 
 
+def _splits_char(stream, end):
+    "Returns whether the UTF-8 bytes end inside a character, i.e. stream[end] is a continuation byte"
+    return b'\x80' <= stream[end:end+1] < b'\xc0'
+
+class _BytesLex(_Lex):
+    """Lexes UTF-8 text in a bytes-like object (such as an mmap), without decoding all of it.
+
+    Only the values of tokens that are kept are decoded, and string terminals reuse the value of their pattern.
+    Positions and columns are counted in bytes. A match that ends inside a multibyte character (e.g. of /[^ ]/)
+    doesn't count, since it would split the character.
+    """
+    @staticmethod
+    def match(lexer, stream, pos):
+        if lexer.bytes_scanner is None:
+            lexer.build_bytes()
+        res = lexer.match_bytes(stream, pos)
+        if res and not _splits_char(stream, res[0]):
+            end, type_ = res
+            return stream[pos:end].decode('utf8'), type_
+
+    def lex(self, stream, newline_types, ignore_types):
+        newline_types = frozenset(newline_types)
+        ignore_types = frozenset(ignore_types)
+        line_ctr = LineCounter()
+        line_ctr.newline_char = b'\n'
+        last_token = None
+        stream_end = len(stream)
+
+        while line_ctr.char_pos < stream_end:
+            lexer = self.lexer
+            if lexer.bytes_scanner is None:
+                lexer.build_bytes()
+            pos = line_ctr.char_pos
+            res = lexer.match_bytes(stream, pos)
+            if not res or _splits_char(stream, res[0]):
+                allowed = lexer.allowed_types - ignore_types
+                if not allowed:
+                    allowed = {"<END-OF-FILE>"}
+                # Decode only the text around the error, for its message
+                context_start = max(pos - 40, 0)
+                context = stream[context_start:pos+40].decode('utf8', 'replace')
+                context_pos = len(stream[context_start:pos].decode('utf8', 'replace'))
+                e = UnexpectedCharacters(context, context_pos, line_ctr.line, line_ctr.column, allowed=allowed, state=self.state, token_history=last_token and [last_token])
+                e.pos_in_stream = pos
+                raise e
+
+            end, type_ = res
+            raw = stream[pos:end]
+
+            t = None
+            if type_ not in ignore_types:
+                t = Token(type_, lexer.str_values.get(type_) or raw.decode('utf8'), pos, line_ctr.line, line_ctr.column)
+                if t.type in lexer.callback:
+                    t = lexer.callback[t.type](t)
+                    if not isinstance(t, Token):
+                        raise ValueError("Callbacks must return a token (returned %r)" % t)
+                last_token = t
+                yield t
+            else:
+                if type_ in lexer.callback:
+                    t = Token(type_, raw.decode('utf8'), pos, line_ctr.line, line_ctr.column)
+                    lexer.callback[type_](t)
+
+            line_ctr.feed(raw, type_ in newline_types)
+            if t:
+                t.end_line = line_ctr.line
+                t.end_column = line_ctr.column
+
+
+class _IncrementalLex:
+    """Lexes text that arrives in chunks, keeping only the text that wasn't consumed yet.
+
+    A token is held back while the rest of the text might be the beginning of a longer match, since more
+    text might still extend it (e.g. '1' in '1e+', which becomes '1e+5'). Its text is then lexed again
+    once more text arrives, or at the end.
+    """
+    def __init__(self, get_lexer, newline_types, ignore_types, state=None):
+        self.get_lexer = get_lexer
+        self.newline_types = frozenset(newline_types)
+        self.ignore_types = frozenset(ignore_types)
+        self.state = state
+        self.line_ctr = LineCounter()
+        self.last_token = None
+        self.buffer = ''
+        self.buffer_pos = 0     # Position of the buffer in the whole text
+
+    set_parser_state = None
+    def lex(self, text, final=False):
+        "Adds text to the buffer, and yields the tokens that are complete. If final is True, the buffer is consumed entirely."
+        stream = self.buffer = self.buffer + text if self.buffer else text
+        newline_types = self.newline_types
+        ignore_types = self.ignore_types
+        line_ctr = self.line_ctr
+
+        while line_ctr.char_pos - self.buffer_pos < len(stream):
+            pos = line_ctr.char_pos - self.buffer_pos
+            lexer = self.get_lexer()
+            if not final and lexer.may_extend(stream, pos):
+                break   # Wait for more text
+            res = lexer.match(stream, pos)
+            if not res:
+                allowed = lexer.allowed_types - ignore_types
+                if not allowed:
+                    allowed = {"<END-OF-FILE>"}
+                e = UnexpectedCharacters(stream, pos, line_ctr.line, line_ctr.column, allowed=allowed, state=self.state, token_history=self.last_token and [self.last_token])
+                e.pos_in_stream = line_ctr.char_pos
+                raise e
+
+            value, type_ = res
+
+            t = None
+            if type_ not in ignore_types:
+                t = Token(type_, value, line_ctr.char_pos, line_ctr.line, line_ctr.column)
+                if t.type in lexer.callback:
+                    t = lexer.callback[t.type](t)
+                    if not isinstance(t, Token):
+                        raise ValueError("Callbacks must return a token (returned %r)" % t)
+                self.last_token = t
+                yield t
+            else:
+                if type_ in lexer.callback:
+                    t = Token(type_, value, line_ctr.char_pos, line_ctr.line, line_ctr.column)
+                    lexer.callback[type_](t)
+
+            line_ctr.feed(value, type_ in newline_types)
+            if t:
+                t.end_line = line_ctr.line
+                t.end_column = line_ctr.column
+
+        # Drop the consumed text
+        self.buffer = stream[line_ctr.char_pos - self.buffer_pos:]
+        self.buffer_pos = line_ctr.char_pos
+
+
 class UnlessCallback:
-    def __init__(self, mres):
-        self.mres = mres
+    """Changes the type of tokens whose value is one of the given string terminals (e.g. keywords).
+
+    Resolved with a dict lookup, since the string terminals are always matched whole.
+    """
+    def __init__(self, terminals):
+        self.exact = {}
+        self.nocase = {}
+        for i, t in enumerate(terminals):
+            if 'i' in t.pattern.flags:
+                self.nocase.setdefault(t.pattern.value.lower(), (i, t.name))
+            else:
+                self.exact.setdefault(t.pattern.value, (i, t.name))
 
     def __call__(self, t):
-        for mre, type_from_index in self.mres:
-            m = mre.match(t.value)
-            if m:
-                t.type = type_from_index[m.lastindex]
-                break
+        match = self.exact.get(t.value)
+        if self.nocase:
+            nocase_match = self.nocase.get(t.value.lower())
+            if nocase_match and (not match or nocase_match < match):
+                match = nocase_match
+        if match:
+            t.type = match[1]
         return t
 
 class CallChain:
@@ -221,7 +371,7 @@ class CallChain:
 
 
 
-def _create_unless(terminals):
+def _create_unless(terminals, cache):
     tokens_by_type = classify(terminals, lambda t: type(t.pattern))
     assert len(tokens_by_type) <= 2, tokens_by_type.keys()
     embedded_strs = set()
@@ -231,38 +381,143 @@ def _create_unless(terminals):
         for strtok in tokens_by_type.get(PatternStr, []):
             if strtok.priority > retok.priority:
                 continue
-            s = strtok.pattern.value
-            m = re.match(retok.pattern.to_regexp(), s)
-            if m and m.group(0) == s:
+            if cache.matches_whole(retok, strtok):
                 unless.append(strtok)
                 if strtok.pattern.flags <= retok.pattern.flags:
                     embedded_strs.add(strtok)
         if unless:
-            callback[retok.name] = UnlessCallback(build_mres(unless, match_whole=True))
+            callback[retok.name] = UnlessCallback(unless)
 
     terminals = [t for t in terminals if t not in embedded_strs]
     return terminals, callback
 
 
-def _build_mres(terminals, max_size, match_whole):
+def _build_mres(terminals, max_size, match_whole, as_bytes=False):
     # Python sets an unreasonable group limit (currently 100) in its re module
     # Worse, the only way to know we reached it is by catching an AssertionError!
     # This function recursively tries less and less groups until it's successful.
     postfix = '$' if match_whole else ''
     mres = []
     while terminals:
+        pattern = u'|'.join(u'(?P<%s>%s)'%(t.name, t.pattern.to_regexp()+postfix) for t in terminals[:max_size])
+        if as_bytes:
+            pattern = pattern.encode('ascii')
         try:
-            mre = re.compile(u'|'.join(u'(?P<%s>%s)'%(t.name, t.pattern.to_regexp()+postfix) for t in terminals[:max_size]))
+            mre = re.compile(pattern)
         except AssertionError:  # Yes, this is what Python provides us.. :/
-            return _build_mres(terminals, max_size//2, match_whole)
+            return _build_mres(terminals, max_size//2, match_whole, as_bytes)
 
         # terms_from_name = {t.name: t for t in terminals[:max_size]}
         mres.append((mre, {i:n for n,i in mre.groupindex.items()} ))
         terminals = terminals[max_size:]
     return mres
 
-def build_mres(terminals, match_whole=False):
-    return _build_mres(terminals, len(terminals), match_whole)
+def build_mres(terminals, match_whole=False, as_bytes=False):
+    return _build_mres(terminals, len(terminals), match_whole, as_bytes)
+
+def _build_scanner(terminals, cache, as_bytes=False):
+    """Builds a dispatch table, that maps each character to the mres of only the terminals that may start with it.
+
+    Terminals whose first character can't be determined are included everywhere.
+    Returns (scanner, default_mres), where default_mres are used for characters that aren't in the table.
+    If as_bytes is True, the table maps the first byte of each character (in UTF-8) to mres that match bytes.
+    """
+    by_char = {}
+    unknown = []
+    for t in terminals:
+        chars = cache.first_chars(t)
+        if chars is None:
+            unknown.append(t)
+        else:
+            for c in chars:
+                if as_bytes:
+                    c = c.encode('utf8')[:1]
+                by_char.setdefault(c, []).append(t)
+
+    # The order of terminals must be kept, since the first matching alternative wins
+    order = {t.name: i for i, t in enumerate(terminals)}
+    scanner = {}
+    for c, char_terminals in by_char.items():
+        key = sorted({t.name: t for t in char_terminals + unknown}.values(), key=lambda t: order[t.name])
+        scanner[c] = cache.build_mres(key, as_bytes)
+
+    return scanner, cache.build_mres(unknown, as_bytes)
+
+def _build_partial_scanner(terminals, cache):
+    """Like _build_scanner, but maps each character to the partial matches of the terminals (see get_regexp_partial_match).
+
+    A partial match is None if it's unknown."""
+    scanner = {}
+    unknown = []
+    for t in terminals:
+        chars = cache.first_chars(t)
+        if chars is None:
+            unknown.append(cache.partial_match(t))
+        else:
+            for c in chars:
+                scanner.setdefault(c, []).append(cache.partial_match(t))
+    for partials in scanner.values():
+        partials += unknown
+    return scanner, unknown
+
+
+class LexerCache:
+    """Caches the work of compiling terminals, so it can be shared between lexers.
+
+    Terminals are identified by name, so a cache must only be shared by lexers of the same grammar.
+    """
+    def __init__(self):
+        self.checked = set()
+        self._first_chars = {}
+        self._partial_matches = {}
+        self._matches_whole = {}
+        self._mres = {}
+
+    def check_terminals(self, terminals):
+        for t in terminals:
+            if t.name in self.checked:
+                continue
+            try:
+                re.compile(t.pattern.to_regexp())
+            except:
+                raise LexError("Cannot compile token %s: %s" % (t.name, t.pattern))
+
+            if t.pattern.min_width == 0:
+                raise LexError("Lexer does not allow zero-width terminals. (%s: %s)" % (t.name, t.pattern))
+            self.checked.add(t.name)
+
+    def first_chars(self, t):
+        try:
+            return self._first_chars[t.name]
+        except KeyError:
+            chars = self._first_chars[t.name] = get_regexp_first_chars(t.pattern.to_regexp())
+            return chars
+
+    def partial_match(self, t):
+        try:
+            return self._partial_matches[t.name]
+        except KeyError:
+            m = self._partial_matches[t.name] = get_regexp_partial_match(t.pattern.to_regexp())
+            return m
+
+    def matches_whole(self, retok, strtok):
+        "Returns whether the regexp terminal retok matches the whole string of strtok"
+        key = retok.name, strtok.name
+        try:
+            return self._matches_whole[key]
+        except KeyError:
+            s = strtok.pattern.value
+            m = re.match(retok.pattern.to_regexp(), s)
+            res = self._matches_whole[key] = bool(m and m.group(0) == s)
+            return res
+
+    def build_mres(self, terminals, as_bytes=False):
+        key = tuple(t.name for t in terminals), as_bytes
+        try:
+            return self._mres[key]
+        except KeyError:
+            mres = self._mres[key] = build_mres(terminals, as_bytes=as_bytes)
+            return mres
 
 def _regexp_has_newline(r):
     r"""Expressions that may indicate newlines in a regexp:
@@ -281,27 +536,27 @@ class Lexer(object):
         lex(self, stream) -> Iterator[Token]
 
         set_parser_state(self, state)   # Optional
+
+        lex_bytes(self, stream) -> Iterator[Token]    # Optional
+
+        lex_incremental(self) -> _IncrementalLex     # Optional
     """
     set_parser_state = NotImplemented
     lex = NotImplemented
+    lex_bytes = NotImplemented
+    lex_incremental = NotImplemented
 
 
 class TraditionalLexer(Lexer):
 
-    def __init__(self, terminals, ignore=(), user_callbacks={}):
+    def __init__(self, terminals, ignore=(), user_callbacks={}, cache=None):
         assert all(isinstance(t, TerminalDef) for t in terminals), terminals
 
         terminals = list(terminals)
 
         # Sanitization
-        for t in terminals:
-            try:
-                re.compile(t.pattern.to_regexp())
-            except:
-                raise LexError("Cannot compile token %s: %s" % (t.name, t.pattern))
-
-            if t.pattern.min_width == 0:
-                raise LexError("Lexer does not allow zero-width terminals. (%s: %s)" % (t.name, t.pattern))
+        self.cache = cache if cache is not None else LexerCache()
+        self.cache.check_terminals(terminals)
 
         assert set(ignore) <= {t.name for t in terminals}
 
@@ -315,7 +570,7 @@ class TraditionalLexer(Lexer):
         self.build()
 
     def build(self):
-        terminals, self.callback = _create_unless(self.terminals)
+        terminals, self.callback = _create_unless(self.terminals, self.cache)
         assert all(self.callback.values())
 
         for type_, f in self.user_callbacks.items():
@@ -325,19 +580,70 @@ class TraditionalLexer(Lexer):
             else:
                 self.callback[type_] = f
 
-        self.mres = build_mres(terminals)
+        self.allowed_types = {t.name for t in terminals}
+        self.scanner, self.default_mres = _build_scanner(terminals, self.cache)
+        self._scanned_terminals = terminals
+        self.bytes_scanner = None
+        self.partial_scanner = None
+
+    def build_bytes(self):
+        "Builds the scanner used by match_bytes()"
+        terminals = self._scanned_terminals
+        for t in terminals:
+            try:
+                t.pattern.to_regexp().encode('ascii')
+            except UnicodeError:
+                raise LexError("Only ASCII terminals can be matched against bytes (%s: %s)" % (t.name, t.pattern))
+
+        # The values of string terminals are known in advance, so there's no need to decode them
+        self.str_values = {t.name: t.pattern.value for t in terminals
+                           if isinstance(t.pattern, PatternStr) and 'i' not in t.pattern.flags}
+        self.bytes_scanner, self.bytes_default_mres = _build_scanner(terminals, self.cache, as_bytes=True)
 
     def match(self, stream, pos):
-        for mre, type_from_index in self.mres:
+        for mre, type_from_index in self.scanner.get(stream[pos], self.default_mres):
             m = mre.match(stream, pos)
             if m:
                 return m.group(0), type_from_index[m.lastindex]
 
+    def may_extend(self, stream, pos):
+        """Returns whether more text after the end of the stream might change the match at pos,
+        i.e. whether the rest of the stream might be the beginning of a match of one of the terminals"""
+        if self.partial_scanner is None:
+            self.partial_scanner, self.partial_default = _build_partial_scanner(self._scanned_terminals, self.cache)
+        for m in self.partial_scanner.get(stream[pos], self.partial_default):
+            if m is None or m.match(stream, pos):
+                return True
+        return False
+
+    def match_bytes(self, stream, pos):
+        "Like match(), but for UTF-8 text in a bytes-like object. Returns (end position, type)"
+        for mre, type_from_index in self.bytes_scanner.get(stream[pos:pos+1], self.bytes_default_mres):
+            m = mre.match(stream, pos)
+            if m:
+                return m.end(), type_from_index[m.lastindex]
+
     def lex(self, stream):
         return _Lex(self).lex(stream, self.newline_types, self.ignore_types)
 
+    def lex_bytes(self, stream):
+        return _BytesLex(self).lex(stream, self.newline_types, self.ignore_types)
+
+    def lex_incremental(self):
+        return _IncrementalLex(lambda: self, self.newline_types, self.ignore_types)
+
+
+
 
+class _LazyLexers(dict):
+    "Maps parser states to their lexers, building each one only when its state is first reached"
+    def __init__(self, build_lexer):
+        dict.__init__(self)
+        self.build_lexer = build_lexer
 
+    def __missing__(self, state):
+        lexer = self[state] = self.build_lexer(state)
+        return lexer
 
 class ContextualLexer(Lexer):
     def __init__(self, terminals, states, ignore=(), always_accept=(), user_callbacks={}):
@@ -346,44 +652,99 @@ class ContextualLexer(Lexer):
             assert t.name not in tokens_by_name, t
             tokens_by_name[t.name] = t
 
-        lexer_by_tokens = {}
-        self.lexers = {}
-        for state, accepts in states.items():
-            key = frozenset(accepts)
-            try:
-                lexer = lexer_by_tokens[key]
-            except KeyError:
-                accepts = set(accepts) | set(ignore) | set(always_accept)
-                state_tokens = [tokens_by_name[n] for n in accepts if n and n in tokens_by_name]
-                lexer = TraditionalLexer(state_tokens, ignore=ignore, user_callbacks=user_callbacks)
-                lexer_by_tokens[key] = lexer
+        # Only the sanitization is done eagerly, so that errors are still reported when the lexer is created
+        self.cache = LexerCache()
+        self.cache.check_terminals(terminals)
+        assert set(ignore) <= set(tokens_by_name)
+
+        self.terminals = terminals
+        self.tokens_by_name = tokens_by_name
+        self.states = states
+        self.ignore = ignore
+        self.always_accept = always_accept
+        self.user_callbacks = user_callbacks
 
-            self.lexers[state] = lexer
+        self.newline_types = [t.name for t in terminals if _regexp_has_newline(t.pattern.to_regexp())]
+        self.ignore_types = list(ignore)
 
-        self.root_lexer = TraditionalLexer(terminals, ignore=ignore, user_callbacks=user_callbacks)
+        self._lexer_by_tokens = {}
+        self.lexers = _LazyLexers(self._build_state_lexer)
+        self._root_lexer = None
 
         self.set_parser_state(None) # Needs to be set on the outside
 
+    def _build_state_lexer(self, state):
+        key = frozenset(self.states[state])
+        try:
+            return self._lexer_by_tokens[key]
+        except KeyError:
+            accepts = set(key) | set(self.ignore) | set(self.always_accept)
+            state_tokens = [self.tokens_by_name[n] for n in accepts if n and n in self.tokens_by_name]
+            lexer = TraditionalLexer(state_tokens, ignore=self.ignore, user_callbacks=self.user_callbacks, cache=self.cache)
+            self._lexer_by_tokens[key] = lexer
+            return lexer
+
+    @property
+    def root_lexer(self):
+        if self._root_lexer is None:
+            self._root_lexer = TraditionalLexer(self.terminals, ignore=self.ignore, user_callbacks=self.user_callbacks, cache=self.cache)
+        return self._root_lexer
+
     def set_parser_state(self, state):
         self.parser_state = state
 
     def lex(self, stream):
-        l = _Lex(self.lexers[self.parser_state], self.parser_state)
+        return self._lex(_Lex, stream)
+
+    def lex_bytes(self, stream):
+        return self._lex(_BytesLex, stream)
+
+    def _lex(self, lex_class, stream):
+        l = lex_class(self.lexers[self.parser_state], self.parser_state)
         try:
-            for x in l.lex(stream, self.root_lexer.newline_types, self.root_lexer.ignore_types):
+            for x in l.lex(stream, self.newline_types, self.ignore_types):
                 yield x
                 l.lexer = self.lexers[self.parser_state]
                 l.state = self.parser_state
         except UnexpectedCharacters as e:
-            # In the contextual lexer, UnexpectedCharacters can mean that the terminal is defined,
-            # but not in the current context.
-            # This tests the input against the global context, to provide a nicer error.
-            root_match = self.root_lexer.match(stream, e.pos_in_stream)
-            if not root_match:
-                raise
-
-            value, type_ = root_match
-            t = Token(type_, value, e.pos_in_stream, e.line, e.column)
-            raise UnexpectedToken(t, e.allowed, state=e.state)
+            raise self._unexpected_token(e, l.match(self.root_lexer, stream, e.pos_in_stream))
+
+    def _unexpected_token(self, e, root_match):
+        "Returns the error to raise for UnexpectedCharacters, given the match of the root lexer at its position"
+        # In the contextual lexer, UnexpectedCharacters can mean that the terminal is defined,
+        # but not in the current context.
+        # This tests the input against the global context, to provide a nicer error.
+        if not root_match:
+            return e
+
+        value, type_ = root_match
+        t = Token(type_, value, e.pos_in_stream, e.line, e.column)
+        return UnexpectedToken(t, e.allowed, state=e.state)
+
+    def lex_incremental(self):
+        return _ContextualIncrementalLex(self)
+
+
+class _ContextualIncrementalLex(_IncrementalLex):
+    def __init__(self, contextual_lexer):
+        self.contextual_lexer = contextual_lexer
+        _IncrementalLex.__init__(self, self._get_lexer, contextual_lexer.newline_types, contextual_lexer.ignore_types)
+
+    # Each incremental parse tracks its own parser state, so that several of them can be interleaved
+    def set_parser_state(self, state):
+        self.state = state
+
+    def _get_lexer(self):
+        return self.contextual_lexer.lexers[self.state]
+
+    def lex(self, text, final=False):
+        stream_pos = self.buffer_pos
+        stream = self.buffer + text
+        try:
+            for t in _IncrementalLex.lex(self, text, final):
+                yield t
+        except UnexpectedCharacters as e:
+            root_match = self.contextual_lexer.root_lexer.match(stream, e.pos_in_stream - stream_pos)
+            raise self.contextual_lexer._unexpected_token(e, root_match)
 
 ###}
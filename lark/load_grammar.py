@@ -463,10 +463,12 @@ def _choice_of_rules(rules):
     return ST('expansions', [ST('expansion', [Token('RULE', name)]) for name in rules])
 
 class Grammar:
-    def __init__(self, rule_defs, term_defs, ignore):
+    def __init__(self, rule_defs, term_defs, ignore, filename=None, imported_files=()):
         self.term_defs = term_defs
         self.rule_defs = rule_defs
         self.ignore = ignore
+        self.filename = filename
+        self.imported_files = set(imported_files)   # Paths of all the grammar files it imports, directly or not
 
     def compile(self, start):
         # We change the trees in-place (to support huge grammars)
@@ -808,9 +810,12 @@ class GrammarLoader:
                 assert False, stmt
 
         # import grammars
+        imported_files = set()
         for dotted_path, (base_paths, aliases) in imports.items():
             grammar_path = os.path.join(*dotted_path) + EXT
             g = import_grammar(grammar_path, base_paths=base_paths)
+            imported_files.add(g.filename)
+            imported_files |= g.imported_files
             new_td, new_rd = import_from_grammar_into_namespace(g, '__'.join(dotted_path), aliases)
 
             term_defs += new_td
@@ -871,7 +876,7 @@ class GrammarLoader:
                     if sym not in rule_names:
                         raise GrammarError("Rule '%s' used but not defined (in rule %s)" % (sym, name))
 
-        return Grammar(rules, term_defs, ignore_names)
+        return Grammar(rules, term_defs, ignore_names, grammar_name, imported_files)
 
 
 
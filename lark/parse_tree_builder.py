@@ -228,26 +228,39 @@ class ParseTreeBuilder:
             yield rule, wrapper_chain
 
 
-    def create_callback(self, transformer=None):
+    def get_user_callback(self, rule, transformer):
+        "Returns the transformer's callback for the rule, or None if it doesn't have one"
+        user_callback_name = rule.alias or rule.origin.name
+        try:
+            f = getattr(transformer, user_callback_name)
+        except AttributeError:
+            return None
+
+        assert not getattr(f, 'meta', False), "Meta args not supported for internal transformer"
+        # XXX InlineTransformer is deprecated!
+        if getattr(f, 'inline', False) or isinstance(transformer, InlineTransformer):
+            f = ptb_inline_args(f)
+        elif hasattr(f, 'whole_tree') or isinstance(transformer, Transformer_InPlace):
+            f = inplace_transformer(f)
+        return f
+
+    def create_callback(self, transformer=None, profiler=None):
         callbacks = {}
 
         for rule, wrapper_chain in self.rule_builders:
 
-            user_callback_name = rule.alias or rule.origin.name
-            try:
-                f = getattr(transformer, user_callback_name)
-                assert not getattr(f, 'meta', False), "Meta args not supported for internal transformer"
-                # XXX InlineTransformer is deprecated!
-                if getattr(f, 'inline', False) or isinstance(transformer, InlineTransformer):
-                    f = ptb_inline_args(f)
-                elif hasattr(f, 'whole_tree') or isinstance(transformer, Transformer_InPlace):
-                    f = inplace_transformer(f)
-            except AttributeError:
-                f = partial(self.tree_class, user_callback_name)
+            f = self.get_user_callback(rule, transformer)
+            if f is None:
+                f = partial(self.tree_class, rule.alias or rule.origin.name)
+            elif profiler:
+                f = profiler.make_wrapper('transformer', f)
 
             for w in wrapper_chain:
                 f = w(f)
 
+            if profiler:
+                f = profiler.make_wrapper('tree_builder', f, 'reduces')
+
             if rule in callbacks:
                 raise GrammarError("Rule '%s' already exists" % (rule,))
 
@@ -1,16 +1,17 @@
 import re
 from functools import partial
 
-from .utils import get_regexp_width, Serialize
+from .utils import get_regexp_width, get_regexp_first_chars, get_regexp_prefixes, Serialize
 from .parsers.grammar_analysis import GrammarAnalyzer
 from .lexer import TraditionalLexer, ContextualLexer, Lexer, Token
 from .parsers import earley, xearley, cyk
-from .parsers.lalr_parser import LALR_Parser
+from .parsers.lalr_parser import LALR_Parser, ParserState
 from .grammar import Rule
 from .tree import Tree
-from .common import LexerConf
+from .common import LexerConf, ParseBudget
 
 ###{standalone
+from itertools import islice
 
 def get_frontend(parser, lexer):
     if parser=='lalr':
@@ -45,13 +46,31 @@ def get_frontend(parser, lexer):
 
 
 class _ParserFrontend(Serialize):
-    def _parse(self, input, start, *args):
+    profiler = None
+    limits = None
+
+    def set_profiler(self, profiler):
+        self.profiler = profiler
+        if hasattr(self.parser, 'profiler'):
+            self.parser.profiler = profiler
+
+    def set_limits(self, limits):
+        "Sets the limits of each parse, as a dict of arguments for ParseBudget"
+        self.limits = limits
+
+    def _new_budget(self):
+        return ParseBudget(**self.limits) if self.limits else None
+
+    def _get_start(self, start):
         if start is None:
             start = self.start
             if len(start) > 1:
                 raise ValueError("Lark initialized with more than 1 possible start rule. Must specify which start rule to parse", start)
             start ,= start
-        return self.parser.parse(input, start, *args)
+        return start
+
+    def _parse(self, input, start, *args):
+        return self.parser.parse(input, self._get_start(start), *args)
 
 
 class WithLexer(_ParserFrontend):
@@ -69,9 +88,11 @@ class WithLexer(_ParserFrontend):
         self.postlex = lexer_conf.postlex
 
     @classmethod
-    def deserialize(cls, data, memo, callbacks, postlex):
+    def deserialize(cls, data, memo, callbacks, postlex, lexer_callbacks=None):
         inst = super(WithLexer, cls).deserialize(data, memo)
-        inst.postlex = postlex
+        inst.postlex = inst.lexer_conf.postlex = postlex
+        if lexer_callbacks:
+            inst.lexer_conf.callbacks = lexer_callbacks
         inst.parser = LALR_Parser.deserialize(inst.parser, memo, callbacks)
         inst.init_lexer()
         return inst
@@ -79,12 +100,18 @@ class WithLexer(_ParserFrontend):
     def _serialize(self, data, memo):
         data['parser'] = data['parser'].serialize(memo)
 
-    def lex(self, text):
-        stream = self.lexer.lex(text)
-        return self.postlex.process(stream) if self.postlex else stream
-
-    def parse(self, text, start=None):
-        token_stream = self.lex(text)
+    def lex(self, text, lex_bytes=False, budget=None):
+        stream = self.lexer.lex_bytes(text) if lex_bytes else self.lexer.lex(text)
+        if self.profiler:
+            stream = self.profiler.wrap_iter('lexer', stream, 'tokens')
+            if self.postlex:
+                stream = self.profiler.wrap_iter('postlex', self.postlex.process(stream))
+        elif self.postlex:
+            stream = self.postlex.process(stream)
+        return budget.count_tokens(stream) if budget is not None else stream
+
+    def parse(self, text, start=None, lex_bytes=False):
+        token_stream = self.lex(text, lex_bytes, self._new_budget())
         sps = self.lexer.set_parser_state
         return self._parse(token_stream, start, *[sps] if sps is not NotImplemented else [])
 
@@ -102,13 +129,93 @@ class LALR_WithLexer(WithLexer):
     def init_lexer(self):
         raise NotImplementedError()
 
+    def lex(self, text, lex_bytes=False, budget=None):
+        stream = WithLexer.lex(self, text, lex_bytes, budget)
+        if self.profiler:
+            # Every token that reaches the LALR parser is shifted exactly once
+            stream = self.profiler.wrap_iter(None, stream, 'shifts')
+        return stream
+
+    def iter_parse(self, text, start=None):
+        events = []
+        def on_shift(token):
+            events.append(('shift', token))
+        def on_reduce(rule, n_children):
+            events.append(('reduce', (rule, n_children)))
+
+        sps = self.lexer.set_parser_state
+        parser_state = self.parser.parse_events(self._get_start(start), on_shift, on_reduce,
+                                                sps if sps is not NotImplemented else None)
+
+        # Feed the tokens in small batches, and pass on their events in between.
+        # The batches are pulled lazily, so the contextual lexer still sees the up-to-date parser state.
+        stream = iter(self.lex(text, budget=self._new_budget()))
+        while True:
+            last_token = parser_state.last_token
+            parser_state.feed_tokens(islice(stream, 100))
+            for event in events:
+                yield event
+            del events[:]
+            if parser_state.last_token is last_token:
+                break
+
+        parser_state.feed_end()
+        for event in events:
+            yield event
+
+    def parse_incremental(self, start=None):
+        if self.postlex:
+            raise NotImplementedError("Incremental parsing doesn't support postlex")
+        if self.lexer.lex_incremental is NotImplemented:
+            raise NotImplementedError("Incremental parsing isn't supported by the lexer %r" % self.lexer)
+        lexer_state = self.lexer.lex_incremental()
+        parser_state = ParserState(self.parser.parser, self._get_start(start), lexer_state.set_parser_state)
+        return IncrementalParser(lexer_state, parser_state, self.profiler, self._new_budget())
+
+
+class IncrementalParser(object):
+    """Parses text that is fed to it in chunks, and returns the result when finished.
+
+    Only the text of incomplete tokens is kept between chunks, so memory is bounded by
+    the longest token and the parser stack, rather than by the size of the input.
+
+    The budget (if any) is shared by all the chunks, so its timeout counts from the creation of the parser.
+    """
+    def __init__(self, lexer_state, parser_state, profiler=None, budget=None):
+        self.lexer_state = lexer_state
+        self.parser_state = parser_state
+        self.profiler = profiler
+        self.budget = budget
+
+    def _feed(self, text, final):
+        stream = self.lexer_state.lex(text, final)
+        if self.profiler:
+            stream = self.profiler.wrap_iter('lexer', stream, 'tokens')
+        if self.budget is not None:
+            stream = self.budget.count_tokens(stream)
+        if self.profiler:
+            stream = self.profiler.wrap_iter(None, stream, 'shifts')
+            self.profiler.make_wrapper('parser', self.parser_state.feed_tokens)(stream)
+        else:
+            self.parser_state.feed_tokens(stream)
+
+    def feed(self, text):
+        "Lexes and parses as much of the text as possible. Incomplete tokens are kept until more text arrives."
+        self._feed(text, False)
+
+    def finish(self):
+        "Ends the input, and returns the result of the parse"
+        self._feed('', True)
+        return self.parser_state.feed_end()
+
 class LALR_TraditionalLexer(LALR_WithLexer):
     def init_lexer(self):
         self.init_traditional_lexer()
 
 class LALR_ContextualLexer(LALR_WithLexer):
     def init_lexer(self):
-        states = {idx:list(t.keys()) for idx, t in self.parser._parse_table.states.items()}
+        parse_table = self.parser._parse_table
+        states = {idx:parse_table.expected_terminals(idx) for idx in range(len(parse_table.action_rows))}
         always_accept = self.postlex.always_accept if self.postlex else ()
         self.lexer = ContextualLexer(self.lexer_conf.tokens, states,
                                      ignore=self.lexer_conf.ignore,
@@ -140,11 +247,25 @@ class Earley(WithLexer):
 
         resolve_ambiguity = options.ambiguity == 'resolve'
         debug = options.debug if options else False
-        self.parser = earley.Parser(parser_conf, self.match, resolve_ambiguity=resolve_ambiguity, debug=debug)
+        self.parser = earley.Parser(parser_conf, self.match, resolve_ambiguity=resolve_ambiguity, debug=debug,
+                                    filter_predictions=True, beam_width=options.beam_width,
+                                    low_memory=options.low_memory)
 
     def match(self, term, token):
         return term.name == token.type
 
+    def parse(self, text, start=None, lex_bytes=False):
+        budget = self._new_budget()
+        return self.parser.parse(self.lex(text, lex_bytes, budget), self._get_start(start), budget)
+
+    def recognize(self, text, start=None):
+        budget = self._new_budget()
+        return self.parser.recognize(self.lex(text, budget=budget), self._get_start(start), budget)
+
+    def parse_forest(self, text, start=None, create_callback=None):
+        budget = self._new_budget()
+        return self.parser.parse_forest(self.lex(text, budget=budget), self._get_start(start), create_callback, budget)
+
 
 class XEarley(_ParserFrontend):
     def __init__(self, lexer_conf, parser_conf, options=None, **kw):
@@ -159,14 +280,37 @@ class XEarley(_ParserFrontend):
                                     ignore=lexer_conf.ignore,
                                     resolve_ambiguity=resolve_ambiguity,
                                     debug=debug,
+                                    beam_width=options.beam_width,
+                                    low_memory=options.low_memory,
+                                    term_first_chars=self.first_chars,
+                                    terms_matcher=self.match_terms,
                                     **kw
                                     )
 
     def match(self, term, text, index=0):
         return self.regexps[term.name].match(text, index)
 
+    def match_terms(self, names, text, index):
+        """Returns a list of (name, matched text) for each of the given terminals (by name) that matches at the index.
+
+        Only the terminals that may begin with the character at the index are tried. They're looked up in a table
+        that's kept for each set of terminals, and filled one character at a time."""
+        try:
+            terms_by_char = self.terms_by_char[names]
+        except KeyError:
+            terms_by_char = self.terms_by_char[names] = _TermsByChar(self, names)
+
+        found = []
+        for regexp, name in terms_by_char[text[index:index+1]]:
+            m = regexp.match(text, index)
+            if m:
+                found.append((name, m.group(0)))
+        return found
+
     def _prepare_match(self, lexer_conf):
         self.regexps = {}
+        self.first_chars = {}
+        self.terms_by_char = {}
         for t in lexer_conf.tokens:
             if t.priority != 1:
                 raise ValueError("Dynamic Earley doesn't support weights on terminals", t, t.priority)
@@ -180,14 +324,62 @@ class XEarley(_ParserFrontend):
                     raise ValueError("Dynamic Earley doesn't allow zero-width regexps", t)
 
             self.regexps[t.name] = re.compile(regexp)
+            self.first_chars[t.name] = get_regexp_first_chars(regexp)
 
     def parse(self, text, start):
-        return self._parse(text, start)
+        return self._parse(text, start, self._new_budget())
+
+    def recognize(self, text, start=None):
+        return self.parser.recognize(text, self._get_start(start), self._new_budget())
+
+    def parse_forest(self, text, start=None, create_callback=None):
+        return self.parser.parse_forest(text, self._get_start(start), create_callback, self._new_budget())
+
+class _TermsByChar(dict):
+    "The (regexp, name) of the terminals in a set that may begin with each character, which are found when first needed"
+    def __init__(self, frontend, names):
+        self.regexps = [(frontend.regexps[name], name, frontend.first_chars[name]) for name in names]
+
+    def __missing__(self, char):
+        terms = self[char] = [(regexp, name) for regexp, name, chars in self.regexps
+                              if chars is None or char in chars]
+        return terms
 
 class XEarley_CompleteLex(XEarley):
     def __init__(self, *args, **kw):
-        XEarley.__init__(self, *args, complete_lex=True, **kw)
+        XEarley.__init__(self, *args, complete_lex=True, prefixes_matcher=self.match_prefixes, **kw)
 
+    def _prepare_match(self, lexer_conf):
+        XEarley._prepare_match(self, lexer_conf)
+        self.prefixes = {}
+        self.min_width = {}
+        for t in lexer_conf.tokens:
+            regexp = t.pattern.to_regexp()
+            min_width, max_width = get_regexp_width(regexp)
+            self.min_width[t.name] = min_width
+            self.prefixes[t.name] = (max_width, 0, None) if min_width == max_width else get_regexp_prefixes(regexp)
+
+    def match_prefixes(self, name, text, start, end):
+        """Returns the end indices of the matches of the terminal at start, that are shorter than its match up to end,
+        longest first.
+
+        For simple regexps (e.g. /\\w+/ or /"[^"]*"/), only the end of each prefix has to be checked (see
+        get_regexp_prefixes). Otherwise, the regexp is matched with each shorter endpos, on the same text."""
+        prefixes = self.prefixes[name]
+        if prefixes is not None:
+            min_width, suffix_width, suffix = prefixes
+            ends = range(end - 1, start + min_width - 1, -1)
+            if suffix is None:
+                return ends
+            return [j for j in ends if suffix.match(text, j - suffix_width, j)]
+
+        regexp = self.regexps[name]
+        found = []
+        for j in range(end - 1, start + self.min_width[name] - 1, -1):
+            m = regexp.match(text, start, j)
+            if m and m.end() not in found[-1:]:
+                found.append(m.end())
+        return found
 
 
 class CYK(WithLexer):
@@ -201,12 +393,15 @@ class CYK(WithLexer):
 
         self.callbacks = parser_conf.callbacks
 
-    def parse(self, text, start):
-        tokens = list(self.lex(text))
+    def parse(self, text, start, lex_bytes=False):
+        tokens = list(self.lex(text, lex_bytes))
         parse = self._parse(tokens, start)
         parse = self._transform(parse)
         return parse
 
+    def recognize(self, text, start=None):
+        return self.parser.recognize(list(self.lex(text)), self._get_start(start))
+
     def _transform(self, tree):
         subtrees = list(tree.iter_subtrees())
         for subtree in subtrees:
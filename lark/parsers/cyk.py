@@ -111,6 +111,18 @@ class Parser(object):
         parse = trees[(0, len(tokenized) - 1)][start]
         return self._to_tree(revert_cnf(parse))
 
+    def recognize(self, tokenized, start):
+        """Returns True if the input (a list of tokens) matches the grammar, or raises ParseError.
+
+        Only the symbols that match each span are computed, without building the parse trees."""
+        assert start
+        start = NT(start)
+
+        table = _recognize(tokenized, self.grammar)
+        if start not in table[(0, len(tokenized) - 1)]:
+            raise ParseError('Parsing failed.')
+        return True
+
     def _to_tree(self, rule_node):
         """Converts a RuleNode parse tree to a lark Tree."""
         orig_rule = self.orig_rules[rule_node.rule.alias]
@@ -172,6 +184,24 @@ def _parse(s, g):
     return table, trees
 
 
+def _recognize(s, g):
+    """Like _parse, but only finds the symbols (rule lhs) that match each span of 's'."""
+    table = defaultdict(set)
+    for i, w in enumerate(s):
+        for terminal, rules in g.terminal_rules.items():
+            if match(terminal, w):
+                table[(i, i)].update(rule.lhs for rule in rules)
+
+    for l in xrange(2, len(s) + 1):
+        for i in xrange(len(s) - l + 1):
+            symbols = table[(i, i + l - 1)]
+            for p in xrange(i + 1, i + l):
+                for lhs1, lhs2 in itertools.product(table[(i, p - 1)], table[(p, i + l - 1)]):
+                    for rule in g.nonterminal_rules.get((lhs1, lhs2), ()):
+                        symbols.add(rule.lhs)
+    return table
+
+
 # This section implements context-free grammar converter to Chomsky normal form.
 # It also implements a conversion of parse trees from its CNF to the original
 # grammar.
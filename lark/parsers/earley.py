@@ -12,20 +12,32 @@ is better documented here:
 
 import logging
 from collections import deque
+from functools import partial
+from itertools import chain
 
 from ..visitors import Transformer_InPlace, v_args
 from ..exceptions import UnexpectedEOF, UnexpectedToken
 from .grammar_analysis import GrammarAnalyzer
 from ..grammar import NonTerminal
+from ..utils import classify
 from .earley_common import Item, TransitiveItem
-from .earley_forest import ForestToTreeVisitor, ForestSumVisitor, SymbolNode, ForestToAmbiguousTreeVisitor
+from .earley_forest import ForestToTreeVisitor, ForestSumVisitor, SymbolNode, PrunedSymbolNode, ForestToAmbiguousTreeVisitor, ParseForest
 
 class Parser:
-    def __init__(self, parser_conf, term_matcher, resolve_ambiguity=True, debug=False):
+    profiler = None
+
+    def __init__(self, parser_conf, term_matcher, resolve_ambiguity=True, debug=False, filter_predictions=False, beam_width=None,
+                 low_memory=False):
         analysis = GrammarAnalyzer(parser_conf)
         self.parser_conf = parser_conf
         self.resolve_ambiguity = resolve_ambiguity
         self.debug = debug
+        # Skip the predictions that can't begin with the type of the next token
+        self.filter_predictions = filter_predictions
+        # Keep at most beam_width derivations in each symbol node (see PrunedSymbolNode)
+        self.SymbolNode = partial(PrunedSymbolNode, beam_width=beam_width) if beam_width else SymbolNode
+        # Drop the completed columns that the pending items can't refer to anymore (see RetainedColumns)
+        self.low_memory = low_memory
 
         self.FIRST = analysis.FIRST
         self.NULLABLE = analysis.NULLABLE
@@ -48,20 +60,66 @@ class Parser:
             if self.forest_sum_visitor is None and rule.options and rule.options.priority is not None:
                 self.forest_sum_visitor = ForestSumVisitor
 
+        ## For each rule, the terminals that it may begin with, for filtering the predictions by the lookahead.
+        #  Nullable rules are never filtered out, since they may complete without consuming anything.
+        self.RULE_FIRST = {}
+        for rule in parser_conf.rules:
+            first = set()
+            for sym in rule.expansion:
+                first |= self.FIRST[sym]
+                if sym not in self.NULLABLE:
+                    self.RULE_FIRST[rule] = first
+                    break
+
+        self.lookahead_predictions = {}
+
         self.term_matcher = term_matcher
 
+    def match_lookahead(self, term, lookahead):
+        "Returns whether a token with the given lookahead (the type of the next token) may match the terminal"
+        return term.name == lookahead
+
+    def predictions_for(self, lookahead):
+        "Returns the predictions for each non-terminal, leaving out the rules that can't begin with the lookahead"
+        try:
+            return self.lookahead_predictions[lookahead]
+        except KeyError:
+            predictions = self.lookahead_predictions[lookahead] = _LookaheadPredictions(self, lookahead)
+            return predictions
+
+    def expected_terminals(self, to_scan, expected_symbols):
+        """Returns the names of the terminals that were expected for the next token.
 
-    def predict_and_complete(self, i, to_scan, columns, transitives):
+        Includes the terminals of the predictions that were skipped because of the lookahead."""
+        expected = {item.expect.name for item in to_scan}
+        for sym in expected_symbols:
+            if not sym.is_term:
+                expected |= {t.name for t in self.FIRST[sym]}
+        return expected
+
+
+    def predict_and_complete(self, i, to_scan, columns, transitives, expects, node_cache, build_forest=True, lookahead=None, budget=None):
         """The core Earley Predictor and Completer.
 
         At each stage of the input, we handling any completed items (things
         that matched on the last cycle) and use those to predict what should
         come next in the input stream. The completions and any predicted
         non-terminals are recursively processed until we reach a set of,
-        which can be added to the scan list for the next scanner cycle."""
+        which can be added to the scan list for the next scanner cycle.
+
+        Once the column is done, its items are indexed by the symbol they expect,
+        and the index is appended to expects.
+
+        node_cache holds the symbol nodes that end at i, by label. It's shared with the
+        scanner that created the column, so that each label has a single node.
+
+        If build_forest is false, no SPPF nodes are created (for recognition only).
+        If a lookahead is given, predictions that can't begin with it are skipped.
+        If a budget is given, the items and packed nodes of the column are added to it."""
         # Held Completions (H in E.Scotts paper).
-        node_cache = {}
         held_completions = {}
+        SymbolNode = self.SymbolNode
+        predictions = self.predictions if lookahead is None else self.predictions_for(lookahead)
 
         column = columns[i]
         # R (items) = Ei (column.items)
@@ -71,30 +129,23 @@ class Parser:
 
             ### The Earley completer
             if item.is_complete:   ### (item.s == string)
-                if item.node is None:
+                if item.node is None and build_forest:
                     label = (item.s, item.start, i)
                     item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
                     item.node.add_family(item.s, item.rule, item.start, None, None)
 
-                # create_leo_transitives(item.rule.origin, item.start)
-
                 ###R Joop Leo right recursion Completer
-                if item.rule.origin in transitives[item.start]:
-                    transitive = transitives[item.start][item.s]
-                    if transitive.previous in transitives[transitive.column]:
-                        root_transitive = transitives[transitive.column][transitive.previous]
-                    else:
-                        root_transitive = transitive
-
+                # If this completion can only lead to a deterministic chain of completions,
+                # jump straight to the top of the chain. The SPPF nodes for the skipped
+                # steps are only created if the forest is walked (see SymbolNode.load_paths).
+                transitive = None if item.start == i else self.leo_transitive(item.s, item.start, columns, transitives, expects)
+                if transitive is not None:
                     new_item = Item(transitive.rule, transitive.ptr, transitive.start)
-                    label = (root_transitive.s, root_transitive.start, i)
-                    new_item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
-                    new_item.node.add_path(root_transitive, item.node)
-                    if new_item.expect in self.TERMINALS:
-                        # Add (B :: aC.B, h, y) to Q
-                        to_scan.add(new_item)
-                    elif new_item not in column:
-                        # Add (B :: aC.B, h, y) to Ei and R
+                    if build_forest:
+                        label = (new_item.s, new_item.start, i)
+                        new_item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
+                        new_item.node.add_path(transitive, item.node, node_cache)
+                    if new_item not in column:
                         column.add(new_item)
                         items.append(new_item)
                 ###R Regular Earley completer
@@ -108,12 +159,12 @@ class Parser:
                     if is_empty_item:
                         held_completions[item.rule.origin] = item.node
 
-                    originators = [originator for originator in columns[item.start] if originator.expect is not None and originator.expect == item.s]
-                    for originator in originators:
+                    for originator in self.originators(item.s, item.start, columns, expects):
                         new_item = originator.advance()
-                        label = (new_item.s, originator.start, i)
-                        new_item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
-                        new_item.node.add_family(new_item.s, new_item.rule, i, originator.node, item.node)
+                        if build_forest:
+                            label = (new_item.s, originator.start, i)
+                            new_item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
+                            new_item.node.add_family(new_item.s, new_item.rule, i, originator.node, item.node)
                         if new_item.expect in self.TERMINALS:
                             # Add (B :: aC.B, h, y) to Q
                             to_scan.add(new_item)
@@ -125,16 +176,17 @@ class Parser:
             ### The Earley predictor
             elif item.expect in self.NON_TERMINALS: ### (item.s == lr0)
                 new_items = []
-                for rule in self.predictions[item.expect]:
+                for rule in predictions[item.expect]:
                     new_item = Item(rule, 0, i)
                     new_items.append(new_item)
 
                 # Process any held completions (H).
                 if item.expect in held_completions:
                     new_item = item.advance()
-                    label = (new_item.s, item.start, i)
-                    new_item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
-                    new_item.node.add_family(new_item.s, new_item.rule, new_item.start, item.node, held_completions[item.expect])
+                    if build_forest:
+                        label = (new_item.s, item.start, i)
+                        new_item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
+                        new_item.node.add_family(new_item.s, new_item.rule, new_item.start, item.node, held_completions[item.expect])
                     new_items.append(new_item)
 
                 for new_item in new_items:
@@ -144,76 +196,58 @@ class Parser:
                         column.add(new_item)
                         items.append(new_item)
 
-    def _parse(self, stream, columns, to_scan, start_symbol=None):
-        def is_quasi_complete(item):
-            if item.is_complete:
-                return True
-
-            quasi = item.advance()
-            while not quasi.is_complete:
-                if quasi.expect not in self.NULLABLE:
-                    return False
-                if quasi.rule.origin == start_symbol and quasi.expect == start_symbol:
-                    return False
-                quasi = quasi.advance()
-            return True
-
-        def create_leo_transitives(origin, start):
-            visited = set()
-            to_create = []
-            trule = None
-            previous = None
-
-            ### Recursively walk backwards through the Earley sets until we find the
-            #   first transitive candidate. If this is done continuously, we shouldn't
-            #   have to walk more than 1 hop.
-            while True:
-                if origin in transitives[start]:
-                    previous = trule = transitives[start][origin]
-                    break
-
-                is_empty_rule = not self.FIRST[origin]
-                if is_empty_rule:
-                    break
-
-                candidates = [ candidate for candidate in columns[start] if candidate.expect is not None and origin == candidate.expect ]
-                if len(candidates) != 1:
-                    break
-                originator = next(iter(candidates))
-
-                if originator is None or originator in visited:
-                    break
-
-                visited.add(originator)
-                if not is_quasi_complete(originator):
-                    break
-
-                trule = originator.advance()
-                if originator.start != start:
-                    visited.clear()
-
-                to_create.append((origin, start, originator))
-                origin = originator.rule.origin
-                start = originator.start
-
-            # If a suitable Transitive candidate is not found, bail.
-            if trule is None:
-                return
-
-            #### Now walk forwards and create Transitive Items in each set we walked through; and link
-            #    each transitive item to the next set forwards.
-            while to_create:
-                origin, start, originator = to_create.pop()
-                titem = None
-                if previous is not None:
-                        titem = previous.next_titem = TransitiveItem(origin, trule, originator, previous.column)
-                else:
-                        titem = TransitiveItem(origin, trule, originator, start)
-                previous = transitives[start][origin] = titem
-
-
-
-        def scan(i, token, to_scan):
+        if self.profiler:
+            self.profiler.counters['earley_items'] += len(column) + len(to_scan)
+        if budget is not None:
+            budget.earley_step(i, len(column) + len(to_scan), _count_families(node_cache))
+
+        expects.append(classify((item for item in column if item.expect is not None), lambda item: item.expect))
+
+    def originators(self, symbol, start, columns, expects):
+        "Returns the items in columns[start] that expect the given symbol"
+        if start < len(expects):
+            return expects[start].get(symbol, ())
+        # The column is still being processed, so it isn't indexed yet
+        return [item for item in columns[start] if item.expect is not None and item.expect == symbol]
+
+    def leo_transitive(self, symbol, start, columns, transitives, expects):
+        """Returns the transitive item for completing symbol from columns[start], or None.
+
+        Completing the symbol is deterministic when exactly one item in the column expects it,
+        and that item is complete once advanced. The transitive item then points to the top
+        of the chain of such completions (Joop Leo's optimization for right recursion).
+        Transitive items (and their absence) are memoized per column, so each is only
+        computed once."""
+        chain = []
+        seen = set()
+        while symbol not in transitives[start]:
+            candidates = self.originators(symbol, start, columns, expects)
+            if len(candidates) != 1:
+                transitives[start][symbol] = None
+                break
+            originator = candidates[0]
+            if originator.ptr + 1 != len(originator.rule.expansion):
+                transitives[start][symbol] = None
+                break
+            if (symbol, start) in seen:
+                # A cycle of unit rules. Leave these to the regular completer.
+                for symbol, start, _ in chain:
+                    transitives[start][symbol] = None
+                return None
+            seen.add((symbol, start))
+            chain.append((symbol, start, originator))
+            symbol, start = originator.rule.origin, originator.start
+
+        # Walk back down the chain, creating a transitive item in each column we passed
+        above = transitives[start][symbol]
+        for symbol, start, originator in reversed(chain):
+            titem = TransitiveItem(symbol, above if above is not None else originator.advance(), originator, start)
+            titem.next_titem = above
+            above = transitives[start][symbol] = titem
+        return above
+
+    def _parse(self, stream, columns, to_scan, start_symbol=None, build_forest=True, budget=None):
+        def scan(i, token, to_scan, node_cache):
             """The core Earley Scanner.
 
             This is a custom implementation of the scanner that uses the
@@ -225,14 +259,14 @@ class Parser:
             next_set = set()
             columns.append(next_set)
             transitives.append({})
-            node_cache = {}
 
             for item in set(to_scan):
                 if match(item.expect, token):
                     new_item = item.advance()
-                    label = (new_item.s, new_item.start, i)
-                    new_item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
-                    new_item.node.add_family(new_item.s, item.rule, new_item.start, item.node, token)
+                    if build_forest:
+                        label = (new_item.s, new_item.start, i + 1)
+                        new_item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
+                        new_item.node.add_family(new_item.s, item.rule, new_item.start, item.node, token)
 
                     if new_item.expect in self.TERMINALS:
                         # add (B ::= Aai+1.B, h, y) to Q'
@@ -242,7 +276,7 @@ class Parser:
                         next_set.add(new_item)
 
             if not next_set and not next_to_scan:
-                expect = {i.expect.name for i in to_scan}
+                expect = self.expected_terminals(to_scan, expects[i])
                 raise UnexpectedToken(token, expect, considered_rules = set(to_scan))
 
             return next_to_scan
@@ -250,9 +284,13 @@ class Parser:
 
         # Define parser functions
         match = self.term_matcher
+        SymbolNode = self.SymbolNode
 
         # Cache for nodes & tokens created in a particular parse step.
         transitives = [{}]
+        node_cache = {}
+        # For each completed column, its items indexed by the symbol they expect.
+        expects = []
 
         ## The main Earley loop.
         # Run the Prediction/Completion cycle for any Items in the current Earley set.
@@ -260,22 +298,39 @@ class Parser:
         # processed down to terminals/empty nodes to be added to the scanner for the next
         # step.
         i = 0
+        filter_predictions = self.filter_predictions
+        retained = self._retained_columns(columns, transitives, expects)
         for token in stream:
-            self.predict_and_complete(i, to_scan, columns, transitives)
+            self.predict_and_complete(i, to_scan, columns, transitives, expects, node_cache, build_forest,
+                                      token.type if filter_predictions else None, budget)
 
-            to_scan = scan(i, token, to_scan)
+            node_cache = {}
+            to_scan = scan(i, token, to_scan, node_cache)
+            if retained is not None:
+                retained.add(i)
+            if not build_forest or self.low_memory:
+                # Completed columns are only referenced through their index in expects
+                columns[i] = None
             i += 1
+            if self.low_memory:
+                retained.release(chain(columns[i], to_scan))
 
-        self.predict_and_complete(i, to_scan, columns, transitives)
+        self.predict_and_complete(i, to_scan, columns, transitives, expects, node_cache, build_forest, budget=budget)
+        if retained is not None:
+            retained.add(i)
+            retained.report(self.profiler)
 
         ## Column is now the final column in the parse.
         assert i == len(columns)-1
         return to_scan
 
-    def parse(self, stream, start):
-        assert start, start
-        start_symbol = NonTerminal(start)
+    def _retained_columns(self, columns, transitives, expects):
+        "Returns the RetainedColumns of a parse, if it's needed for releasing the columns or for the profiler"
+        if self.low_memory or self.profiler:
+            return RetainedColumns(columns, transitives, expects)
+        return None
 
+    def _predict_start(self, start_symbol):
         columns = [set()]
         to_scan = set()     # The scan buffer. 'Q' in E.Scott's paper.
 
@@ -288,8 +343,30 @@ class Parser:
                 to_scan.add(item)
             else:
                 columns[0].add(item)
+        return columns, to_scan
 
-        to_scan = self._parse(stream, columns, to_scan, start_symbol)
+    def recognize(self, stream, start, budget=None):
+        """Returns True if the stream matches the grammar, or raises UnexpectedInput if it doesn't.
+
+        Only the Earley sets are computed, without a parse forest."""
+        assert start, start
+        start_symbol = NonTerminal(start)
+
+        columns, to_scan = self._predict_start(start_symbol)
+        to_scan = self._parse(stream, columns, to_scan, start_symbol, build_forest=False, budget=budget)
+
+        if not any(n.is_complete and n.s == start_symbol and n.start == 0 for n in columns[-1]):
+            expected_tokens = [t.expect for t in to_scan]
+            raise UnexpectedEOF(expected_tokens)
+        return True
+
+    def _parse_forest(self, stream, start, budget=None):
+        "Returns the root of the SPPF"
+        assert start, start
+        start_symbol = NonTerminal(start)
+
+        columns, to_scan = self._predict_start(start_symbol)
+        to_scan = self._parse(stream, columns, to_scan, start_symbol, budget=budget)
 
         # If the parse was successful, the start
         # symbol should have been completed in the last step of the Earley cycle, and will be in
@@ -310,12 +387,97 @@ class Parser:
             raise UnexpectedEOF(expected_tokens)
         elif len(solutions) > 1:
             assert False, 'Earley should not generate multiple start symbol items!'
+        return solutions[0]
+
+    def parse_forest(self, stream, start, create_callback=None, budget=None):
+        "Returns the ParseForest of the stream, whose derivations can be enumerated lazily, or transformed"
+        return ParseForest(self._parse_forest(stream, start, budget), self.callbacks,
+                           self.forest_sum_visitor and self.forest_sum_visitor(), create_callback)
+
+    def parse(self, stream, start, budget=None):
+        root = self._parse_forest(stream, start, budget)
 
         # Perform our SPPF -> AST conversion using the right ForestVisitor.
         forest_tree_visitor_cls = ForestToTreeVisitor if self.resolve_ambiguity else ForestToAmbiguousTreeVisitor
         forest_tree_visitor = forest_tree_visitor_cls(self.callbacks, self.forest_sum_visitor and self.forest_sum_visitor())
 
-        return forest_tree_visitor.visit(solutions[0])
+        if self.profiler:
+            return self.profiler.make_wrapper('forest_to_tree', forest_tree_visitor.visit)(root)
+        return forest_tree_visitor.visit(root)
+
+
+class RetainedColumns(object):
+    """Keeps track of the completed columns of a parse, and releases those that can't be referenced anymore.
+
+    An item only refers back to the column where it started: once complete, it advances the items there
+    that expect its symbol (through expects and transitives). Those items refer to their own start columns,
+    and so on. So the columns that can't be reached this way from the pending items are never looked at again,
+    and release() drops their items, indices and transitive items.
+
+    The columns are only swept after the number of retained columns has doubled, so it costs O(1) per step,
+    amortized. peak is the largest number of items that were retained at once."""
+    MIN_SWEEP = 16
+
+    def __init__(self, columns, transitives, expects):
+        self.columns = columns
+        self.transitives = transitives
+        self.expects = expects
+        self.sizes = {}     # The number of items of each retained column, by index
+        self.items = 0
+        self.peak = 0
+        self.next_sweep = self.MIN_SWEEP
+
+    def add(self, i):
+        "Adds columns[i] to the retained columns, once it's complete"
+        size = self.sizes[i] = len(self.columns[i])
+        self.items += size
+        if self.items > self.peak:
+            self.peak = self.items
+
+    def release(self, pending_items):
+        "Drops the completed columns that can't be reached from the pending items (if it's time for a sweep)"
+        if len(self.sizes) < self.next_sweep:
+            return
+        expects = self.expects
+        reachable = set()
+        starts = {item.start for item in pending_items}
+        while starts:
+            start = starts.pop()
+            if start in reachable or start >= len(expects):
+                continue
+            reachable.add(start)
+            for items in expects[start].values():
+                starts |= {item.start for item in items}
+
+        for i in list(self.sizes):
+            if i not in reachable:
+                self.items -= self.sizes.pop(i)
+                self.columns[i] = self.transitives[i] = self.expects[i] = None
+        self.next_sweep = max(self.MIN_SWEEP, 2 * len(self.sizes))
+
+    def report(self, profiler):
+        if profiler:
+            counters = profiler.counters
+            counters['earley_items_peak'] = max(counters['earley_items_peak'], self.peak)
+
+
+def _count_families(node_cache):
+    "Returns the number of packed nodes in the symbol nodes of an Earley step"
+    return sum(len(node._children) for node in node_cache.values())
+
+
+class _LookaheadPredictions(dict):
+    "The predictions for a single lookahead, which are filtered when they are first needed"
+    def __init__(self, parser, lookahead):
+        self.parser = parser
+        self.lookahead = lookahead
+
+    def __missing__(self, origin):
+        parser = self.parser
+        rules = self[origin] = [rule for rule in parser.predictions[origin]
+                                if rule not in parser.RULE_FIRST
+                                or any(parser.match_lookahead(t, self.lookahead) for t in parser.RULE_FIRST[rule])]
+        return rules
 
 
 class ApplyCallbacks(Transformer_InPlace):
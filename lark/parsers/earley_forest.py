@@ -10,8 +10,11 @@ http://www.bramvandersanden.com/post/2014/06/shared-packed-parse-forest/
 from random import randint
 from math import isinf
 from collections import deque
+from heapq import heappush, heappop
 from operator import attrgetter
 from importlib import import_module
+from functools import partial
+from copy import copy
 
 from ..tree import Tree
 from ..exceptions import ParseError
@@ -33,14 +36,16 @@ class SymbolNode(ForestNode):
 
     Hence a Symbol Node with a single child is unambiguous.
     """
-    __slots__ = ('s', 'start', 'end', '_children', 'paths', 'paths_loaded', 'priority', 'is_intermediate', '_hash')
+    __slots__ = ('s', 'start', 'end', '_children', '_sorted_children', 'paths', 'paths_loaded', 'node_cache', 'priority', 'is_intermediate', '_hash')
     def __init__(self, s, start, end):
         self.s = s
         self.start = start
         self.end = end
         self._children = set()
-        self.paths = set()
+        self._sorted_children = None
+        self.paths = []
         self.paths_loaded = False
+        self.node_cache = None
 
         ### We use inf here as it can be safely negated without resorting to conditionals,
         #   unlike None or float('NaN'), and sorts appropriately.
@@ -49,31 +54,77 @@ class SymbolNode(ForestNode):
         self._hash = hash((self.s, self.start, self.end))
 
     def add_family(self, lr0, rule, start, left, right):
+        if left is self or right is self:
+            return  # A unit cycle back to this node (e.g. "a: a"), which adds no derivation
         self._children.add(PackedNode(self, lr0, rule, start, left, right))
+        self._sorted_children = None
 
-    def add_path(self, transitive, node):
-        self.paths.add((transitive, node))
+    def add_path(self, transitive, node, node_cache):
+        """Adds a Leo path, to be expanded by load_paths.
+
+        node_cache holds the symbol nodes of the Earley step that ends with this node, by label."""
+        path = (transitive, node)
+        if path not in self.paths:
+            self.paths.append(path)
+        self.node_cache = node_cache
 
     def load_paths(self):
+        """Expands the Leo paths of this node into the chain of symbol nodes that they skipped.
+
+        Each path is a transitive item and the completed node at the bottom of its chain.
+        The skipped nodes are looked up in the node cache of the Earley step, so a label that
+        was already completed some other way keeps a single node, and paths that meet along
+        the way are merged. The paths are expanded in the order they were added."""
+        nodes = self.node_cache
         for transitive, node in self.paths:
-            if transitive.next_titem is not None:
-                vn = SymbolNode(transitive.next_titem.s, transitive.next_titem.start, self.end)
-                vn.add_path(transitive.next_titem, node)
-                self.add_family(transitive.reduction.rule.origin, transitive.reduction.rule, transitive.reduction.start, transitive.reduction.node, vn)
-            else:
-                self.add_family(transitive.reduction.rule.origin, transitive.reduction.rule, transitive.reduction.start, transitive.reduction.node, node)
+            while True:
+                originator = transitive.reduction
+                lr0 = originator.rule.origin
+                if transitive.next_titem is None:
+                    self.add_family(lr0, originator.rule, originator.start, originator.node, node)
+                    break
+
+                label = (lr0, originator.start, self.end)
+                if label in nodes:
+                    # The rest of the chain is already linked, either by another path or because
+                    # the node was completed in the Earley step, and so had its own Leo path
+                    nodes[label].add_family(lr0, originator.rule, originator.start, originator.node, node)
+                    break
+                parent = nodes[label] = self._new_node(*label)
+                parent.add_family(lr0, originator.rule, originator.start, originator.node, node)
+                node = parent
+                transitive = transitive.next_titem
         self.paths_loaded = True
+        self.node_cache = None
+
+    def _new_node(self, s, start, end):
+        "Creates the symbol nodes along the Leo paths (see load_paths)"
+        return SymbolNode(s, start, end)
+
+    def reset_order(self):
+        "Forgets the order of the children, so that it's sorted again after their priorities changed"
+        self._sorted_children = None
 
     @property
     def is_ambiguous(self):
-        return len(self.children) > 1
+        if not self.paths_loaded: self.load_paths()
+        return len(self._children) > 1
 
     @property
     def children(self):
-        if not self.paths_loaded: self.load_paths()
-        return sorted(self._children, key=attrgetter('sort_key'))
+        """The packed nodes, in order of preference (see PackedNode.sort_key).
+
+        The order is computed once, and kept until a family is added or reset_order() is called."""
+        if self._sorted_children is None:
+            if not self.paths_loaded: self.load_paths()
+            if len(self._children) > 1:
+                self._sorted_children = sorted(self._children, key=attrgetter('sort_key'))
+            else:
+                self._sorted_children = list(self._children)
+        return self._sorted_children
 
     def __iter__(self):
+        if not self.paths_loaded: self.load_paths()
         return iter(self._children)
 
     def __eq__(self, other):
@@ -95,6 +146,47 @@ class SymbolNode(ForestNode):
             symbol = self.s.name
         return "({}, {}, {}, {})".format(symbol, self.start, self.end, self.priority)
 
+class PrunedSymbolNode(SymbolNode):
+    """
+    A Symbol Node that keeps at most beam_width families, so that the forest stays
+    bounded on highly ambiguous input.
+
+    The families are ranked like in PackedNode.sort_key, but with their priorities
+    estimated from what was parsed so far: the priority of their rule, plus the best
+    priority found so far for their left and right nodes. When a family doesn't fit,
+    the worst one is dropped (the new one, unless it's strictly better).
+
+    The exact priorities of the remaining families are still computed by ForestSumVisitor.
+    """
+    __slots__ = ('beam_width', 'beam_priority')
+    def __init__(self, s, start, end, beam_width):
+        SymbolNode.__init__(self, s, start, end)
+        self.beam_width = beam_width
+        self.beam_priority = 0
+
+    def add_family(self, lr0, rule, start, left, right):
+        if left is self or right is self:
+            return
+        packed = PackedNode(self, lr0, rule, start, left, right)
+        if packed in self._children:
+            return
+        key = self._beam_key(packed)
+        if len(self._children) >= self.beam_width:
+            worst = max(self._children, key=self._beam_key)
+            if key >= self._beam_key(worst):
+                return
+            self._children.remove(worst)
+        self.beam_priority = max(self.beam_priority, -key[1]) if self._children else -key[1]
+        self._children.add(packed)
+        self._sorted_children = None
+
+    def _beam_key(self, packed):
+        priority = _rule_priority(packed) + getattr(packed.left, 'beam_priority', 0) + getattr(packed.right, 'beam_priority', 0)
+        return packed.is_empty, -priority, packed.rule.order
+
+    def _new_node(self, s, start, end):
+        return PrunedSymbolNode(s, start, end, self.beam_width)
+
 class PackedNode(ForestNode):
     """
     A Packed Node represents a single derivation in a symbol node.
@@ -146,13 +238,62 @@ class PackedNode(ForestNode):
             symbol = self.s.name
         return "({}, {}, {}, {})".format(symbol, self.start, self.priority, self.rule.order)
 
+def _same_span(node, child):
+    return isinstance(child, SymbolNode) and child.start == node.start and child.end == node.end
+
+def _same_span_component(node, avoid):
+    """Returns the symbol nodes with the same span that node reaches without going through
+    the nodes in avoid (by id), and the ids of the ones in avoid that it runs into."""
+    component = [node]
+    seen = {id(node)}
+    blocked = set()
+    for n in component:
+        for packed in n:
+            for child in packed:
+                if _same_span(n, child) and id(child) not in seen:
+                    seen.add(id(child))
+                    if id(child) in avoid:
+                        blocked.add(id(child))
+                    else:
+                        component.append(child)
+    return component, blocked
+
+def _is_derivable(node, avoid):
+    """Returns whether the symbol node has a derivation that doesn't go through the nodes in avoid (by id).
+
+    A cycle in the forest can only go through nodes with the same span, so only they are searched.
+    Every node has some finite derivation, so unless the search runs into avoid, the answer is yes.
+    Otherwise, the nodes that are still derivable are found as a fixpoint."""
+    if id(node) in avoid:
+        return False
+    component, blocked = _same_span_component(node, avoid)
+    if not blocked:
+        return True
+
+    derivable = set()
+    changed = True
+    while changed and id(node) not in derivable:
+        changed = False
+        for n in component:
+            if id(n) not in derivable and any(all(not _same_span(n, child) or id(child) in derivable for child in packed)
+                                              for packed in n):
+                derivable.add(id(n))
+                changed = True
+    return id(node) in derivable
+
+def _is_acyclic(packed, visiting):
+    """Returns whether the packed node has a derivation that doesn't lead back into the
+    symbol nodes that are being visited (by id), so that it can be chosen for a tree."""
+    parent = packed.parent
+    return all(not _same_span(parent, child) or _is_derivable(child, visiting) for child in packed)
+
 class ForestVisitor(object):
     """
     An abstract base class for building forest visitors.
 
     Use this as a base when you need to walk the forest.
     """
-    __slots__ = ['result']
+    __slots__ = ['result', 'visiting']
 
     def visit_token_node(self, node): pass
     def visit_symbol_node_in(self, node): pass
@@ -167,7 +308,9 @@ class ForestVisitor(object):
         # of a symbol/intermediate so that we can process both up and down. Also,
         # since the SPPF can have cycles it allows us to detect if we're trying
         # to recurse into a node that's already on the stack (infinite recursion).
-        visiting = set()
+        # Visitors that choose between the children of a symbol node use it to skip
+        # the cyclic ones (see _is_acyclic).
+        visiting = self.visiting = set()
 
         # We do not use recursion here to walk the Forest due to the limited
         # stack size in python. Therefore input_stack is essentially our stack.
@@ -242,28 +385,39 @@ class ForestSumVisitor(ForestVisitor):
     lesser of two evils: there can be significantly more Earley
     items created during parsing than there are SPPF nodes in the
     final tree.
+
+    The priorities are memoized on the nodes: a symbol node whose
+    priority is already known isn't walked again, so each shared
+    sub-forest is only summed once, no matter how many walks reach it.
     """
     def visit_packed_node_in(self, node):
         return iter([node.left, node.right])
 
     def visit_symbol_node_in(self, node):
-        return iter(node.children)
+        if not isinf(node.priority):
+            return None
+        # Cyclic children keep their priority of -inf, so they're sorted last
+        return iter([child for child in node.children if _is_acyclic(child, self.visiting)])
 
     def visit_packed_node_out(self, node):
-        priority = node.rule.options.priority if not node.parent.is_intermediate and node.rule.options and node.rule.options.priority else 0
+        priority = _rule_priority(node)
         priority += getattr(node.right, 'priority', 0)
         priority += getattr(node.left, 'priority', 0)
         node.priority = priority
 
     def visit_symbol_node_out(self, node):
-        node.priority = max(child.priority for child in node.children)
+        if isinf(node.priority):
+            # The children's priorities are now known, so they're sorted again, once
+            node.reset_order()
+            node.priority = max(child.priority for child in node.children)
 
 class ForestToTreeVisitor(ForestVisitor):
     """
     A Forest visitor which converts an SPPF forest to an unambiguous AST.
 
     The implementation in this visitor walks only the first ambiguous child
-    of each symbol node. When it finds an ambiguous symbol node it first
+    of each symbol node, skipping the ones that lead back into a node that's
+    being visited (see _is_acyclic). When it finds an ambiguous symbol node it first
     calls the forest_sum_visitor implementation to sort the children
     into preference order using the algorithms defined there; so the first
     child should always be the highest preference. The forest_sum_visitor
@@ -286,7 +440,10 @@ class ForestToTreeVisitor(ForestVisitor):
     def visit_symbol_node_in(self, node):
         if self.forest_sum_visitor and node.is_ambiguous and isinf(node.priority):
             self.forest_sum_visitor.visit(node)
-        return next(iter(node.children))
+        for child in node.children:
+            if _is_acyclic(child, self.visiting):
+                return child
+        raise ParseError("Infinite recursion in grammar!")
 
     def visit_packed_node_in(self, node):
         if not node.parent.is_intermediate:
@@ -324,18 +481,27 @@ class ForestToAmbiguousTreeVisitor(ForestToTreeVisitor):
     def __init__(self, callbacks, forest_sum_visitor = ForestSumVisitor):
         super(ForestToAmbiguousTreeVisitor, self).__init__(callbacks, forest_sum_visitor)
 
+    def visit(self, root):
+        self.ambiguous = set()   # ids of the symbol nodes that have more than one acyclic child
+        return super(ForestToAmbiguousTreeVisitor, self).visit(root)
+
     def visit_token_node(self, node):
         self.output_stack[-1].children.append(node)
 
     def visit_symbol_node_in(self, node):
         if self.forest_sum_visitor and node.is_ambiguous and isinf(node.priority):
             self.forest_sum_visitor.visit(node)
-        if not node.is_intermediate and node.is_ambiguous:
+        children = [child for child in node.children if _is_acyclic(child, self.visiting)]
+        if not children:
+            raise ParseError("Infinite recursion in grammar!")
+        if not node.is_intermediate and len(children) > 1:
+            self.ambiguous.add(id(node))
             self.output_stack.append(Tree('_ambig', []))
-        return iter(node.children)
+        return iter(children)
 
     def visit_symbol_node_out(self, node):
-        if not node.is_intermediate and node.is_ambiguous:
+        if id(node) in self.ambiguous:
+            self.ambiguous.remove(id(node))
             result = self.output_stack.pop()
             if self.output_stack:
                 self.output_stack[-1].children.append(result)
@@ -355,6 +521,272 @@ class ForestToAmbiguousTreeVisitor(ForestToTreeVisitor):
             else:
                 self.result = result
 
+def _rule_priority(packed):
+    rule = packed.rule
+    return rule.options.priority if not packed.parent.is_intermediate and rule.options and rule.options.priority else 0
+
+_NO_CONTEXT = frozenset()
+
+def _child_context(parent, child, context):
+    "Returns the context of the child in the derivations of parent in context (see ParseForest)"
+    if not _same_span(parent, child):
+        return _NO_CONTEXT
+    _, blocked = _same_span_component(child, context | {id(parent)})
+    return frozenset(blocked)
+
+class _Derivations(object):
+    """The derivations of a symbol node (in a context) that were found so far, best first, and the candidates for the next ones.
+
+    Each family is (packed node, left context, right context). The families that lead straight back into
+    a node of the context are left out. Each derivation is (score, rank, i, j), where rank is the index
+    of its family, and i and j are the indices of the derivations of its left and right symbol nodes."""
+    __slots__ = ('found', 'candidates', 'seen', 'families')
+    def __init__(self, node, context):
+        self.found = []
+        self.candidates = []
+        self.seen = set()
+        self.families = []
+        for packed in node.children:
+            if any(id(child) in context for child in packed):
+                continue
+            rank = len(self.families)
+            self.families.append((packed, _child_context(node, packed.left, context), _child_context(node, packed.right, context)))
+            # The score isn't known until the children's best derivations are, so start with an optimistic one
+            self.add_candidate(float('-inf'), rank, 0, 0)
+
+    def add_candidate(self, neg_score_bound, rank, i, j):
+        if (rank, i, j) not in self.seen:
+            self.seen.add((rank, i, j))
+            heappush(self.candidates, (neg_score_bound, rank, i, j, False))
+
+class ParseForest(object):
+    """The shared packed parse forest (SPPF) of a successful Earley parse.
+
+    Its derivations can be enumerated as trees, one at a time, in order of preference:
+    the highest sum of rule priorities first, and then in the order of the rules in the grammar
+    (so the first tree is the one that ambiguity='resolve' chooses).
+
+    The k-best derivations are found lazily (as in Huang & Chiang, "Better k-best parsing", 2005),
+    so only the parts of the forest that the next derivation needs are explored.
+
+    The forest may have cycles (e.g. for the rules 'a: b | "x"' and 'b: a'), but a derivation doesn't go through the same node
+    twice, like in ForestToTreeVisitor. So the derivations of a node depend on the nodes above it that it can
+    reach back to, which are its context, and they're found separately for each context.
+    """
+    def __init__(self, root, callbacks, forest_sum_visitor=None, create_callback=None):
+        self.root = root
+        self.callbacks = callbacks
+        self.forest_sum_visitor = forest_sum_visitor
+        self.create_callback = create_callback
+        self._derivations = {}
+
+    def transform(self, transformer=None):
+        """Applies the transformer's methods (or the parser's callbacks, if it's None) directly on the forest, with ForestTransformer.
+
+        Each node is transformed once, so the cost is proportional to the size of the forest, rather than
+        to the number of trees in it. Ambiguous nodes become '_ambig' trees of their alternatives,
+        or are passed to the transformer's _ambig method, if it has one."""
+        if self.forest_sum_visitor:
+            self.forest_sum_visitor.visit(self.root)
+        if transformer is None:
+            return ForestTransformer(self.callbacks).transform(self.root)
+        callbacks = self.create_callback(transformer)
+        return ForestTransformer(callbacks, getattr(transformer, '_ambig', None)).transform(self.root)
+
+    def iter_trees(self, limit=None):
+        """Yields the trees of at most limit derivations (or all of them), best first. Each tree is built when it's needed.
+
+        Each derivation is yielded once. Derivations that only differ by tokens that are filtered out
+        (e.g. in 'x: "a" | "a" "a"') still give equal trees."""
+        k = 0
+        while limit is None or k < limit:
+            self._find(self.root, k)
+            if len(self._get(self.root, _NO_CONTEXT).found) <= k:
+                return
+            yield self._tree(self.root, k)
+            k += 1
+
+    def _get(self, node, context):
+        try:
+            return self._derivations[id(node), context]
+        except KeyError:
+            derivations = self._derivations[id(node), context] = _Derivations(node, context)
+            return derivations
+
+    def _missing(self, node, context, k):
+        "Returns whether the k-th derivation of the node (if it's a symbol node) may exist, but wasn't found yet"
+        if not isinstance(node, SymbolNode):
+            return False
+        derivations = self._get(node, context)
+        return len(derivations.found) <= k and bool(derivations.candidates)
+
+    def _find(self, root, k):
+        """Finds the derivations of root up to the k-th, or as many as there are.
+
+        A candidate is only scored once the derivations of its children that it uses are found. Until then,
+        it waits in the heap with the score of the derivation it came from, which is at least as good.
+        We don't use recursion, because the forest may be deeper than Python's stack."""
+        stack = [(root, _NO_CONTEXT, k)]
+        waiting = {(id(root), _NO_CONTEXT, k)}
+        while stack:
+            node, context, k = stack[-1]
+            derivations = self._get(node, context)
+            if not self._missing(node, context, k):
+                stack.pop()
+                waiting.discard((id(node), context, k))
+                continue
+
+            neg_score, rank, i, j, scored = derivations.candidates[0]
+            packed, left_context, right_context = derivations.families[rank]
+            if scored:
+                heappop(derivations.candidates)
+                derivations.found.append((-neg_score, rank, i, j))
+                # Its successors use the next derivation of either child, which can't be better
+                if isinstance(packed.left, SymbolNode):
+                    derivations.add_candidate(neg_score, rank, i + 1, j)
+                if isinstance(packed.right, SymbolNode):
+                    derivations.add_candidate(neg_score, rank, i, j + 1)
+                continue
+
+            children = (packed.left, left_context, i), (packed.right, right_context, j)
+            for child, child_context, child_k in children:
+                if self._missing(child, child_context, child_k):
+                    if (id(child), child_context, child_k) in waiting:
+                        # It leads back into a derivation that's still being found,
+                        # so this candidate has no derivation, and the next one is tried
+                        heappop(derivations.candidates)
+                        break
+                    waiting.add((id(child), child_context, child_k))
+                    stack.append((child, child_context, child_k))
+                    break
+            else:
+                heappop(derivations.candidates)
+                score = _rule_priority(packed)
+                for child, child_context, child_k in children:
+                    if isinstance(child, SymbolNode):
+                        child_found = self._get(child, child_context).found
+                        if len(child_found) <= child_k:
+                            break   # The child has no more derivations
+                        score += child_found[child_k][0]
+                else:
+                    heappush(derivations.candidates, (-score, rank, i, j, True))
+
+    def _tree(self, root, k):
+        "Builds the tree of the k-th derivation of root, applying the callbacks like ForestToTreeVisitor"
+        output_stack = [[]]
+        stack = [(root, _NO_CONTEXT, k)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, PackedNode):
+                result = self.callbacks[item.rule](output_stack.pop())
+                output_stack[-1].append(result)
+                continue
+
+            node, context, k = item
+            if not isinstance(node, SymbolNode):
+                output_stack[-1].append(node)
+                continue
+
+            derivations = self._get(node, context)
+            _, rank, i, j = derivations.found[k]
+            packed, left_context, right_context = derivations.families[rank]
+            if not node.is_intermediate:
+                output_stack.append([])
+                stack.append(packed)
+            if packed.right is not None:
+                stack.append((packed.right, right_context, j))
+            if packed.left is not None:
+                stack.append((packed.left, left_context, i))
+
+        result ,= output_stack[0]
+        return result
+
+def _copy_tree(result):
+    "Returns a shallow copy of the result if it's a tree (along with its list of children), or the result itself"
+    if not isinstance(result, Tree):
+        return result
+    tree = copy(result)
+    tree.children = list(result.children)
+    return tree
+
+class ForestTransformer(object):
+    """Transforms an SPPF bottom-up, applying the callbacks of each rule to the children of its packed nodes.
+
+    The results are memoized for each symbol node and packed node, and reused wherever the node is shared,
+    so each callback runs once per node of the forest, instead of once per node of each tree in it.
+    (As a consequence, the results of shared nodes are shared between their parents. Trees are the exception:
+    the callbacks may change the children of their arguments, like when inlining a '_rule', so each parent
+    gets a shallow copy).
+
+    An ambiguous symbol node calls ambig with the list of the results of its alternatives, in order of
+    preference (Default: returns them in an '_ambig' tree). Like ForestToAmbiguousTreeVisitor, this can't
+    represent ambiguities in intermediate nodes, so they're resolved by taking the preferred alternative.
+    """
+    def __init__(self, callbacks, ambig=None):
+        self.callbacks = callbacks
+        self.ambig = ambig or partial(Tree, '_ambig')
+
+    def _children(self, node, context):
+        """Returns the children of the node that it's transformed from, with their contexts (see ParseForest).
+
+        The families of a symbol node that lead back into its context are left out, like in ForestToTreeVisitor."""
+        if isinstance(node, SymbolNode):
+            avoid = context | {id(node)}
+            families = [(packed, context) for packed in node.children if _is_acyclic(packed, avoid)]
+            if not families:
+                raise ParseError("Infinite recursion in grammar!")
+            return families[:1] if node.is_intermediate else families
+        return [(child, _child_context(node.parent, child, context)) for child in (node.left, node.right) if child is not None]
+
+    def _transform_node(self, node, children, results):
+        if isinstance(node, SymbolNode):
+            alternatives = [results[id(packed), context] for packed, context in children]
+            return alternatives[0] if len(alternatives) == 1 else self.ambig(alternatives)
+
+        args = []
+        for child, context in children:
+            if isinstance(child, SymbolNode):
+                if child.is_intermediate:
+                    args += results[id(child), context]
+                else:
+                    args.append(results[id(child), context])
+            else:
+                args.append(child)
+        if node.parent.is_intermediate:
+            return args
+        return self.callbacks[node.rule]([_copy_tree(arg) for arg in args])
+
+    def transform(self, root):
+        # We do not use recursion, due to the limited stack size in python.
+        results = {}
+        expanding = {}  # The children of the nodes that wait for them to be transformed
+        stack = [(root, _NO_CONTEXT)]
+        while stack:
+            node, context = stack[-1]
+            key = id(node), context
+            if key in results:
+                stack.pop()
+                continue
+
+            children = expanding.get(key)
+            if children is None:
+                children = self._children(node, context)
+                needed = [(child, child_context) for child, child_context in children
+                          if isinstance(child, ForestNode) and (id(child), child_context) not in results]
+                if needed:
+                    if any((id(child), child_context) in expanding for child, child_context in needed):
+                        raise ParseError("Infinite recursion in grammar!")
+                    expanding[key] = children
+                    stack += reversed(needed)   # So that they're transformed left to right
+                    continue
+            else:
+                del expanding[key]
+
+            results[key] = self._transform_node(node, children, results)
+            stack.pop()
+
+        return results[id(root), _NO_CONTEXT]
+
 class ForestToPyDotVisitor(ForestVisitor):
     """
     A Forest visitor which writes the SPPF to a PNG.
@@ -16,6 +16,7 @@ from .grammar_analysis import GrammarAnalyzer, Terminal, LR0ItemSet
 from ..grammar import Rule
 
 ###{standalone
+from array import array
 
 class Action:
     def __init__(self, name):
@@ -81,6 +82,103 @@ class IntParseTable(ParseTable):
         end_states = {start:state_to_idx[s] for start, s in parse_table.end_states.items()}
         return cls(int_states, start_states, end_states)
 
+
+class CompactParseTable:
+    """An integer-indexed parse table, stored in arrays. Used by the LALR parser.
+
+    Terminals, non-terminals and rules are numbered. Each state has a row of actions,
+    indexed by terminal id, and a row of gotos, indexed by non-terminal id.
+    Identical rows are shared between states.
+
+    Actions are encoded as: 0 = error, n > 0 = shift to state n-1, n < 0 = reduce by rule -n-1
+    Gotos are encoded as: -1 = error, n >= 0 = go to state n
+    """
+    def __init__(self, terminals, nonterminals, rules, action_rows, goto_rows, start_states, end_states):
+        self.terminals = terminals
+        self.nonterminals = nonterminals
+        self.rules = rules
+        self.action_rows = action_rows
+        self.goto_rows = goto_rows
+        self.start_states = start_states
+        self.end_states = end_states
+
+        self.terminal_ids = {name: i for i, name in enumerate(terminals)}
+        self.nonterminal_ids = {name: i for i, name in enumerate(nonterminals)}
+
+    @classmethod
+    def from_ParseTable(cls, parse_table):
+        if not isinstance(parse_table, IntParseTable):
+            parse_table = IntParseTable.from_ParseTable(parse_table)
+        states = parse_table.states
+        assert set(states) == set(range(len(states)))
+
+        rules = []
+        rule_ids = {}
+        for actions in states.values():
+            for action, arg in actions.values():
+                if action is Reduce and arg not in rule_ids:
+                    rule_ids[arg] = len(rules)
+                    rules.append(arg)
+
+        # Only non-terminals can be reduced. (Names aren't enough, since imported terminals may be namespaced)
+        names = {name for actions in states.values() for name in actions}
+        origins = {rule.origin.name for rule in rules}
+        terminals = sorted(names - origins)
+        nonterminals = sorted(names & origins)
+        terminal_ids = {name: i for i, name in enumerate(terminals)}
+        nonterminal_ids = {name: i for i, name in enumerate(nonterminals)}
+
+        typecode = 'h' if max(len(states), len(rules)) < 0x7fff else 'l'
+        rows_cache = {}
+        def shared_row(values):
+            values = tuple(values)
+            if values not in rows_cache:
+                rows_cache[values] = array(typecode, values)
+            return rows_cache[values]
+
+        action_rows = []
+        goto_rows = []
+        for state in range(len(states)):
+            action_row = [0] * len(terminals)
+            goto_row = [-1] * len(nonterminals)
+            for name, (action, arg) in states[state].items():
+                if name in terminal_ids:
+                    action_row[terminal_ids[name]] = arg + 1 if action is Shift else -rule_ids[arg] - 1
+                else:
+                    assert action is Shift
+                    goto_row[nonterminal_ids[name]] = arg
+            action_rows.append(shared_row(action_row))
+            goto_rows.append(shared_row(goto_row))
+
+        return cls(terminals, nonterminals, rules, action_rows, goto_rows, parse_table.start_states, parse_table.end_states)
+
+    @property
+    def states(self):
+        "The table in the format of IntParseTable (i.e. as a dict of dicts)"
+        states = {}
+        for state, (action_row, goto_row) in enumerate(zip(self.action_rows, self.goto_rows)):
+            actions = {}
+            for term, action in zip(self.terminals, action_row):
+                if action > 0:
+                    actions[term] = Shift, action - 1
+                elif action < 0:
+                    actions[term] = Reduce, self.rules[-action - 1]
+            for nonterm, new_state in zip(self.nonterminals, goto_row):
+                if new_state >= 0:
+                    actions[nonterm] = Shift, new_state
+            states[state] = actions
+        return states
+
+    def expected_terminals(self, state):
+        return [term for term, action in zip(self.terminals, self.action_rows[state]) if action]
+
+    def serialize(self, memo):
+        return IntParseTable(self.states, self.start_states, self.end_states).serialize(memo)
+
+    @classmethod
+    def deserialize(cls, data, memo):
+        return cls.from_ParseTable(IntParseTable.deserialize(data, memo))
+
 ###}
 
 
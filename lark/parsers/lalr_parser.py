@@ -6,7 +6,7 @@ from ..exceptions import UnexpectedToken
 from ..lexer import Token
 from ..utils import Enumerator, Serialize
 
-from .lalr_analysis import LALR_Analyzer, Shift, Reduce, IntParseTable
+from .lalr_analysis import LALR_Analyzer, Shift, Reduce, CompactParseTable
 
 
 ###{standalone
@@ -18,14 +18,14 @@ class LALR_Parser(object):
         analysis.compute_lalr()
         callbacks = parser_conf.callbacks
 
-        self._parse_table = analysis.parse_table
+        self._parse_table = CompactParseTable.from_ParseTable(analysis.parse_table)
         self.parser_conf = parser_conf
-        self.parser = _Parser(analysis.parse_table, callbacks)
+        self.parser = _Parser(self._parse_table, callbacks)
 
     @classmethod
     def deserialize(cls, data, memo, callbacks):
         inst = cls.__new__(cls)
-        inst._parse_table = IntParseTable.deserialize(data, memo)
+        inst._parse_table = CompactParseTable.deserialize(data, memo)
         inst.parser = _Parser(inst._parse_table, callbacks)
         return inst
 
@@ -35,71 +35,135 @@ class LALR_Parser(object):
     def parse(self, *args):
         return self.parser.parse(*args)
 
+    def parse_events(self, start, on_shift, on_reduce, set_state=None):
+        """Returns a ParserState that reports events instead of building a tree.
+
+        on_shift(token) is called for every token that's shifted, and on_reduce(rule, n_children)
+        for every reduction. No values are kept on the stack.
+        """
+        callbacks = {rule: _reduce_event(on_reduce, rule) for rule in self._parse_table.rules}
+        return ParserState(_Parser(self._parse_table, callbacks), start, set_state, on_shift)
+
+
+def _reduce_event(on_reduce, rule):
+    n_children = len(rule.expansion)
+    def callback(children):
+        on_reduce(rule, n_children)
+    return callback
+
 
 class _Parser:
     def __init__(self, parse_table, callbacks):
-        self.states = parse_table.states
+        self.parse_table = parse_table
         self.start_states = parse_table.start_states
         self.end_states = parse_table.end_states
         self.callbacks = callbacks
 
-    def parse(self, seq, start, set_state=None):
-        token = None
-        stream = iter(seq)
-        states = self.states
-
-        start_state = self.start_states[start]
-        end_state = self.end_states[start]
-
-        state_stack = [start_state]
-        value_stack = []
+        # Everything needed to reduce by a rule: (size, callback, origin id)
+        self.reductions = [(len(rule.expansion), callbacks[rule], parse_table.nonterminal_ids[rule.origin.name])
+                           for rule in parse_table.rules]
 
+    def parse(self, seq, start, set_state=None):
+        state = ParserState(self, start, set_state)
+        state.feed_tokens(seq)
+        return state.feed_end()
+
+
+class ParserState:
+    """The state of a single LALR parse, which can be fed its tokens incrementally.
+
+    Used by _Parser.parse, and directly for incremental parsing.
+    """
+    def __init__(self, parser, start, set_state=None, on_shift=None):
+        self.parser = parser
+        self.set_state = set_state
+        self.on_shift = on_shift
+        self.end_state = parser.end_states[start]
+        self.last_token = None
+
+        start_state = parser.start_states[start]
+        self.state_stack = [start_state]
+        self.value_stack = []
         if set_state: set_state(start_state)
 
-        def get_action(token):
-            state = state_stack[-1]
-            try:
-                return states[state][token.type]
-            except KeyError:
-                expected = [s for s in states[state].keys() if s.isupper()]
-                raise UnexpectedToken(token, expected, state=state)
-
-        def reduce(rule):
-            size = len(rule.expansion)
-            if size:
-                s = value_stack[-size:]
-                del state_stack[-size:]
-                del value_stack[-size:]
-            else:
-                s = []
-
-            value = self.callbacks[rule](s)
-
-            _action, new_state = states[state_stack[-1]][rule.origin.name]
-            assert _action is Shift
-            state_stack.append(new_state)
-            value_stack.append(value)
-
-        # Main LALR-parser loop
-        for token in stream:
-            while True:
-                action, arg = get_action(token)
-                assert arg != end_state
-
-                if action is Shift:
-                    state_stack.append(arg)
-                    value_stack.append(token)
-                    if set_state: set_state(arg)
-                    break # next token
-                else:
-                    reduce(arg)
+    def unexpected_token(self, token):
+        state = self.state_stack[-1]
+        return UnexpectedToken(token, self.parser.parse_table.expected_terminals(state), state=state)
 
+    def feed_tokens(self, tokens):
+        "Feeds the given tokens to the parser, shifting them and reducing as much as possible"
+        token = None
+        parse_table = self.parser.parse_table
+        terminal_ids = parse_table.terminal_ids
+        action_rows = parse_table.action_rows
+        goto_rows = parse_table.goto_rows
+        reductions = self.parser.reductions
+        state_stack = self.state_stack
+        value_stack = self.value_stack
+        set_state = self.set_state
+        on_shift = self.on_shift
+        end_state = self.end_state
+
+        try:
+            # Main LALR-parser loop
+            for token in tokens:
+                try:
+                    term = terminal_ids[token.type]
+                except KeyError:
+                    raise self.unexpected_token(token)
+
+                while True:
+                    action = action_rows[state_stack[-1]][term]
+                    if action > 0:
+                        state = action - 1
+                        assert state != end_state
+                        state_stack.append(state)
+                        value_stack.append(token)
+                        if set_state: set_state(state)
+                        if on_shift: on_shift(token)
+                        break # next token
+                    elif action < 0:
+                        # Reduce (inlined, since this is the hot path)
+                        size, callback, origin = reductions[-action - 1]
+                        if size:
+                            s = value_stack[-size:]
+                            del state_stack[-size:]
+                            del value_stack[-size:]
+                        else:
+                            s = []
+
+                        value_stack.append(callback(s))
+                        state_stack.append(goto_rows[state_stack[-1]][origin])
+                    else:
+                        raise self.unexpected_token(token)
+        finally:
+            if token is not None:
+                self.last_token = token
+
+    def reduce(self, rule_id):
+        size, callback, origin = self.parser.reductions[rule_id]
+        if size:
+            s = self.value_stack[-size:]
+            del self.state_stack[-size:]
+            del self.value_stack[-size:]
+        else:
+            s = []
+
+        self.value_stack.append(callback(s))
+        self.state_stack.append(self.parser.parse_table.goto_rows[self.state_stack[-1]][origin])
+
+    def feed_end(self):
+        "Ends the input, and returns the result of the parse"
+        token = self.last_token
         token = Token.new_borrow_pos('$END', '', token) if token else Token('$END', '', 0, 1, 1)
+        term = self.parser.parse_table.terminal_ids['$END']
+        action_rows = self.parser.parse_table.action_rows
         while True:
-            _action, arg = get_action(token)
-            assert(_action is Reduce)
-            reduce(arg)
-            if state_stack[-1] == end_state:
-                return value_stack[-1]
+            action = action_rows[self.state_stack[-1]][term]
+            if action >= 0:
+                raise self.unexpected_token(token)
+            self.reduce(-action - 1)
+            if self.state_stack[-1] == self.end_state:
+                return self.value_stack[-1]
 
 ###}
@@ -15,23 +15,70 @@ Earley's power in parsing any CFG.
 """
 
 from collections import defaultdict
+from itertools import chain
 
 from ..exceptions import UnexpectedCharacters
 from ..lexer import Token
 from ..grammar import Terminal
 from .earley import Parser as BaseParser
-from .earley_forest import SymbolNode
 
 
 class Parser(BaseParser):
-    def __init__(self,  parser_conf, term_matcher, resolve_ambiguity=True, ignore = (), complete_lex = False, debug=False):
-        BaseParser.__init__(self, parser_conf, term_matcher, resolve_ambiguity, debug)
-        self.ignore = [Terminal(t) for t in ignore]
+    def __init__(self,  parser_conf, term_matcher, resolve_ambiguity=True, ignore = (), complete_lex = False, debug=False,
+                 term_first_chars=None, terms_matcher=None, prefixes_matcher=None, beam_width=None, low_memory=False):
+        BaseParser.__init__(self, parser_conf, term_matcher, resolve_ambiguity, debug, beam_width=beam_width,
+                            low_memory=low_memory)
+        self.ignore = frozenset(ignore)
         self.complete_lex = complete_lex
-
-    def _parse(self, stream, columns, to_scan, start_symbol=None):
-
-        def scan(i, to_scan):
+        if terms_matcher is not None:
+            self.match_terms = terms_matcher
+        if prefixes_matcher is not None:
+            self.match_prefixes = prefixes_matcher
+
+        # The characters that each terminal may begin with (or None if unknown), for filtering the predictions
+        # by the next character. Not possible at characters that may begin an ignored terminal.
+        self.term_first_chars = term_first_chars
+        self.ignore_first_chars = None
+        if term_first_chars is not None:
+            self.ignore_first_chars = set()
+            for t in ignore:
+                chars = term_first_chars.get(t)
+                if chars is None:
+                    self.term_first_chars = self.ignore_first_chars = None
+                    break
+                self.ignore_first_chars |= chars
+
+    def match_terms(self, names, text, index):
+        """Returns a list of (name, matched text) for each of the terminals (given by name) that matches at the index.
+
+        May be replaced by a faster terms_matcher, that matches a set of terminals all at once."""
+        found = []
+        for name in names:
+            m = self.term_matcher(Terminal(name), text, index)
+            if m:
+                found.append((name, m.group(0)))
+        return found
+
+    def match_prefixes(self, name, text, start, end):
+        """Returns the end indices of the matches of the terminal (given by name) at start, that are shorter
+        than its match up to end, longest first. Used by complete_lex.
+
+        May be replaced by a faster prefixes_matcher, that doesn't copy the text of each prefix."""
+        found = []
+        term = Terminal(name)
+        for j in range(end - 1, start, -1):
+            m = self.term_matcher(term, text[start:j])
+            if m and start + m.end() not in found[-1:]:
+                found.append(start + m.end())
+        return found
+
+    def match_lookahead(self, term, lookahead):
+        chars = self.term_first_chars.get(term.name)
+        return chars is None or lookahead in chars
+
+    def _parse(self, stream, columns, to_scan, start_symbol=None, build_forest=True, budget=None):
+
+        def scan(i, to_scan, node_cache):
             """The core Earley Scanner.
 
             This is a custom implementation of the scanner that uses the
@@ -40,44 +87,39 @@ class Parser(BaseParser):
             This ensures that at each phase of the parse we have a custom
             lexer context, allowing for more complex ambiguities."""
 
-            node_cache = {}
-
-            # 1) Loop the expectations and ask the lexer to match.
+            # 1) Match the expected terminals, and the items that expect them.
+            # Each terminal is matched once, no matter how many items expect it.
             # Since regexp is forward looking on the input stream, and we only
             # want to process tokens when we hit the point in the stream at which
             # they complete, we push all tokens into a buffer (delayed_matches), to
             # be held possibly for a later parse step when we reach the point in the
             # input stream at which they complete.
-            for item in set(to_scan):
-                m = match(item.expect, stream, i)
-                if m:
-                    t = Token(item.expect.name, m.group(0), i, text_line, text_column)
-                    delayed_matches[m.end()].append( (item, i, t) )
+            if to_scan:
+                for name, s in match_terms(frozenset([item.expect.name for item in to_scan]), stream, i):
+                    items = [item for item in to_scan if item.expect.name == name]
+                    t = Token(name, s, i, text_line, text_column)
+                    delayed_matches[i + len(s)].extend([(item, i, t) for item in items])
 
                     if self.complete_lex:
-                        s = m.group(0)
-                        for j in range(1, len(s)):
-                            m = match(item.expect, s[:-j])
-                            if m:
-                                t = Token(item.expect.name, m.group(0), i, text_line, text_column)
-                                delayed_matches[i+m.end()].append( (item, i, t) )
+                        for end in self.match_prefixes(name, stream, i, i + len(s)):
+                            t = Token(name, stream[i:end], i, text_line, text_column)
+                            delayed_matches[end].extend([(item, i, t) for item in items])
 
                     # Remove any items that successfully matched in this pass from the to_scan buffer.
                     # This ensures we don't carry over tokens that already matched, if we're ignoring below.
-                    to_scan.remove(item)
+                    to_scan.difference_update(items)
 
             # 3) Process any ignores. This is typically used for e.g. whitespace.
             # We carry over any unmatched items from the to_scan buffer to be matched again after
             # the ignore. This should allow us to use ignored symbols in non-terminals to implement
             # e.g. mandatory spacing.
-            for x in self.ignore:
-                m = match(x, stream, i)
-                if m:
-                    # Carry over any items still in the scan buffer, to past the end of the ignored items.
-                    delayed_matches[m.end()].extend([(item, i, None) for item in to_scan ])
+            for name, s in match_terms(self.ignore, stream, i):
+                end = i + len(s)
+                # Carry over any items still in the scan buffer, to past the end of the ignored items.
+                delayed_matches[end].extend([(item, i, None) for item in to_scan ])
 
-                    # If we're ignoring up to the end of the file, # carry over the start symbol if it already completed.
-                    delayed_matches[m.end()].extend([(item, i, None) for item in columns[i] if item.is_complete and item.s == start_symbol])
+                # If we're ignoring up to the end of the file, # carry over the start symbol if it already completed.
+                delayed_matches[end].extend([(item, i, None) for item in columns[i] if item.is_complete and item.s == start_symbol])
 
             next_to_scan = set()
             next_set = set()
@@ -95,9 +137,10 @@ class Parser(BaseParser):
                     token.end_column = text_column + 1
 
                     new_item = item.advance()
-                    label = (new_item.s, new_item.start, i)
-                    new_item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
-                    new_item.node.add_family(new_item.s, item.rule, new_item.start, item.node, token)
+                    if build_forest:
+                        label = (new_item.s, new_item.start, i + 1)
+                        new_item.node = node_cache[label] if label in node_cache else node_cache.setdefault(label, SymbolNode(*label))
+                        new_item.node.add_family(new_item.s, item.rule, new_item.start, item.node, token)
                 else:
                     new_item = item
 
@@ -111,16 +154,20 @@ class Parser(BaseParser):
             del delayed_matches[i+1]    # No longer needed, so unburden memory
 
             if not next_set and not delayed_matches and not next_to_scan:
-                raise UnexpectedCharacters(stream, i, text_line, text_column, {item.expect.name for item in to_scan}, set(to_scan))
+                raise UnexpectedCharacters(stream, i, text_line, text_column, self.expected_terminals(to_scan, expects[i]), set(to_scan))
 
             return next_to_scan
 
 
         delayed_matches = defaultdict(list)
-        match = self.term_matcher
+        match_terms = self.match_terms
+        SymbolNode = self.SymbolNode
 
         # Cache for nodes & tokens created in a particular parse step.
         transitives = [{}]
+        node_cache = {}
+        # For each completed column, its items indexed by the symbol they expect.
+        expects = []
 
         text_line = 1
         text_column = 1
@@ -130,11 +177,23 @@ class Parser(BaseParser):
         # Completions will be added to the SPPF tree, and predictions will be recursively
         # processed down to terminals/empty nodes to be added to the scanner for the next
         # step.
+        ignore_first_chars = self.ignore_first_chars
+        release_columns = not build_forest or self.low_memory
+        retained = self._retained_columns(columns, transitives, expects)
         i = 0
-        for token in stream:
-            self.predict_and_complete(i, to_scan, columns, transitives)
+        end = len(stream)
+        while i < end:
+            token = stream[i]
+            lookahead = token if ignore_first_chars is not None and token not in ignore_first_chars else None
+            self.predict_and_complete(i, to_scan, columns, transitives, expects, node_cache, build_forest, lookahead, budget)
 
-            to_scan = scan(i, to_scan)
+            node_cache = {}
+            to_scan = scan(i, to_scan, node_cache)
+            if retained is not None:
+                retained.add(i)
+            if release_columns:
+                # Completed columns are only referenced through their index in expects
+                columns[i] = None
 
             if token == '\n':
                 text_line += 1
@@ -143,7 +202,34 @@ class Parser(BaseParser):
                 text_column += 1
             i += 1
 
-        self.predict_and_complete(i, to_scan, columns, transitives)
+            if not to_scan and not columns[i] and delayed_matches:
+                # Nothing can happen until the next pending match (e.g. inside a long token),
+                # so skip straight to the step that completes it, leaving the columns in between empty.
+                next_i = min(delayed_matches) - 1
+                if next_i > i:
+                    for j in range(i, next_i):
+                        expects.append({})
+                        transitives.append({})
+                        if release_columns:
+                            columns[j] = None
+                        columns.append(set())
+
+                    newlines = stream.count('\n', i, next_i)
+                    if newlines:
+                        text_line += newlines
+                        text_column = next_i - stream.rindex('\n', i, next_i)
+                    else:
+                        text_column += next_i - i
+                    i = next_i
+
+            if self.low_memory:
+                delayed_items = (item for matches in delayed_matches.values() for item, _, _ in matches)
+                retained.release(chain(columns[i], to_scan, delayed_items))
+
+        self.predict_and_complete(i, to_scan, columns, transitives, expects, node_cache, build_forest, budget=budget)
+        if retained is not None:
+            retained.add(i)
+            retained.report(self.profiler)
 
         ## Column is now the final column in the parse.
         assert i == len(columns)-1
@@ -43,10 +43,12 @@ import os
 from pprint import pprint
 from os import path
 from collections import defaultdict
+from functools import partial
 
 import lark
 from lark import Lark
 from lark.parsers.lalr_analysis import Reduce
+from lark.parse_tree_builder import ExpandSingleChild, ChildFilterLALR_NoPlaceholders
 
 
 from lark.grammar import RuleOptions, Rule
@@ -93,7 +95,215 @@ def extract_sections(lines):
     return {name:''.join(text) for name, text in sections.items()}
 
 
-def main(fobj, start):
+COMPILED_PARSER = '''
+class _CompiledParser:
+    "An LALR parser, specialized to the grammar by lark.tools.standalone --compile"
+    def __init__(self, rules, callbacks, parse_tree_builder, transformer):
+        def get_callback(rule_id):
+            rule = rules[RULE_INDEX[rule_id]]
+            return callbacks[rule]
+        def get_user_callback(rule_id):
+            rule = rules[RULE_INDEX[rule_id]]
+            f = parse_tree_builder.get_user_callback(rule, transformer)
+            return f or partial(parse_tree_builder.tree_class, rule.alias or rule.origin.name)
+        self.reducers = _create_reducers(get_callback, get_user_callback)
+
+    def parse(self, seq, start, set_state=None):
+        token = None
+        action_table = ACTION
+        terminal_ids = TERMINAL_IDS
+        reducers = self.reducers
+
+        start_state = START_STATES[start]
+        end_state = END_STATES[start]
+
+        state_stack = [start_state]
+        value_stack = []
+
+        if set_state: set_state(start_state)
+
+        for token in seq:
+            try:
+                term = terminal_ids[token.type]
+            except KeyError:
+                raise _unexpected_token(token, state_stack[-1])
+
+            while True:
+                action = action_table[state_stack[-1]][term]
+                if action > 0:
+                    state_stack.append(action - 1)
+                    value_stack.append(token)
+                    if set_state: set_state(action - 1)
+                    break
+                elif action < 0:
+                    reducers[-action - 1](value_stack, state_stack)
+                else:
+                    raise _unexpected_token(token, state_stack[-1])
+
+        token = Token.new_borrow_pos('$END', '', token) if token else Token('$END', '', 0, 1, 1)
+        term = terminal_ids['$END']
+        while True:
+            action = action_table[state_stack[-1]][term]
+            if action >= 0:
+                raise _unexpected_token(token, state_stack[-1])
+            reducers[-action - 1](value_stack, state_stack)
+            if state_stack[-1] == end_state:
+                return value_stack[-1]
+
+def _unexpected_token(token, state):
+    expected = [term for term, action in zip(TERMINALS, ACTION[state]) if action]
+    return UnexpectedToken(token, expected, state=state)
+
+def Lark_StandAlone(transformer=None, postlex=None):
+    namespace = {'Rule': Rule, 'TerminalDef': TerminalDef}
+    inst = Lark.deserialize(DATA, namespace, MEMO, transformer=transformer, postlex=postlex)
+    inst.parser.parser.parser = _CompiledParser(inst.rules, inst._callbacks, inst._parse_tree_builder, transformer)
+    return inst
+'''
+
+
+def _analyze_wrapper_chain(rule, wrapper_chain):
+    """Returns (expand_single_child, to_include) for wrapper chains that can be compiled, or None.
+
+    to_include is a list of (index, to_expand), like ChildFilterLALR_NoPlaceholders expects.
+    """
+    expand_single_child = False
+    to_include = [(i, False) for i in range(len(rule.expansion))]
+    for w in wrapper_chain:
+        if w is ExpandSingleChild:
+            expand_single_child = True
+        elif isinstance(w, partial) and w.func is ChildFilterLALR_NoPlaceholders:
+            to_include ,= w.args
+        else:
+            return None
+    return expand_single_child, to_include
+
+
+def _gen_reducer(rule_id, rule, wrapper_chain, origin_id):
+    size = len(rule.expansion)
+    lines = ['    def reduce_%d(value_stack, state_stack):' % rule_id,
+             '        # %s' % rule]
+
+    chain = _analyze_wrapper_chain(rule, wrapper_chain)
+    if chain is None:
+        # Not something we know how to compile. Use the callback chain created at runtime.
+        names = ['c%d' % i for i in range(size)]
+        value = 'cb_%d([%s])' % (rule_id, ', '.join(names))
+        header = ['    cb_%d = get_callback(%d)' % (rule_id, rule_id)]
+    else:
+        expand_single_child, to_include = chain
+        used = {i for i, _ in to_include}
+        names = ['c%d' % i if i in used else '_' for i in range(size)]
+        header = []
+        if expand_single_child and len(to_include) == 1 and not to_include[0][1]:
+            # ?rule with a single child - pass it through without calling anything
+            i, _ = to_include[0]
+            if size == 1:
+                lines.append('        state_stack[-1] = goto[state_stack[-2]][%d]' % origin_id)
+                return header, lines
+            value = 'c%d' % i
+        else:
+            header = ['    f_%d = get_user_callback(%d)' % (rule_id, rule_id)]
+
+            # Mirrors ChildFilterLALR_NoPlaceholders, including its in-place extension of expanded children
+            filtered = None
+            group = []
+            stmts = []
+            def flush_group():
+                if group:
+                    if filtered is None:
+                        stmts.append('filtered = [%s]' % ', '.join(group))
+                    elif len(group) == 1:
+                        stmts.append('filtered.append(%s)' % group[0])
+                    else:
+                        stmts.append('filtered += [%s]' % ', '.join(group))
+                    del group[:]
+                    return True
+
+            for i, to_expand in to_include:
+                if to_expand:
+                    if flush_group():
+                        filtered = True
+                    if filtered is None:
+                        stmts.append('filtered = c%d.children' % i)
+                        filtered = True
+                    else:
+                        stmts.append('filtered += c%d.children' % i)
+                else:
+                    group.append('c%d' % i)
+            if flush_group():
+                filtered = True
+            if filtered is None:
+                stmts.append('filtered = []')
+
+            lines += ['        ' + stmt for stmt in stmts]
+            value = 'f_%d(filtered)' % rule_id
+            if expand_single_child and any(to_expand for _, to_expand in to_include):
+                value = 'filtered[0] if len(filtered) == 1 else %s' % value
+
+    if size == 0:
+        lines.insert(2, '        value_stack.append(%s)' % value)
+        lines.append('        state_stack.append(goto[state_stack[-1]][%d])' % origin_id)
+        return header, lines
+
+    if size == 1:
+        if names[0] != '_':
+            lines.insert(2, '        %s = value_stack[-1]' % names[0])
+        lines.append('        value_stack[-1] = %s' % value)
+    else:
+        if set(names) != {'_'}:
+            lines.insert(2, '        %s = value_stack[-%d:]' % (', '.join(names), size))
+        lines.append('        value_stack[-%d:] = [%s]' % (size, value))
+    lines.append('        state_stack[-%d:] = [goto[state_stack[-%d]][%d]]' % (size, size+1, origin_id))
+    return header, lines
+
+
+def gen_compiled_parser(lark_inst):
+    """Generates Python code for an LALR parser that is specialized to the grammar of lark_inst.
+
+    The parse table is emitted as tuple literals, and each rule gets its own reduce function,
+    which builds the tree node in-line, instead of going through the ParseTreeBuilder wrappers.
+    """
+    table = lark_inst.parser.parser._parse_table
+    rule_index = {rule: i for i, rule in enumerate(lark_inst.rules)}
+    wrapper_chains = dict(lark_inst._parse_tree_builder.rule_builders)
+
+    def rows(name, rows_list):
+        distinct = {}
+        for row in rows_list:
+            distinct.setdefault(tuple(row), len(distinct))
+        by_index = sorted(distinct, key=distinct.get)
+        out = ['_%s_ROWS = (' % name]
+        out += ['    %r,' % (row,) for row in by_index]
+        out.append(')')
+        out.append('%s = [_%s_ROWS[i] for i in %r]' % (name, name, [distinct[tuple(row)] for row in rows_list]))
+        return out
+
+    out = []
+    out.append('TERMINALS = %r' % (table.terminals,))
+    out.append('TERMINAL_IDS = %r' % (table.terminal_ids,))
+    out += rows('ACTION', table.action_rows)
+    out += rows('GOTO', table.goto_rows)
+    out.append('START_STATES = %r' % (table.start_states,))
+    out.append('END_STATES = %r' % (table.end_states,))
+    out.append('RULE_INDEX = %r' % ([rule_index[rule] for rule in table.rules],))
+    out.append('')
+
+    out.append('def _create_reducers(get_callback, get_user_callback):')
+    out.append('    goto = GOTO')
+    reducers = []
+    for rule_id, rule in enumerate(table.rules):
+        origin_id = table.nonterminal_ids[rule.origin.name]
+        header, lines = _gen_reducer(rule_id, rule, wrapper_chains[rule], origin_id)
+        out += header
+        reducers += lines
+    out += reducers
+    out.append('    return [%s]' % ', '.join('reduce_%d' % i for i in range(len(table.rules))))
+
+    return '\n'.join(out) + '\n' + COMPILED_PARSER
+
+
+def main(fobj, start, compile=False):
     lark_inst = Lark(fobj, parser="lalr", lexer="contextual", start=start)
 
     print('# The file was automatically generated by Lark v%s' % lark.__version__)
@@ -111,6 +321,9 @@ def main(fobj, start):
     print(m)
     print(')')
 
+    if compile:
+        print(gen_compiled_parser(lark_inst))
+        return
 
     print('Shift = 0')
     print('Reduce = 1')
@@ -121,17 +334,25 @@ def main(fobj, start):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
+    args = sys.argv[1:]
+    compile = False
+    if args and args[0] in ('-c', '--compile'):
+        compile = True
+        args = args[1:]
+
+    if len(args) < 1:
         print("Lark Stand-alone Generator Tool")
-        print("Usage: python -m lark.tools.standalone <grammar-file> [<start>]")
+        print("Usage: python -m lark.tools.standalone [-c|--compile] <grammar-file> [<start>]")
+        print("")
+        print("  -c, --compile   Generate Python code specialized to the grammar, instead of an interpreted parse table")
         sys.exit(1)
 
-    if len(sys.argv) == 3:
-        fn, start = sys.argv[1:]
-    elif len(sys.argv) == 2:
-        fn, start = sys.argv[1], 'start'
+    if len(args) == 2:
+        fn, start = args
+    elif len(args) == 1:
+        fn, start = args[0], 'start'
     else:
         assert False, sys.argv
 
     with codecs.open(fn, encoding='utf8') as f:
-        main(f, start)
+        main(f, start, compile)
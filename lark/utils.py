@@ -168,17 +168,237 @@ def smart_decorator(f, create_decorator):
 import sys, re
 Py36 = (sys.version_info[:2] >= (3, 6))
 
-import sre_parse
-import sre_constants
+try:
+    # The sre_* modules are deprecated since Python 3.11, and became private modules of re
+    from re import _parser as sre_parse, _compiler as sre_compile, _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_compile
+    import sre_constants
+
+def _compile_parsed(state, items, flags):
+    "Compiles the items of a parsed regexp into a regexp object, like re.compile does for a string"
+    return sre_compile.compile(sre_parse.SubPattern(state, items), flags)
+
 def get_regexp_width(regexp):
     try:
         return [int(x) for x in sre_parse.parse(regexp).getwidth()]
     except sre_constants.error:
         raise ValueError(regexp)
 
+try:
+    unichr
+except NameError:   # Python 3
+    unichr = chr
+
+_MAX_FIRST_CHARS = 1024
+
+def _first_chars(subpattern, ignorecase):
+    """Returns (chars, nullable) for a parsed regexp, where chars is the set of characters
+    that a match may begin with, or None if it can't be determined."""
+    chars = set()
+    for op, av in subpattern:
+        nullable = False
+        if op == sre_constants.LITERAL:
+            item_chars = {unichr(av)}
+        elif op == sre_constants.IN:
+            item_chars = set()
+            for in_op, in_av in av:
+                if in_op == sre_constants.LITERAL:
+                    item_chars.add(unichr(in_av))
+                elif in_op == sre_constants.RANGE and in_av[1] - in_av[0] < _MAX_FIRST_CHARS:
+                    item_chars |= {unichr(c) for c in range(in_av[0], in_av[1]+1)}
+                else:   # NEGATE, CATEGORY, etc.
+                    return None, False
+        elif op == sre_constants.SUBPATTERN:
+            add_flags = av[1] if len(av) == 4 else 0
+            item_chars, nullable = _first_chars(av[-1], ignorecase or bool(add_flags & sre_constants.SRE_FLAG_IGNORECASE))
+        elif op == sre_constants.BRANCH:
+            item_chars = set()
+            for branch in av[1]:
+                branch_chars, branch_nullable = _first_chars(branch, ignorecase)
+                if branch_chars is None:
+                    return None, False
+                item_chars |= branch_chars
+                nullable = nullable or branch_nullable
+        elif op in _REPEAT_OPCODES:
+            item_chars, nullable = _first_chars(av[2], ignorecase)
+            nullable = nullable or av[0] == 0
+        elif op in _ZERO_WIDTH_OPCODES:
+            # Anchors and look-arounds only restrict the match, so skipping them is safe
+            item_chars, nullable = set(), True
+        else:   # ANY, NOT_LITERAL, GROUPREF, etc.
+            return None, False
+
+        if item_chars is None:
+            return None, False
+        if ignorecase and any(c.lower() != c.upper() for c in item_chars):
+            # Case-folding maps some letters to unexpected characters (e.g. KELVIN SIGN matches 'k')
+            return None, False
+        chars |= item_chars
+        if len(chars) > _MAX_FIRST_CHARS:
+            return None, False
+        if not nullable:
+            return chars, False
+
+    return chars, True
+
+_REPEAT_OPCODES = {getattr(sre_constants, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+                   if hasattr(sre_constants, name)}
+_ZERO_WIDTH_OPCODES = {getattr(sre_constants, name) for name in ('AT', 'ASSERT', 'ASSERT_NOT')}
+
+def get_regexp_first_chars(regexp):
+    """Returns the set of characters that a match of regexp may begin with,
+    or None if it can't be determined (or is too large to be useful)."""
+    try:
+        parsed = sre_parse.parse(regexp)
+    except sre_constants.error:
+        raise ValueError(regexp)
+    state = getattr(parsed, 'state', None) or parsed.pattern   # Python 3.7 renamed 'pattern' to 'state'
+    chars, nullable = _first_chars(parsed, bool(state.flags & sre_constants.SRE_FLAG_IGNORECASE))
+    if nullable:
+        return None
+    return chars
+
+_SINGLE_CHAR_OPCODES = {getattr(sre_constants, name) for name in ('LITERAL', 'NOT_LITERAL', 'IN', 'ANY', 'CATEGORY')}
+
+class _UnknownPrefixes(Exception):
+    pass
+
+def _whole(state, subpattern):
+    "Returns the items of a parsed regexp, without its look-arounds and anchors (so it may match more)"
+    items = []
+    for op, av in subpattern:
+        if op in _SINGLE_CHAR_OPCODES:
+            items.append((op, av))
+        elif op == sre_constants.SUBPATTERN:
+            items.append((op, av[:-1] + (_whole(state, av[-1]),)))
+        elif op == sre_constants.BRANCH:
+            items.append((op, (av[0], [_whole(state, branch) for branch in av[1]])))
+        elif op in _REPEAT_OPCODES:
+            items.append((sre_constants.MAX_REPEAT, (av[0], av[1], _whole(state, av[2]))))
+        elif op in _ZERO_WIDTH_OPCODES:
+            pass
+        elif op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+            items += _whole(state, av)
+        else:   # GROUPREF, etc.
+            raise _UnknownPrefixes()
+    return sre_parse.SubPattern(state, items)
+
+def _prefixes(state, subpattern):
+    """Returns the items of a regexp that matches the prefixes of the matches of a parsed regexp (or more).
+
+    The prefixes of 'a b c' are those of 'a', and 'a' followed by the prefixes of 'b c'."""
+    items = []  # Only the empty prefix
+    for op, av in reversed(list(subpattern)):
+        if op in _SINGLE_CHAR_OPCODES:
+            prefixes = [(sre_constants.MAX_REPEAT, (0, 1, sre_parse.SubPattern(state, [(op, av)])))]
+        elif op == sre_constants.SUBPATTERN:
+            prefixes = [(op, av[:-1] + (_prefixes(state, av[-1]),))]
+        elif op == sre_constants.BRANCH:
+            prefixes = [(op, (av[0], [_prefixes(state, branch) for branch in av[1]]))]
+        elif op in _REPEAT_OPCODES:
+            low, high, repeated = av
+            if high == 0:
+                continue
+            repeated = _whole(state, repeated)
+            if len(repeated) == 1 and repeated[0][0] in _SINGLE_CHAR_OPCODES:
+                prefixes = [(sre_constants.MAX_REPEAT, (0, high, repeated))]
+            else:
+                if high != sre_constants.MAXREPEAT:
+                    high -= 1
+                prefixes = [(sre_constants.MAX_REPEAT, (0, high, repeated))] + list(_prefixes(state, repeated))
+        elif op in _ZERO_WIDTH_OPCODES:
+            if op == sre_constants.AT or av[0] < 0:
+                # Anchors and look-behinds only look at the text up to the next character,
+                # and if the text ends here, the empty prefix of what follows covers it
+                continue
+            # The text may end inside the match of a look-ahead
+            items = [(sre_constants.BRANCH, (None, [_prefixes(state, av[1]), sre_parse.SubPattern(state, items)]))]
+            continue
+        elif op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+            prefixes = list(_prefixes(state, av))
+        else:   # GROUPREF, etc.
+            raise _UnknownPrefixes()
+
+        whole = list(_whole(state, [(op, av)]))
+        items = [(sre_constants.BRANCH, (None, [sre_parse.SubPattern(state, prefixes),
+                                                sre_parse.SubPattern(state, whole + items)]))]
+    return sre_parse.SubPattern(state, items)
+
+def get_regexp_partial_match(regexp):
+    """Returns a compiled regexp that matches at a position if the rest of the text is the beginning of a match
+    of regexp, i.e. if more text might still complete or extend a match there. It may match in more cases.
+
+    Returns None if it can't be determined."""
+    try:
+        parsed = sre_parse.parse(regexp)
+    except sre_constants.error:
+        raise ValueError(regexp)
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    try:
+        prefixes = _prefixes(state, parsed)
+        prefixes.append((sre_constants.AT, sre_constants.AT_END_STRING))
+        return _compile_parsed(state, list(prefixes), re.compile(regexp).flags)
+    except (_UnknownPrefixes, RuntimeError, AssertionError):  # Too deep, or too many groups (in Python 2)
+        return None
+
 ###}
 
 
+_GREEDY_REPEAT_OPCODES = {getattr(sre_constants, name) for name in ('MAX_REPEAT', 'POSSESSIVE_REPEAT')
+                          if hasattr(sre_constants, name)}
+
+def _split_prefixes(subpattern, flags):
+    """Returns (min_width, suffix items, flags) for a parsed regexp made of single characters
+    around at most one greedy repeat of a single character, or None for other regexps."""
+    items = list(subpattern)
+    if len(items) == 1 and items[0][0] == sre_constants.SUBPATTERN:
+        av = items[0][1]
+        add_flags = av[1] if len(av) == 4 else 0
+        return _split_prefixes(av[-1], flags | add_flags)
+
+    min_width = 0
+    suffix = None
+    for op, av in items:
+        if op in _SINGLE_CHAR_OPCODES:
+            min_width += 1
+            if suffix is not None:
+                suffix.append((op, av))
+        elif op in _GREEDY_REPEAT_OPCODES and suffix is None:
+            repeated = list(av[2])
+            if len(repeated) != 1 or repeated[0][0] not in _SINGLE_CHAR_OPCODES:
+                return None
+            min_width += av[0]
+            suffix = []
+        else:
+            return None
+    return min_width, suffix or [], flags
+
+def get_regexp_prefixes(regexp):
+    """Tells which prefixes of a match of regexp are matches of it too, without matching each of them.
+
+    Returns (min_width, suffix_width, suffix) for a regexp made of single characters around at most one greedy
+    repeat of a single character (e.g. /[a-z]\\w*/ or /"[^"]*"/). A prefix then matches if it's at least min_width
+    long, and its last suffix_width characters match the compiled suffix regexp (if there is one).
+    Returns None for other regexps."""
+    try:
+        parsed = sre_parse.parse(regexp)
+    except sre_constants.error:
+        raise ValueError(regexp)
+    # The global flags (e.g. a leading '(?i)') aren't always kept in the parsed regexp, so they're taken from re
+    split = _split_prefixes(parsed, re.compile(regexp).flags)
+    if split is None:
+        return None
+    min_width, suffix, flags = split
+    if not suffix:
+        return min_width, 0, None
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    return min_width, len(suffix), _compile_parsed(state, suffix, flags)
+
+
+
+
 def dedup_list(l):
     """Given a list (l) will removing duplicates from the list,
        preserving the original order of the list. Assumes that
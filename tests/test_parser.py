@@ -5,6 +5,9 @@ import unittest
 import logging
 import os
 import sys
+import shutil
+import tempfile
+from itertools import islice
 try:
     from cStringIO import StringIO as cStringIO
 except ImportError:
@@ -18,17 +21,33 @@ from io import (
 logging.basicConfig(level=logging.INFO)
 
 from lark.lark import Lark
-from lark.exceptions import GrammarError, ParseError, UnexpectedToken, UnexpectedInput, UnexpectedCharacters
+from lark.exceptions import GrammarError, ParseError, UnexpectedToken, UnexpectedInput, UnexpectedCharacters, LexError, ParseBudgetExceeded, ConfigurationError, WorkerError
 from lark.tree import Tree
 from lark.visitors import Transformer, Transformer_InPlace, v_args
 from lark.grammar import Rule
-from lark.lexer import TerminalDef, Lexer, TraditionalLexer
+from lark.lexer import TerminalDef, Lexer, TraditionalLexer, Token
 
 __path__ = os.path.dirname(__file__)
 def _read(n, *args):
     with open(os.path.join(__path__, n), *args) as f:
         return f.read()
 
+class _SumTransformer(Transformer):
+    "Defined at module level, so that it can be pickled for parse_many"
+    def start(self, children):
+        return sum(int(c) for c in children)
+
+class _UnpicklableError(Exception):
+    "Its arguments don't match its __init__, so it's pickled, but can't be unpickled"
+    def __init__(self, a, b):
+        Exception.__init__(self, '%s %s' % (a, b))
+
+class _FailingTransformer(Transformer):
+    def start(self, children):
+        if len(children) > 2:
+            raise _UnpicklableError('too', 'long')
+        return len(children)
+
 class TestParsers(unittest.TestCase):
     def test_same_ast(self):
         "Tests that Earley and LALR parsers produce equal trees"
@@ -168,6 +187,37 @@ class TestParsers(unittest.TestCase):
         r = g.parse("xx")
         self.assertEqual( r.children, ["<c>"] )
 
+    def test_embedded_transformer_earley(self):
+        class T(Transformer):
+            def add(self, children):
+                return children[0] + children[1]
+            def mul(self, children):
+                return children[0] * children[1]
+            def num(self, children):
+                return int(children[0])
+
+        grammar = """?start: sum
+                     ?sum: sum "+" product -> add | product
+                     ?product: product "*" atom -> mul | atom
+                     ?atom: NUMBER -> num | "(" sum ")"
+                     %import common.NUMBER
+                     %ignore " "
+                  """
+        for lexer in ('standard', 'dynamic'):
+            g = Lark(grammar, parser='earley', lexer=lexer, transformer=T())
+            self.assertEqual(g.parse("1 + 2 * (3 + 4)"), 15)
+            self.assertEqual(T().transform(Lark(grammar, parser='earley', lexer=lexer).parse("1+2*3")), g.parse("1+2*3"))
+            self.assertEqual(next(g.parse_forest("2*3").iter_trees()), 6)
+
+        # The transformer is applied to the derivation chosen by the priorities
+        g = Lark("""start: a | b
+                    a.2: "x"
+                    b: "x"
+                 """, parser='earley', transformer=T())
+        self.assertEqual(g.parse("x").children, [Tree('a', [])])
+
+        self.assertRaises(ValueError, Lark, grammar, parser='earley', ambiguity='explicit', transformer=T())
+
     def test_embedded_transformer_inplace(self):
         @v_args(tree=True)
         class T1(Transformer_InPlace):
@@ -217,6 +267,746 @@ class TestParsers(unittest.TestCase):
     def test_alias(self):
         Lark("""start: ["a"] "b" ["c"] "e" ["f"] ["g"] ["h"] "x" -> d """)
 
+    def test_cache_grammar(self):
+        class T(Transformer):
+            def a(self, children):
+                return "<a>"
+
+        g = """start: a+ NAME
+                 a: "x"
+                 NAME: /[a-z]+/
+                 %ignore " "
+              """
+        cache_dir = tempfile.mkdtemp()
+        try:
+            l = Lark(g, parser='lalr', cache_grammar=cache_dir)
+            cache_files = os.listdir(cache_dir)
+            self.assertEqual(len(cache_files), 1)
+            self.assertEqual(l.parse('x x abc'), Tree('start', [Tree('a', []), Tree('a', []), 'abc']))
+
+            # Loaded from the cache, with a new transformer
+            l2 = Lark(g, parser='lalr', cache_grammar=cache_dir, transformer=T())
+            self.assertFalse(hasattr(l2, 'grammar'))
+            self.assertEqual(l2.parse('x x abc'), Tree('start', ['<a>', '<a>', 'abc']))
+            self.assertEqual(l2.get_terminal('NAME').pattern.value, '[a-z]+')
+
+            # Different options use a different cache entry
+            Lark(g, parser='lalr', lexer='standard', cache_grammar=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            # A corrupt cache is ignored, and rewritten
+            cache_fn = os.path.join(cache_dir, cache_files[0])
+            with open(cache_fn, 'wb') as f:
+                f.write(b'garbage')
+            l3 = Lark(g, parser='lalr', cache_grammar=cache_dir)
+            self.assertTrue(hasattr(l3, 'grammar'))
+            self.assertEqual(l3.parse('x abc'), Tree('start', [Tree('a', []), 'abc']))
+            l4 = Lark(g, parser='lalr', cache_grammar=cache_dir)
+            self.assertFalse(hasattr(l4, 'grammar'))
+
+            # A cache that other users can write to isn't loaded, since it may have been planted
+            if hasattr(os, 'getuid'):
+                os.chmod(cache_fn, 0o666)
+                l5 = Lark(g, parser='lalr', cache_grammar=cache_dir)
+                self.assertTrue(hasattr(l5, 'grammar'))
+        finally:
+            shutil.rmtree(cache_dir)
+
+        self.assertRaises(NotImplementedError, Lark, g, parser='earley', cache_grammar=True)
+        self.assertRaises(ConfigurationError, Lark, g, parser='lalr', cache_grammar=True, edit_terminals=lambda t: None)
+
+    def test_cache_grammar_imports(self):
+        from lark import load_grammar
+        grammar_dir = tempfile.mkdtemp()
+        cache_dir = tempfile.mkdtemp()
+        try:
+            grammar_fn = os.path.join(grammar_dir, 'main.lark')
+            with open(grammar_fn, 'w') as f:
+                f.write('start: WORD\n%import .cache_test_words.WORD\n')
+            words_fn = os.path.join(grammar_dir, 'cache_test_words.lark')
+            with open(words_fn, 'w') as f:
+                f.write('WORD: /[a-z]+/\n')
+
+            l = Lark.open(grammar_fn, parser='lalr', cache_grammar=cache_dir)
+            self.assertEqual(l.parse('abc'), Tree('start', ['abc']))
+            l2 = Lark.open(grammar_fn, parser='lalr', cache_grammar=cache_dir)
+            self.assertFalse(hasattr(l2, 'grammar'))
+
+            # Editing the imported grammar invalidates the cache
+            with open(words_fn, 'w') as f:
+                f.write('WORD: /[0-9]+/\n')
+            load_grammar._imported_grammars.pop('cache_test_words.lark')
+            l3 = Lark.open(grammar_fn, parser='lalr', cache_grammar=cache_dir)
+            self.assertTrue(hasattr(l3, 'grammar'))
+            self.assertEqual(l3.parse('123'), Tree('start', ['123']))
+            l4 = Lark.open(grammar_fn, parser='lalr', cache_grammar=cache_dir)
+            self.assertFalse(hasattr(l4, 'grammar'))
+            self.assertEqual(l4.parse('123'), Tree('start', ['123']))
+        finally:
+            load_grammar._imported_grammars.pop('cache_test_words.lark', None)
+            shutil.rmtree(grammar_dir)
+            shutil.rmtree(cache_dir)
+
+    def test_lexer_first_char_dispatch(self):
+        from lark.utils import get_regexp_first_chars
+        self.assertEqual(get_regexp_first_chars(r'-?(a|b|)c'), set('-abc'))
+        self.assertEqual(get_regexp_first_chars(r'(?:\s)*x'), None)
+        self.assertEqual(get_regexp_first_chars(r'(?i:if)'), None)
+        self.assertEqual(get_regexp_first_chars(r'(?i:\+)'), set('+'))
+
+        g = Lark(r"""start: (IF | KEY | NAME | NUM)+
+                    IF: "if"
+                    KEY: "key"i
+                    NAME: /[a-z]\w*/
+                    NUM: /\d+/
+                    %ignore " "
+                 """, parser='lalr', lexer='standard')
+        # KELVIN SIGN matches "k" when ignoring case
+        self.assertEqual([t.type for t in g.lex(u'if ifx KEY key \u212aey 12 x1')],
+                         ['IF', 'NAME', 'KEY', 'KEY', 'KEY', 'NUM', 'NAME'])
+
+        # Only the patterns of the dispatch table are compiled, not one of all the terminals
+        lexer = g.parser.lexer
+        self.assertNotIn((tuple(t.name for t in lexer._scanned_terminals), False), lexer.cache._mres)
+        try:
+            list(g.lex('if $'))
+        except UnexpectedCharacters as e:
+            self.assertEqual(e.allowed, {'KEY', 'NAME', 'NUM'})     # IF is matched as a NAME
+        else:
+            self.fail()
+
+    def test_contextual_lexer_lazy(self):
+        g = Lark(r"""start: "a" b | "x" "y"
+                    b: "b" NUM
+                    NUM: /\d+/
+                    %ignore " "
+                 """, parser='lalr', lexer='contextual')
+        lexer = g.parser.lexer
+        self.assertEqual(len(lexer.lexers), 0)
+
+        self.assertEqual(g.parse('a b 12'), Tree('start', [Tree('b', ['12'])]))
+        self.assertTrue(0 < len(lexer.lexers) < len(lexer.states))
+        built = set(map(id, lexer.lexers.values()))
+
+        # Lexers of states with the same accepted terminals are shared, and so are their compiled patterns
+        g.parse('a b 3')
+        self.assertEqual(set(map(id, lexer.lexers.values())), built)
+
+        self.assertRaises(UnexpectedInput, g.parse, 'a y')
+        self.assertRaises(LexError, Lark, 'start: A\nA: /a*/', parser='lalr', lexer='contextual')
+
+    def test_parse_incremental(self):
+        grammar = r"""start: item*
+                      item: NAME "=" (NUM | STRING) ";"
+                      NAME: /[a-z]+/
+                      NUM: /\d+/
+                      STRING: /"[^"]*"/
+                      %ignore /\s+/
+                   """
+        text = 'abc = 12;\nx="a b\n c" ; yy=3;' * 5
+        for lexer in ('standard', 'contextual'):
+            g = Lark(grammar, parser='lalr', lexer=lexer)
+            expected = g.parse(text)
+            for size in (1, 2, 5, 100):
+                p = g.parse_incremental()
+                for i in range(0, len(text), size):
+                    p.feed(text[i:i+size])
+                self.assertEqual(p.finish(), expected)
+
+            # Interleaved parses don't interfere with each other
+            p1 = g.parse_incremental()
+            p2 = g.parse_incremental()
+            p1.feed('ab')
+            p2.feed('x = "')
+            p1.feed('c = 1')
+            p2.feed('y";')
+            p1.feed(';')
+            self.assertEqual(p1.finish(), g.parse('abc = 1;'))
+            self.assertEqual(p2.finish(), g.parse('x = "y";'))
+
+            p = g.parse_incremental()
+            p.feed('a = 1;\nb = ')
+            try:
+                p.feed('$')
+                p.finish()
+            except UnexpectedCharacters as e:
+                self.assertEqual((e.pos_in_stream, e.line, e.column), (11, 2, 5))
+            else:
+                self.fail()
+
+            p = g.parse_incremental()
+            p.feed('a = 1')
+            self.assertRaises(UnexpectedToken, p.finish)
+
+        self.assertRaises(NotImplementedError, Lark(grammar).parse_incremental)
+
+    def test_import_without_deprecation_warnings(self):
+        # The sre_* modules that the regexp helpers use are deprecated in Python 3.11
+        import subprocess
+        code = 'import lark.lexer; from lark.utils import get_regexp_partial_match; get_regexp_partial_match("a+b")'
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.check_call([sys.executable, '-W', 'error::DeprecationWarning', '-c', code], cwd=root)
+
+    def test_parse_incremental_json(self):
+        grammar = r"""?value: dict | list | string | SIGNED_NUMBER -> number | "true" -> true | "null" -> null
+                      list: "[" [value ("," value)*] "]"
+                      dict: "{" [pair ("," pair)*] "}"
+                      pair: string ":" value
+                      string: ESCAPED_STRING
+                      %import common.ESCAPED_STRING
+                      %import common.SIGNED_NUMBER
+                      %import common.WS
+                      %ignore WS
+                   """
+        text = '{"a": 1.5e3, "bc": [true, -12, null, "x \\"y\\" z"],\n "d": {"e": 0.25E-10}, "f": 100}'
+        for lexer in ('standard', 'contextual'):
+            g = Lark(grammar, parser='lalr', lexer=lexer, start='value')
+            expected = g.parse(text)
+            # Any split of the text parses the same, even inside a token
+            for i in range(len(text) + 1):
+                p = g.parse_incremental()
+                p.feed(text[:i])
+                p.feed(text[i:])
+                self.assertEqual(p.finish(), expected, i)
+
+            p = g.parse_incremental()
+            for c in text:
+                p.feed(c)
+            self.assertEqual(p.finish(), expected)
+
+        # A token that only becomes longer after two more matches (NUMBER '1', NAME 'e', "+")
+        grammar = r"""start: (NUMBER | NAME | "+")*
+                      %import common.NUMBER
+                      %import common.CNAME -> NAME
+                   """
+        for lexer in ('standard', 'contextual'):
+            g = Lark(grammar, parser='lalr', lexer=lexer)
+            text = '1e+5'
+            self.assertEqual(g.parse(text), Tree('start', [Token('NUMBER', '1e+5')]))
+            for i in range(len(text) + 1):
+                p = g.parse_incremental()
+                p.feed(text[:i])
+                p.feed(text[i:])
+                self.assertEqual(p.finish(), g.parse(text), i)
+
+    def test_parse_many(self):
+        grammar = r"""start: NUM ("," NUM)*
+                      NUM: /\d+/
+                      %ignore " "
+                   """
+        texts = ['1, 2', '3', '4,', '5, 6, 7'] * 5
+
+        g = Lark(grammar, parser='lalr')
+        results = list(g.parse_many(texts, workers=2))
+        self.assertEqual(len(results), len(texts))
+        for text, result in zip(texts, results):
+            if text == '4,':
+                self.assertIsInstance(result, UnexpectedToken)
+                self.assertEqual(result.token.type, '$END')
+            else:
+                self.assertEqual(result, g.parse(text))
+
+        g = Lark(grammar, parser='lalr', transformer=_SumTransformer())
+        results = list(g.parse_many(iter(texts), workers=2, chunksize=3))
+        self.assertEqual(results[:2], [3, 3])
+        self.assertEqual(results[-1], 18)
+
+        # Only a bounded number of texts are read ahead, so the input can be endless
+        consumed = []
+        def endless_texts():
+            while True:
+                consumed.append(None)
+                yield '1, 2'
+        results = list(islice(g.parse_many(endless_texts(), workers=2, chunksize=3), 8))
+        self.assertEqual(results, [3] * 8)
+        self.assertTrue(len(consumed) <= 3 * 2 * 3, len(consumed))
+
+        g = Lark(grammar, parser='lalr', transformer=_FailingTransformer())
+        results = list(g.parse_many(texts, workers=2))
+        self.assertEqual(results[:2], [2, 1])
+        error = results[3]
+        self.assertIsInstance(error, WorkerError)
+        self.assertEqual(error.type_name, '_UnpicklableError')
+        self.assertEqual(str(error), '_UnpicklableError: too long')
+        self.assertTrue('raise _UnpicklableError' in error.traceback)
+
+        self.assertRaises(NotImplementedError, Lark(grammar).parse_many, texts)
+
+    def test_iter_parse(self):
+        g = Lark(r"""start: item+
+                     item: NAME "=" value
+                     value: NAME | NUM
+                     NAME: /[a-z]+/
+                     NUM: /\d+/
+                     %ignore " "
+                  """, parser='lalr')
+        events = list(g.iter_parse('a = 1 b = c'))
+        self.assertEqual([(e, p if e == 'shift' else (p[0].origin.name, p[1])) for e, p in events], [
+            ('shift', 'a'), ('shift', '='), ('shift', '1'), ('reduce', ('value', 1)), ('reduce', ('item', 3)),
+            ('reduce', ('__anon_plus_0', 1)),
+            ('shift', 'b'), ('shift', '='), ('shift', 'c'), ('reduce', ('value', 1)), ('reduce', ('item', 3)),
+            ('reduce', ('__anon_plus_0', 2)), ('reduce', ('start', 1)),
+        ])
+        self.assertEqual([t.type for e, t in events if e == 'shift'], ['NAME', 'EQUAL', 'NUM'] + ['NAME', 'EQUAL', 'NAME'])
+
+        # Long inputs are parsed in batches of tokens
+        n = sum(1 for e, p in g.iter_parse('x = 1 ' * 1000) if e == 'reduce' and p[0].origin.name == 'item')
+        self.assertEqual(n, 1000)
+
+        self.assertRaises(UnexpectedToken, list, g.iter_parse('a = = 1'))
+        self.assertRaises(NotImplementedError, Lark('start: "a"').iter_parse, 'a')
+
+    def test_parse_file(self):
+        grammar = r"""start: item*
+                      item: NAME "=" (NUM | STRING) ";"
+                      NAME: /[a-z]+/
+                      NUM: /\d+/
+                      STRING: /"[^"]*"/
+                      COMMENT: /#[^\n]*/
+                      %ignore /\s+/
+                      %ignore COMMENT
+                   """
+        text = u'abc = 12; # caf\xe9\nx="שלום\n" ; yy=3;'
+        temp_dir = tempfile.mkdtemp()
+        try:
+            fn = os.path.join(temp_dir, 'input.txt')
+            with open(fn, 'w', encoding='utf8') as f:
+                f.write(text)
+
+            for parser, lexer in [('lalr', 'standard'), ('lalr', 'contextual'), ('earley', 'standard')]:
+                g = Lark(grammar, parser=parser, lexer=lexer)
+                tree = g.parse_file(fn)
+                self.assertEqual(tree, g.parse(text))
+
+                # Positions are counted in bytes
+                yy = tree.children[2].children[0]
+                self.assertEqual((yy.line, yy.column), (3, 5))
+                self.assertEqual(yy.pos_in_stream, text.encode('utf8').index(b'yy'))
+
+            with open(fn, 'w', encoding='utf8') as f:
+                f.write(u'a = 1;\nb = $;')
+            try:
+                Lark(grammar, parser='lalr').parse_file(fn)
+            except UnexpectedCharacters as e:
+                self.assertEqual((e.pos_in_stream, e.line, e.column), (11, 2, 5))
+            else:
+                self.fail()
+
+            with open(fn, 'w', encoding='utf8') as f:
+                f.write(u'')
+            self.assertEqual(Lark(grammar, parser='lalr').parse_file(fn), Tree('start', []))
+
+            self.assertRaises(NotImplementedError, Lark(grammar).parse_file, fn)
+
+            with open(fn, 'w', encoding='utf8') as f:
+                f.write(u'\xe9')
+            self.assertRaises(LexError, Lark(u'start: "\xe9"', parser='lalr').parse_file, fn)
+
+            # Negated classes match whole characters when repeated, but not one byte of them
+            with open(fn, 'w', encoding='utf8') as f:
+                f.write(u'a \xe9t\xe9 b')
+            g = Lark('start: WORD+\nWORD: /[^ ]+/\n%ignore " "', parser='lalr')
+            self.assertEqual(g.parse_file(fn).children, ['a', u'\xe9t\xe9', 'b'])
+            g = Lark('start: CHAR+\nCHAR: /[^ ]/\n%ignore " "', parser='lalr')
+            self.assertEqual(len(g.parse(u'a \xe9t\xe9 b').children), 5)
+            try:
+                g.parse_file(fn)
+            except UnexpectedCharacters as e:
+                self.assertEqual(e.pos_in_stream, 2)
+            else:
+                self.fail()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_lalr_compact_parse_table(self):
+        from lark.parsers.lalr_analysis import CompactParseTable, IntParseTable
+        g = Lark("""start: a+ b
+                    a: "x" | "y" a
+                    b: "z"
+                 """, parser='lalr')
+        table = g.parser.parser._parse_table
+        self.assertTrue(isinstance(table, CompactParseTable))
+        self.assertTrue(all(isinstance(t, str) and t == t.upper() for t in table.terminals))
+
+        # Round-trip through the dict representation
+        table2 = CompactParseTable.from_ParseTable(IntParseTable(table.states, table.start_states, table.end_states))
+        self.assertEqual(table2.states, table.states)
+
+        try:
+            g.parse('xyz')
+        except UnexpectedToken as e:
+            self.assertEqual(sorted(e.expected), ['X', 'Y'])
+        else:
+            assert False
+
+    def test_earley_lookahead_predictions(self):
+        grammar = """start: stmt+
+                     stmt: NAME "=" expr ";" | "print" expr ";"
+                     ?expr: atom | expr "+" atom
+                     ?atom: NAME | NUMBER | "(" expr ")" | "-" atom
+                     NAME: /[a-z]+/
+                     NUMBER: /[0-9]+/
+                     %ignore " "
+                  """
+        text = "x = 1 + (y + -2); print x;"
+        items = {}
+        for lexer in ('standard', 'dynamic'):
+            g = Lark(grammar, parser='earley', lexer=lexer, profile=True)
+            self.assertEqual(g.parse(text), Lark(grammar, parser='lalr').parse(text))
+            items[lexer] = g.profiler.counters['earley_items']
+
+            # Predictions that were skipped are still reported as expected
+            try:
+                g.parse("x = ;")
+            except UnexpectedInput as e:
+                expected = e.expected if isinstance(e, UnexpectedToken) else e.allowed
+                self.assertEqual(sorted(expected), ['LPAR', 'MINUS', 'NAME', 'NUMBER'])
+            else:
+                assert False
+
+        g = Lark(grammar, parser='earley', lexer='standard', profile=True)
+        g.parser.parser.filter_predictions = False
+        g.parse(text)
+        self.assertTrue(items['standard'] < g.profiler.counters['earley_items'])
+
+    def test_earley_dynamic_match_terms(self):
+        grammar = """start: (kw | word | bref)+
+                     kw: "if" | "in" | "int" | IMPORT
+                     word: NAME | UPPER
+                     bref: /(['"]).*?\\1/
+                     IMPORT: "import"i
+                     NAME: /[a-z]\\w*/
+                     UPPER: /(?=[A-Z])\\w+/
+                     %ignore " "
+                  """
+        g = Lark(grammar, parser='earley', lexer='dynamic')
+        tree = g.parse("if int IMPORT zap X 'a\"' Y")
+        self.assertEqual([t.data for t in tree.children], ['kw', 'kw', 'kw', 'word', 'word', 'bref', 'word'])
+
+        # Matches are looked up by the first character, for each set of expected terminals
+        names = frozenset(['NAME', 'UPPER', 'IMPORT'])
+        self.assertEqual(sorted(g.parser.match_terms(names, "Import", 0)), [('IMPORT', 'Import'), ('UPPER', 'Import')])
+        self.assertEqual(g.parser.match_terms(names, "xyz", 1), [('NAME', 'yz')])
+        self.assertEqual(g.parser.match_terms(names, "xyz", 3), [])
+
+    def test_earley_dynamic_skip_positions(self):
+        grammar = r"""start: item+
+                      item: STRING | COMMENT | NAME
+                      STRING: /"[^"]*"/
+                      COMMENT: /#[^\n]*\n/
+                      NAME: /\w+/
+                      %ignore /\s+/
+                   """
+        text = 'a "long\nstring\nspanning lines" b # a comment\n  c'
+        for lexer in ('dynamic', 'dynamic_complete'):
+            g = Lark(grammar, parser='earley', lexer=lexer, propagate_positions=True)
+            tree = g.parse(text)
+            self.assertEqual([(c.children[0], c.line, c.column, c.end_line, c.end_column) for c in tree.children], [
+                ('a', 1, 1, 1, 2),
+                ('"long\nstring\nspanning lines"', 1, 3, 3, 16),
+                ('b', 3, 17, 3, 18),
+                ('# a comment\n', 3, 19, 3, 31),
+                ('c', 4, 3, 4, 4),
+            ])
+            self.assertTrue(g.recognize(text))
+
+    def test_earley_forest_children_order(self):
+        from lark.grammar import Rule, RuleOptions, NonTerminal, Terminal
+        from lark.lexer import Token
+        from lark.parsers.earley_forest import SymbolNode, ForestSumVisitor
+        a = NonTerminal('a')
+        low = Rule(a, [Terminal('X')], order=0)
+        high = Rule(a, [Terminal('X'), Terminal('X')], order=1, options=RuleOptions(priority=2))
+
+        node = SymbolNode(a, 0, 2)
+        node.add_family(a, low, 0, None, Token('X', 'xx'))
+        self.assertFalse(node.is_ambiguous)
+        node.add_family(a, high, 0, Token('X', 'x'), Token('X', 'x'))
+        self.assertTrue(node.is_ambiguous)
+
+        # The order is kept between accesses, and sorted again once the priorities are known
+        children = node.children
+        self.assertIs(node.children, children)
+        self.assertEqual([c.rule for c in children], [low, high])
+        ForestSumVisitor().visit(node)
+        self.assertEqual([c.rule for c in node.children], [high, low])
+        self.assertEqual(node.priority, 2)
+
+    def test_earley_forest_sum_memoized(self):
+        from lark.parsers.earley_forest import ForestSumVisitor
+        summed = []
+        class CountingSumVisitor(ForestSumVisitor):
+            def visit_packed_node_out(self, node):
+                summed.append(node)
+                return ForestSumVisitor.visit_packed_node_out(self, node)
+
+        g = Lark("""start: e
+                    e: e "+" e | e "*" e | f
+                    f.2: NUMBER
+                    %import common.NUMBER
+                 """, parser='earley')
+        g.parser.parser.forest_sum_visitor = CountingSumVisitor
+        tree = g.parse('+'.join(['1*2'] * 12))
+        self.assertEqual(len(list(tree.find_data('f'))), 24)
+        # Each packed node is summed once, though the forest is walked from every ambiguous node
+        self.assertEqual(len(summed), len(set(map(id, summed))))
+
+    def test_earley_parse_forest(self):
+        grammar = """start: x+
+                     x: a | b | c
+                     a.3: "a"
+                     b.1: "a"
+                     c: "a"
+                  """
+        for lexer in ('standard', 'dynamic'):
+            g = Lark(grammar, parser='earley', lexer=lexer)
+            forest = g.parse_forest('aa')
+            trees = [' '.join(x.children[0].data for x in t.children) for t in forest.iter_trees()]
+            # Best first, by the sum of priorities, then by the order of the rules
+            self.assertEqual(trees, ['a a', 'a b', 'b a', 'a c', 'c a', 'b b', 'b c', 'c b', 'c c'])
+            self.assertEqual(next(forest.iter_trees()), g.parse('aa'))
+            self.assertEqual(len(list(forest.iter_trees(limit=4))), 4)
+
+        g = Lark("""start: e
+                    e: e "+" e | e "*" e | NUMBER
+                    %import common.NUMBER
+                 """, parser='earley')
+        trees = list(g.parse_forest('+'.join(['1*2'] * 4)).iter_trees())
+        self.assertEqual(len(trees), 429)     # The 7th Catalan number
+        self.assertEqual(len(set(trees)), 429)
+
+        # Each derivation is yielded once. With all the tokens kept, they all give different trees
+        grammar = """start: x+
+                     x: "a" | "a" "a" | y
+                     y: "a" "b"?
+                  """
+        for lexer in ('standard', 'dynamic'):
+            g = Lark(grammar, parser='earley', lexer=lexer, keep_all_tokens=True)
+            for text, count in (('a', 2), ('aaa', 12), ('aaaaba', 24)):
+                trees = list(g.parse_forest(text).iter_trees())
+                self.assertEqual(len(trees), count)
+                self.assertEqual(len(set(trees)), count)
+                self.assertEqual(trees[0], g.parse(text))
+            self.assertEqual(len(list(g.parse_forest('aaa').iter_trees(limit=10))), 10)
+
+        # Cyclic derivations are left out
+        for lexer in ('standard', 'dynamic'):
+            g = Lark('start: y\ny: "a" | y', parser='earley', lexer=lexer)
+            self.assertEqual(list(g.parse_forest('a').iter_trees()), [g.parse('a')])
+            g = Lark('start: y\ny: z | "a"\nz: y | "a"', parser='earley', lexer=lexer)
+            trees = list(g.parse_forest('a').iter_trees())
+            self.assertEqual(trees, [Tree('start', [Tree('y', [Tree('z', [])])]), Tree('start', [Tree('y', [])])])
+            self.assertEqual(trees[0], g.parse('a'))
+
+        # The forest is walked without recursion
+        g = Lark("""start: l
+                    l: l "," "a" | "a"
+                 """, parser='earley')
+        tree ,= g.parse_forest(','.join(['a'] * 2000)).iter_trees()
+
+        self.assertRaises(NotImplementedError, Lark('start: "a"', parser='lalr').parse_forest, 'a')
+
+    def test_earley_forest_transformer(self):
+        grammar = """sentence: noun verb noun        -> simple
+                             | noun verb "like" noun -> comparative
+                     noun: adj? NOUN
+                     verb: VERB
+                     adj: ADJ
+                     NOUN: "flies" | "bananas" | "fruit"
+                     VERB: "like" | "flies"
+                     ADJ: "fruit"
+                     %import common.WS
+                     %ignore WS
+                  """
+        g = Lark(grammar, start='sentence', ambiguity='explicit')
+        text = 'fruit flies like bananas'
+        self.assertEqual(g.parse_forest(text).transform(), g.parse(text))
+
+        calls = []
+        class T(Transformer):
+            def num(self, children):
+                calls.append(children[0])
+                return int(children[0])
+            def add(self, children):
+                return children[0] + children[1]
+            def mul(self, children):
+                return children[0] * children[1]
+            def _ambig(self, children):
+                return max(children)
+
+        g = Lark("""start: e
+                    e: e "+" e -> add | e "*" e -> mul | NUMBER -> num
+                    %import common.NUMBER
+                 """, parser='earley')
+        result = g.parse_forest('1+2*3+4').transform(T())
+        self.assertEqual(result, Tree('start', [21]))
+        # Each shared node is transformed once, though it appears in all 5 derivations
+        self.assertEqual(calls, ['1', '2', '3', '4'])
+
+        # A shared '_rule' is inlined into each of its parents, without changing the others
+        grammar = """start: a | b
+                     a: _p Z
+                     b: _p Z
+                     _p: X Y
+                     X: "x"
+                     Y: "y"
+                     Z: "z"
+                  """
+        for lexer in ('standard', 'dynamic'):
+            forest = Lark(grammar, parser='earley', lexer=lexer).parse_forest('xyz')
+            result = forest.transform()
+            self.assertEqual(result, Tree('_ambig', list(forest.iter_trees())))
+            self.assertEqual(result.children[0], Tree('start', [Tree('a', ['x', 'y', 'z'])]))
+            self.assertEqual(result, Lark(grammar, parser='earley', lexer=lexer, ambiguity='explicit').parse('xyz'))
+
+        # Cyclic families are left out, like when parsing
+        for grammar, text in (('start: y\ny: z | "a"\nz: y', 'a'), ('start: y z\ny: z | "a"\nz: y | "a"', 'aa')):
+            for lexer in ('standard', 'dynamic'):
+                g = Lark(grammar, parser='earley', lexer=lexer, ambiguity='explicit')
+                self.assertEqual(g.parse_forest(text).transform(), g.parse(text))
+        g = Lark('start: y z\ny: z | "a"\nz: y | "a"', parser='earley')
+        result = g.parse_forest('aa').transform()
+        self.assertEqual(result, Tree('start', [Tree('_ambig', [Tree('y', [Tree('z', [])]), Tree('y', [])]),
+                                                Tree('_ambig', [Tree('z', [Tree('y', [])]), Tree('z', [])])]))
+
+    def test_earley_beam_width(self):
+        grammar = """start: x+
+                     x: a | b | c
+                     a.3: "a"
+                     b.1: "a"
+                     c: "a"
+                  """
+        for lexer in ('standard', 'dynamic', 'dynamic_complete'):
+            g = Lark(grammar, parser='earley', lexer=lexer, beam_width=2)
+            trees = [' '.join(x.children[0].data for x in t.children) for t in g.parse_forest('aa').iter_trees()]
+            # Only the two best derivations of each x are kept
+            self.assertEqual(trees, ['a a', 'a b', 'b a', 'b b'])
+
+            g = Lark(grammar, parser='earley', lexer=lexer, ambiguity='explicit', beam_width=1)
+            self.assertEqual(g.parse('aa'), Lark(grammar, parser='earley', lexer=lexer).parse('aa'))
+
+        g = Lark("""start: e
+                    e: e "+" e | e "*" e | NUMBER
+                    %import common.NUMBER
+                 """, parser='earley', beam_width=1)
+        tree ,= g.parse_forest('+'.join(['1*2'] * 4)).iter_trees()
+
+        self.assertRaises(ValueError, Lark, grammar, parser='lalr', beam_width=1)
+        self.assertRaises(ValueError, Lark, grammar, parser='earley', beam_width=0)
+
+    def test_parse_budget(self):
+        grammar = """start: e
+                     e: e "+" e | e "*" e | NUMBER
+                     %import common.NUMBER
+                  """
+        text = '+'.join(['1*2'] * 30)
+        for lexer in ('standard', 'dynamic', 'dynamic_complete'):
+            for option in ('max_items', 'max_forest_nodes'):
+                g = Lark(grammar, parser='earley', lexer=lexer, **{option: 500})
+                try:
+                    g.parse(text)
+                except ParseBudgetExceeded as e:
+                    self.assertEqual(e.option, option)
+                    self.assertEqual(e.limit, 500)
+                    self.assertTrue(500 < e.stats[{'max_items': 'earley_items', 'max_forest_nodes': 'forest_nodes'}[option]])
+                    self.assertTrue(0 < e.stats['pos'] < len(text))
+                else:
+                    assert False, (lexer, option)
+                self.assertRaises(ParseBudgetExceeded, g.parse_forest, text)
+                self.assertEqual(g.parse('1+2'), Lark(grammar, parser='earley', lexer=lexer).parse('1+2'))
+
+            g = Lark(grammar, parser='earley', lexer=lexer, timeout=0)
+            self.assertRaises(ParseBudgetExceeded, g.parse, '1')
+
+        g = Lark(grammar, parser='earley', lexer='standard', max_tokens=10)
+        self.assertRaises(ParseBudgetExceeded, g.recognize, text)
+        self.assertTrue(g.recognize('1+2'))
+
+        g = Lark('start: "a"+', parser='lalr', max_tokens=10)
+        self.assertEqual(g.parse('a' * 10), Tree('start', []))
+        try:
+            g.parse('a' * 11)
+        except ParseBudgetExceeded as e:
+            self.assertEqual(e.option, 'max_tokens')
+            self.assertEqual(e.stats['tokens'], 11)
+        else:
+            assert False
+
+        self.assertRaises(ParseBudgetExceeded, list, g.iter_parse('a' * 11))
+        self.assertEqual(len([e for e, _ in g.iter_parse('a' * 10) if e == 'shift']), 10)
+
+        p = g.parse_incremental()
+        p.feed('a' * 6)
+        p.feed('a' * 5)     # The last token is held back until the next chunk
+        self.assertRaises(ParseBudgetExceeded, p.finish)
+        p = g.parse_incremental()
+        p.feed('a' * 6)
+        p.feed('a' * 4)
+        self.assertEqual(p.finish(), Tree('start', []))
+
+        g = Lark('start: "a"+', parser='lalr', timeout=0)
+        self.assertRaises(ParseBudgetExceeded, list, g.iter_parse('a'))
+        def parse_incremental(text):
+            p = g.parse_incremental()
+            p.feed(text)
+            return p.finish()
+        self.assertRaises(ParseBudgetExceeded, parse_incremental, 'aa')
+
+        self.assertRaises(ValueError, Lark, grammar, parser='lalr', max_items=10)
+        self.assertRaises(ValueError, Lark, grammar, parser='earley', lexer='dynamic', max_tokens=10)
+
+    def test_earley_low_memory(self):
+        grammar = """start: stmt+
+                     stmt: NAME "=" expr ";"
+                     ?expr: expr "+" atom | atom
+                     ?atom: NAME | NUMBER | "(" expr ")"
+                     %import common.CNAME -> NAME
+                     %import common.NUMBER
+                     %ignore " "
+                  """
+        text = ' '.join('x%d = (a + %d) + (b + (c + %d));' % (i, i, i) for i in range(100))
+        for lexer in ('standard', 'dynamic', 'dynamic_complete'):
+            g = Lark(grammar, parser='earley', lexer=lexer, profile=True)
+            low = Lark(grammar, parser='earley', lexer=lexer, profile=True, low_memory=True)
+            self.assertEqual(low.parse(text), g.parse(text))
+            # Only the columns of the current statement are kept
+            self.assertTrue(low.profiler.counters['earley_items_peak'] * 10 < g.profiler.counters['earley_items_peak'])
+
+            self.assertTrue(low.recognize(text))
+            self.assertEqual(next(low.parse_forest(text).iter_trees()), g.parse(text))
+            self.assertRaises(UnexpectedInput, low.parse, text + ' )')
+
+    def test_profiler(self):
+        class T(Transformer):
+            def a(self, children):
+                return "<a>"
+
+        g = """start: a+
+                 a: "x" "y"
+                 %ignore " "
+              """
+        l = Lark(g, parser='lalr', profile=True, transformer=T())
+        self.assertEqual(l.parse('xy xy xy').children, ['<a>'] * 3)
+        p = l.profiler
+        self.assertEqual(p.counters['tokens'], 6)
+        self.assertEqual(p.counters['shifts'], 6)
+        self.assertEqual(p.counters['reduces'], 7)   # 3 x a, 3 x a+, start
+        for section in ('lexer', 'parser', 'tree_builder', 'transformer'):
+            self.assertTrue(p.total_time[section] > 0, section)
+
+        p.reset()
+        self.assertEqual(dict(p.counters), {})
+        l.parse('xy')
+        self.assertEqual(p.counters['reduces'], 3)
+
+        l = Lark(g, parser='earley', lexer='standard', profile=True)
+        l.parse('xy xy')
+        self.assertEqual(l.profiler.counters['tokens'], 4)
+        self.assertTrue(l.profiler.counters['earley_items'] > 0)
+        self.assertTrue(l.profiler.total_time['forest_to_tree'] > 0)
+
+        self.assertEqual(Lark(g, parser='lalr').profiler, None)
+
 
 
 def _make_full_earley_test(LEXER):
@@ -301,6 +1091,91 @@ def _make_full_earley_test(LEXER):
             empty_tree = Tree('empty', [Tree('empty2', [])])
             self.assertSequenceEqual(res.children, ['a', empty_tree, empty_tree, 'b'])
 
+        def test_earley_right_recursion(self):
+            # Right-recursive rules are completed with Leo's transitive items
+            grammar = """
+            start: list
+            list: item "," list | item
+            !item: "a" | "a" "a"
+            """
+
+            parser = Lark(grammar, parser='earley', lexer=LEXER)
+            res = parser.parse(','.join(['a'] * 2000)).children[0]
+            depth = 0
+            while len(res.children) > 1:
+                res = res.children[-1]
+                depth += 1
+            self.assertEqual(depth, 1999)
+
+            parser = Lark(grammar, parser='earley', lexer=LEXER, ambiguity='explicit')
+            res = parser.parse('a,aa,a')
+            expected = Tree('start', [Tree('list', [
+                Tree('item', ['a']),
+                Tree('list', [Tree('item', ['a', 'a']), Tree('list', [Tree('item', ['a'])])])
+            ])])
+            self.assertEqual(res, expected)
+
+        def test_earley_ambiguous_right_recursion(self):
+            grammar = """
+            start: x
+            x: "a" x | "a" | y
+            y: "a" "a" | "a" y
+            """
+
+            parser = Lark(grammar, parser='earley', lexer=LEXER, ambiguity='explicit')
+            res = parser.parse('aaa')
+
+            def count_derivations(tree):
+                if not isinstance(tree, Tree):
+                    return 1
+                counts = [count_derivations(child) for child in tree.children]
+                if tree.data == '_ambig':
+                    return sum(counts)
+                product = 1
+                for count in counts:
+                    product *= count
+                return product
+            self.assertEqual(count_derivations(res), 3)
+
+        def test_earley_leo_same_trees(self):
+            # The Leo paths must give the same forest as the regular completer
+            from lark.parsers.earley import Parser as EarleyParser
+
+            def canonical(tree):
+                if not isinstance(tree, Tree):
+                    return tree
+                children = [canonical(child) for child in tree.children]
+                if tree.data == '_ambig':
+                    children.sort(key=repr)
+                return Tree(tree.data, children)
+
+            cases = [
+                ('start: x+\nx: "a" | y\ny: "a" "b"?', ['a', 'aaa', 'aab']),
+                ('start: x+\nx: "a" | "a" "a" | y\ny: "a" "b"?', ['a', 'aaa', 'aaaaba']),
+                ('start: x\nx: "a" x | "a" | y\ny: "a" "a" | "a" y', ['aaa', 'aaaa']),
+                ('start: list\nlist: item "," list | item\n!item: "a" | "a" "a"', ['a,aa,a']),
+            ]
+
+            def parse_all():
+                results = []
+                for grammar, texts in cases:
+                    for ambiguity in ('resolve', 'explicit'):
+                        parser = Lark(grammar, parser='earley', lexer=LEXER, ambiguity=ambiguity)
+                        results += [canonical(parser.parse(text)) for text in texts]
+                return results
+
+            with_leo = parse_all()
+            leo_transitive = EarleyParser.leo_transitive
+            EarleyParser.leo_transitive = lambda self, *args: None
+            try:
+                without_leo = parse_all()
+            finally:
+                EarleyParser.leo_transitive = leo_transitive
+            self.assertEqual(with_leo, without_leo)
+
+            parser = Lark(cases[0][0], parser='earley', lexer=LEXER)
+            self.assertEqual(parser.parse('a'), Tree('start', [Tree('x', [])]))
+
         @unittest.skipIf(LEXER=='standard', "Requires dynamic lexer")
         def test_earley_explicit_ambiguity(self):
             # This was a sneaky bug!
@@ -413,6 +1288,38 @@ def _make_full_earley_test(LEXER):
                 ('c', 'a' ,'t')
             })
 
+        @unittest.skipIf(LEXER!='dynamic_complete', "Only relevant for the dynamic_complete parser")
+        def test_match_prefixes(self):
+            grammar = r"""
+            start: (WORD | QUOTED | NUM | TAG)+
+            WORD: /[a-z]\w*/
+            QUOTED: /'[^']*'/
+            NUM: /\d+(?=!)/
+            TAG: /<[a-z>]+>/
+            """
+            from lark.utils import get_regexp_prefixes
+            self.assertEqual(get_regexp_prefixes(r'[a-z]\w*'), (1, 0, None))
+            self.assertEqual(get_regexp_prefixes(r'(?i:x{2,5})'), (2, 0, None))
+            self.assertEqual(get_regexp_prefixes(r'\w+?'), None)
+            self.assertEqual(get_regexp_prefixes(r'\w+\b'), None)
+            min_width, suffix_width, suffix = get_regexp_prefixes(r'(?i:[a-z]+x)')
+            self.assertEqual((min_width, suffix_width), (2, 1))
+            self.assertTrue(suffix.match('X'))
+            min_width, suffix_width, suffix = get_regexp_prefixes(r'(?i)[a-z]+x')
+            self.assertEqual((min_width, suffix_width), (2, 1))
+            self.assertTrue(suffix.match('X'))
+
+            parser = _Lark(grammar, ambiguity='explicit')
+            self.assertEqual(list(parser.parser.match_prefixes('WORD', 'xabc', 1, 4)), [3, 2])
+            self.assertEqual(list(parser.parser.match_prefixes('QUOTED', "'abc'", 0, 5)), [])
+            self.assertEqual(list(parser.parser.match_prefixes('TAG', "<ab>c>", 0, 6)), [4])
+            # Matched up to each endpos, so look-aheads stop at the end of the prefix
+            self.assertEqual(list(parser.parser.match_prefixes('NUM', "123!", 0, 3)), [])
+
+            tree = parser.parse("ab'c'")
+            self.assertEqual(tree.data, '_ambig')
+            self.assertEqual({tuple(t.children) for t in tree.children}, {('ab', "'c'"), ('a', 'b', "'c'")})
+
         def test_term_ambig_resolve(self):
             grammar = r"""
             !start: NAME+
@@ -479,6 +1386,18 @@ def _make_parser_test(LEXER, PARSER):
 
             self.assertRaises(ParseError, g.parse, 'aaabaa')
 
+        @unittest.skipIf(PARSER == 'lalr', "Only implemented for Earley and CYK")
+        def test_recognize(self):
+            g = _Lark("""start: a+ b a* "b" a*
+                        b: "b"
+                        a: "a" | "a" "a"
+                     """)
+
+            self.assertEqual(g.recognize('aaabaab'), True)
+            self.assertEqual(g.recognize('aaabaaba'), True)
+            self.assertRaises(ParseError, g.recognize, 'aaabaa')
+            self.assertRaises(UnexpectedInput, g.recognize, 'aaabaabx')
+
         def test_basic2(self):
             # Multiple parsers and colliding tokens
             g = _Lark("""start: B A
@@ -1027,6 +1946,17 @@ def _make_parser_test(LEXER, PARSER):
             tree = l.parse("aa")
             self.assertEqual(len(tree.children), 2)
 
+        @unittest.skipIf(PARSER != 'earley', "Only Earley supports cyclic grammars")
+        def test_unit_cycle(self):
+            for grammar in ('start: y\ny: y | "a"', 'start: y\ny: "a" | y', 'start: y\ny: z | "a"\nz: y'):
+                for ambiguity in ('resolve', 'explicit'):
+                    l = _Lark(grammar, ambiguity=ambiguity)
+                    self.assertEqual(l.parse('a'), Tree('start', [Tree('y', [])]))
+
+            # Both derivations of y are found, but not the cyclic ones
+            l = _Lark('start: y\ny: z | "a"\nz: y | "a"', ambiguity='explicit')
+            self.assertEqual(l.parse('a'), Tree('start', [Tree('_ambig', [Tree('y', [Tree('z', [])]), Tree('y', [])])]))
+
 
         @unittest.skipIf(LEXER != 'standard', "Only standard lexers care about token priority")
         def test_lexer_prioritization(self):
@@ -18,11 +18,11 @@ class TestStandalone(TestCase):
     def setUp(self):
         pass
 
-    def _create_standalone(self, grammar):
+    def _create_standalone(self, grammar, compile=False):
         code_buf = StringIO()
         temp = sys.stdout
         sys.stdout = code_buf
-        standalone.main(StringIO(grammar), 'start')
+        standalone.main(StringIO(grammar), 'start', compile)
         sys.stdout = temp
         code = code_buf.getvalue()
 
@@ -50,6 +50,11 @@ class TestStandalone(TestCase):
         x = l.parse('16 candles')
         self.assertEqual(x.children, ['16', 'candles'])
 
+        # Neither the cache nor parse_many are part of the standalone parser
+        self.assertFalse(hasattr(_Lark, '_save_cache'))
+        self.assertFalse(hasattr(_Lark, 'parse_many'))
+        self.assertFalse('_parse_in_worker' in context)
+
     def test_contextual(self):
         grammar = """
         start: a b
@@ -102,6 +107,36 @@ class TestStandalone(TestCase):
         x = l.parse('(\n)\n')
         self.assertEqual(x, Tree('start', []))
 
+    def test_compiled(self):
+        grammar = r"""
+            start: item+ _tail?
+            ?item: NUMBER | "(" item ")" | pair | _group
+            pair: WORD "=" item
+            _group: "[" item* "]"
+            _tail: ";" WORD
+            %import common.NUMBER
+            %import common.WORD
+            %import common.WS
+            %ignore WS
+        """
+        texts = ['1 2 3', '((4)) [5 6] x=7; end', 'a=b=(8) []']
+
+        interpreted = self._create_standalone(grammar)['Lark_StandAlone']()
+        context = self._create_standalone(grammar, compile=True)
+        compiled = context['Lark_StandAlone']()
+        for text in texts:
+            self.assertEqual(compiled.parse(text), interpreted.parse(text))
+
+        class T(context['Transformer']):
+            def pair(self, items):
+                return (items[0], items[1])
+            start = list
+        x = context['Lark_StandAlone'](transformer=T()).parse('x=1 2')
+        self.assertEqual(x, [('x', '1'), '2'])
+
+        self.assertRaises(context['UnexpectedToken'], compiled.parse, '1 ;')
+        self.assertRaises(context['UnexpectedToken'], compiled.parse, '(1')
+
 
 
 if __name__ == '__main__':